@@ -2,13 +2,16 @@ import os
 import time
 import math
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, parent_process
 from scipy.sparse.csgraph import minimum_spanning_tree
-from openpyxl import Workbook
 from distance_finder import travel_times_matrix, calculate_total_distance
-from feasibility import is_feasible
+from feasibility import RouteState
 from file_reader import read_txt_file
-from file_writer import save_to_excel
+from file_writer import save_to_excel, new_result_workbook
 from visualization import save_routes_plot_in_folder
+from solution_store import export_solutions
+from batch_runner import imap_in_pool
 
 
 output_filename = '1-constructive-heuristics/results/VRPTW_th_ACO.xlsx'  # Output file path for storing results
@@ -20,7 +23,9 @@ aco_params = {
     'alpha': 1.5,          # Influence of the pheromone on decision making
     'beta': 2.0,           # Influence of the distance (visibility) on decision making
     'rho': 0.7,            # Evaporation factor for pheromones
-    'Q': 10.0              # Amount of pheromone deposited by ants after finding a solution
+    'Q': 10.0,             # Amount of pheromone deposited by ants after finding a solution
+    'workers': 1           # Processes sharing the ants of each iteration (1 builds the whole colony here); only used when
+                           # the instances run serially (processes=1), inside the instance pool it is forced to 1
 }
 
 def lower_bound_routes(customers, vehicle_capacity):
@@ -42,11 +47,8 @@ def lower_bound_mst(depot, customers, distance_matrix):
     :return: Lower bound on the total distance.
     """
     nodes = [depot] + customers  # Combine depot and customers
-    n = len(nodes)
-    full_matrix = np.zeros((n, n))  # Create a full distance matrix
-    for i in range(n):
-        for j in range(n):
-            full_matrix[i, j] = distance_matrix[nodes[i].index][nodes[j].index]  # Populate distance matrix between nodes
+    indexes = [node.index for node in nodes]
+    full_matrix = np.asarray(distance_matrix)[np.ix_(indexes, indexes)]  # Pick the sub-matrix of these nodes in one step
     
     # Calculate the Minimum Spanning Tree (MST) from the distance matrix
     mst = minimum_spanning_tree(full_matrix).toarray()
@@ -79,9 +81,159 @@ def update_pheromones(pheromones, all_routes, Q, rho):
                 # Increase pheromone between consecutive nodes on the route
                 pheromones[route[i].index][route[i + 1].index] += Q / distance
 
-def aco_vrptw(nodes, capacity, times, num_ants, num_iterations, alpha, beta, rho, Q):
+def visibility_matrix(times, beta):
+    """
+    Heuristic part of the transition weights, constant for the whole run.
+    :param times: Matrix of travel times between nodes.
+    :param beta: Weight of distances (visibility).
+    :return: Matrix with (1 / travel_time) ** beta (zero travel times count as 1e-6).
+    """
+    times = np.asarray(times, dtype=float)
+    return (1 / np.where(times > 0, times, 1e-6)) ** beta
+
+def construct_ant_solutions(weights, times, demands, inf, sup, t_serv, capacity, num_ants, rng):
+    """
+    Build the solutions of a whole colony in lockstep: every step each unfinished ant either moves to a
+    feasible customer (sampled proportionally to its row of weights) or returns to the depot.
+    :param weights: Transition weights pheromone ** alpha * visibility ** beta for this iteration.
+    :param times: Matrix of travel times between nodes (NumPy array).
+    :param demands: Demand of each node (NumPy array, depot at index 0).
+    :param inf: Start of the time window of each node.
+    :param sup: End of the time window of each node.
+    :param t_serv: Service time of each node.
+    :param capacity: Vehicle capacity.
+    :param num_ants: Number of ants.
+    :param rng: NumPy random Generator used for the sampling.
+    :return: Array (num_ants x steps) with the visited node of each ant per step, routes separated by the
+             depot (0) and padded with -1 once the ant has finished.
+    """
+    num_nodes = len(demands)
+    ants = np.arange(num_ants)
+    current = np.zeros(num_ants, dtype=np.intp)  # Node where each ant stands
+    load = np.zeros(num_ants)  # Load of the route each ant is building
+    clock = np.zeros(num_ants)  # Time at which each ant leaves its current node
+    unvisited = np.ones((num_ants, num_nodes), dtype=bool)
+    unvisited[:, 0] = False
+    steps = [current.copy()]  # Every ant starts at the depot
+
+    active = np.ones(num_ants, dtype=bool)
+    while active.any():
+        # Feasible customers of every ant: not visited yet, fit in the vehicle and reached before the window closes
+        arrival = clock[:, None] + times[current]
+        feasible = unvisited & (load[:, None] + demands <= capacity) & (arrival <= sup)
+        feasible[~active] = False
+        can_move = feasible.any(axis=1)
+
+        # Ants without a feasible customer that are still on the road go back to the depot
+        back = active & ~can_move & (current != 0)
+        # Ants at the depot with nothing feasible either finished or met customers no vehicle can serve
+        stuck = active & ~can_move & (current == 0)
+        if unvisited[stuck].any():
+            raise ValueError("Some customers cannot be served by any route (capacity or time window)")
+        active &= ~stuck
+
+        # Roulette wheel on the masked rows of weights (uniform when every weight underflows to zero)
+        movers = ants[can_move]
+        masked = np.where(feasible[movers], weights[current[movers]], 0.0)
+        empty = masked.sum(axis=1) <= 0
+        masked[empty] = feasible[movers][empty]
+        cumulative = np.cumsum(masked, axis=1)
+        threshold = rng.random(len(movers)) * cumulative[:, -1]
+        chosen = np.argmax(cumulative > threshold[:, None], axis=1)
+
+        # Advance the moving ants
+        start = np.maximum(arrival[movers, chosen], inf[chosen])
+        clock[movers] = start + t_serv[chosen]
+        load[movers] += demands[chosen]
+        unvisited[movers, chosen] = False
+        current[movers] = chosen
+
+        # Reset the returning ants for a new route
+        current[back] = 0
+        load[back] = 0
+        clock[back] = 0
+
+        step = np.full(num_ants, -1, dtype=np.intp)
+        step[movers] = chosen
+        step[back] = 0
+        steps.append(step)
+
+    return np.stack(steps, axis=1)
+
+def sequence_distances(sequences, times):
+    """
+    Total travelled distance of each ant.
+    :param sequences: Output of construct_ant_solutions.
+    :param times: Matrix of travel times between nodes (NumPy array).
+    :return: Array with the distance of each ant.
+    """
+    origins, destinations = sequences[:, :-1], sequences[:, 1:]
+    valid = destinations >= 0
+    return np.where(valid, times[origins, np.where(valid, destinations, 0)], 0.0).sum(axis=1)
+
+def sequence_to_routes(sequence, nodes):
+    """
+    Split the step sequence of one ant into routes of Node objects, each starting and ending at the depot.
+    """
+    sequence = sequence[sequence >= 0]
+    depots = np.flatnonzero(sequence == 0)
+    return [[nodes[index] for index in sequence[depots[k]:depots[k + 1] + 1]] for k in range(len(depots) - 1)]
+
+def update_pheromones_from_sequences(pheromones, sequences, distances, Q, rho):
+    """
+    Same update as update_pheromones for the step sequences of a colony, in one vectorized pass.
+    :param pheromones: Current pheromone matrix.
+    :param sequences: Output of construct_ant_solutions.
+    :param distances: Total distance of each ant.
+    :param Q: Constant controlling pheromone deposition.
+    :param rho: Evaporation rate for pheromones.
+    """
+    pheromones *= (1 - rho)  # Evaporate pheromones by multiplying by (1 - rho)
+    origins, destinations = sequences[:, :-1], sequences[:, 1:]
+    valid = destinations >= 0
+    deposits = np.broadcast_to((Q / distances)[:, None], valid.shape)
+    np.add.at(pheromones, (origins[valid], destinations[valid]), deposits[valid])  # Repeated arcs accumulate
+
+# State of an ant worker process, filled once by init_ant_worker
+ant_worker = {}
+
+def init_ant_worker(shm_name, times, demands, inf, sup, t_serv, capacity, alpha, beta):
+    """
+    Attach a worker process to the shared pheromone matrix and keep the read-only instance data.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ant_worker['shm'] = shm  # Keep the segment open while the view is alive
+    ant_worker['pheromones'] = np.ndarray(times.shape, dtype=np.float64, buffer=shm.buf)  # No copy of the matrix
+    ant_worker['visibility'] = visibility_matrix(times, beta)
+    ant_worker['instance'] = (times, demands, inf, sup, t_serv, capacity)
+    ant_worker['alpha'] = alpha
+
+def build_ant_share(task):
+    """
+    Build the solutions of a share of the colony from the current pheromone snapshot.
+    :param task: Tuple (number of ants, SeedSequence of this worker for this iteration).
+    :return: Step sequences as returned by construct_ant_solutions.
+    """
+    num_ants, seed_sequence = task
+    weights = ant_worker['pheromones'] ** ant_worker['alpha'] * ant_worker['visibility']
+    rng = np.random.default_rng(seed_sequence)
+    return construct_ant_solutions(weights, *ant_worker['instance'], num_ants, rng)
+
+def stack_sequences(shares):
+    """
+    Join the step sequences of several shares of the colony, padding the shorter ones with -1.
+    """
+    steps = max(share.shape[1] for share in shares)
+    return np.vstack([np.pad(share, ((0, 0), (0, steps - share.shape[1])), constant_values=-1) for share in shares])
+
+def aco_vrptw(nodes, capacity, times, num_ants, num_iterations, alpha, beta, rho, Q, seed=None, workers=1):
     """
     Ant Colony Optimization (ACO) algorithm for VRPTW.
+    The colony of each iteration is built in lockstep by construct_ant_solutions on one weight matrix.
+    With workers > 1 the ants are split among worker processes that read the pheromone matrix from shared
+    memory; each worker draws from SeedSequence([seed, iteration, worker]) and this process does the update,
+    so a run is reproducible for a given seed and number of workers. Do not use workers > 1 from a process of
+    another pool (e.g. solve_instance under imap_in_pool): each worker would start its own nested pool.
     :param nodes: List of nodes (depot + customers).
     :param capacity: Vehicle capacity.
     :param times: Matrix of travel times between nodes.
@@ -91,99 +243,118 @@ def aco_vrptw(nodes, capacity, times, num_ants, num_iterations, alpha, beta, rho
     :param beta: Weight of distances (visibility).
     :param rho: Pheromone evaporation rate.
     :param Q: Amount of pheromone deposited by ants.
+    :param seed: Seed of the random generator (None for fresh entropy).
+    :param workers: Number of processes building the ants of each iteration.
     :return: Best routes found and their total distance.
     """
+    rng = np.random.default_rng(seed)
+    times = np.asarray(times, dtype=float)
+    demands = np.array([node.q for node in nodes], dtype=float)
+    inf = np.array([node.inf for node in nodes], dtype=float)
+    sup = np.array([node.sup for node in nodes], dtype=float)
+    t_serv = np.array([node.t_serv for node in nodes], dtype=float)
+
     num_nodes = len(nodes)
     pheromones = initialize_pheromones(num_nodes, times)  # Initialize pheromone matrix
-    best_routes = None
+    visibility = visibility_matrix(times, beta)
+    best_sequence = None
     best_distance = float('inf')  # Start with the best distance as infinity
 
-    for iteration in range(num_iterations):  # Repeat for the specified number of iterations
-        all_routes = []
-        for ant in range(num_ants):  # Each ant finds a solution
-            depot = nodes[0]
-            customers = set(range(1, num_nodes))  # Set of customer indices (excluding depot)
-            routes = []
-
-            while customers:  # While there are still customers left to visit
-                route = [depot]
-                current_load = 0
-
-                while True:
-                    # Find feasible customers based on vehicle capacity and time windows
-                    feasible_customers = [cust for cust in customers if is_feasible(route, nodes[cust], capacity, times)]
-                    if not feasible_customers:
-                        break
-
-                    # Calculate probabilities based on pheromone levels and visibility (distance)
-                    probabilities = []
-                    for cust in feasible_customers:
-                        pheromone = pheromones[route[-1].index][cust]
-                        travel_time = times[route[-1].index][cust]
-                        visibility = 1 / (travel_time if travel_time > 0 else 1e-6)  # Avoid division by zero
-                        probabilities.append((pheromone ** alpha) * (visibility ** beta))
-
-                    total_prob = sum(probabilities)
-                    # Normalize probabilities or choose uniformly if all probabilities are zero
-                    probabilities = np.array(probabilities) / total_prob if total_prob > 0 else np.ones(len(feasible_customers)) / len(feasible_customers)
-
-                    # Randomly select the next customer based on the calculated probabilities
-                    next_customer_index = np.random.choice(feasible_customers, p=probabilities)
-                    next_customer = nodes[next_customer_index]
-
-                    # Check if adding the next customer exceeds the vehicle's capacity
-                    if current_load + next_customer.q <= capacity:
-                        route.append(next_customer)
-                        current_load += next_customer.q
-                        customers.remove(next_customer_index)  # Remove the customer from the list
-                    else:
-                        break
-
-                route.append(depot)  # Return to the depot at the end of the route
-                routes.append(route)
-
-            total_distance = sum(calculate_total_distance([route], times) for route in routes)  # Calculate the total distance for all routes
-            all_routes.append((routes, total_distance))
-
-            # Update the best solution if this one is better
-            if total_distance < best_distance:
-                best_distance = total_distance
-                best_routes = routes
-
-        # Update pheromone levels after all ants have finished
-        update_pheromones(pheromones, all_routes, Q, rho)
-
-    return best_routes, best_distance  # Return the best routes and distance
-
-def vrptw_solver(directory_path, output_filename):
+    shm = executor = None
+    if workers > 1:
+        # Move the pheromone matrix to shared memory, the workers map the same buffer
+        shm = shared_memory.SharedMemory(create=True, size=pheromones.nbytes)
+        shared = np.ndarray(pheromones.shape, dtype=np.float64, buffer=shm.buf)
+        shared[:] = pheromones
+        pheromones = shared
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_ant_worker,
+                                       initargs=(shm.name, times, demands, inf, sup, t_serv, capacity, alpha, beta))
+        base_seed = seed if seed is not None else np.random.SeedSequence().entropy
+        shares = [len(share) for share in np.array_split(np.arange(num_ants), workers) if len(share)]
+
+    try:
+        for iteration in range(num_iterations):  # Repeat for the specified number of iterations
+            if executor is None:
+                weights = pheromones ** alpha * visibility  # Transition weights shared by every ant of the iteration
+                sequences = construct_ant_solutions(weights, times, demands, inf, sup, t_serv, capacity, num_ants, rng)
+            else:
+                tasks = [(ants, np.random.SeedSequence([base_seed, iteration, worker])) for worker, ants in enumerate(shares)]
+                sequences = stack_sequences(list(executor.map(build_ant_share, tasks)))  # Worker order is fixed
+            distances = sequence_distances(sequences, times)
+
+            # Update the best solution if this colony found a better one
+            ant = int(np.argmin(distances))
+            if distances[ant] < best_distance:
+                best_distance = distances[ant]
+                best_sequence = sequences[ant].copy()
+
+            # Update pheromone levels after all ants have finished (workers are idle until the next map)
+            update_pheromones_from_sequences(pheromones, sequences, distances, Q, rho)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+            del pheromones, shared  # Release the views before closing the segment
+            shm.close()
+            shm.unlink()
+
+    best_routes = sequence_to_routes(best_sequence, nodes)
+    return best_routes, calculate_total_distance(best_routes, times)  # Return the best routes and distance
+
+def solve_instance(i, directory_path, seed=None):
     """
-    ACO-based solution for VRPTW with lower bound and GAP calculation, and saves results.
+    Solve one VRPTW instance with ACO (runs inside a worker process).
+    :param i: Number of the instance (VRPTWi.txt).
     :param directory_path: Path to the input files.
-    :param output_filename: Path to save the output results (Excel file).
+    :param seed: Base random seed, each instance uses seed + i (None draws fresh entropy).
+    :return: Dictionary with the routes, distances, lower bounds and execution time of the instance.
     """
-    wb = Workbook()  # Initialize the Excel workbook
-    wb.remove(wb.active)
+    filename = f'{directory_path}/VRPTW{i}.txt'
+    file_start_time = time.time()  # Start timing the computation for this instance
 
-    execution_times = []  # List to store the execution time for each instance
+    # Read the instance file and calculate the travel times
+    n, Q, nodes = read_txt_file(filename)
+    times = travel_times_matrix(nodes)
 
-    for i in range(1, 19):  # Loop through all instances from VRPTW1 to VRPTW18
-        filename = f'{directory_path}/VRPTW{i}.txt'
-        file_start_time = time.time()  # Start timing the computation for this instance
+    depot = nodes[0]
+    customers = nodes[1:]
 
-        # Read the instance file and calculate the travel times
-        n, Q, nodes = read_txt_file(filename)
-        times = travel_times_matrix(nodes)
+    # Calculate lower bounds for routes and distance
+    lb_routes = lower_bound_routes(customers, Q)
+    lb_distance = lower_bound_mst(depot, customers, times)
 
-        depot = nodes[0]
-        customers = nodes[1:]
+    # Apply ACO to find the best routes and distance
+    params = dict(aco_params)
+    if parent_process() is not None:
+        params['workers'] = 1  # Already inside a worker of the instance pool, no nested pool of ants
+    routes, best_distance = aco_vrptw(nodes, Q, times, seed=None if seed is None else seed + i, **params)
+    computation_time = (time.time() - file_start_time) * 1000  # Execution time in milliseconds
 
-        # Calculate lower bounds for routes and distance
-        lb_routes = lower_bound_routes(customers, Q)
-        lb_distance = lower_bound_mst(depot, customers, times)
+    return {'i': i, 'filename': filename, 'routes': routes, 'distance': best_distance, 'time': computation_time,
+            'times': times, 'route_states': [RouteState(route, times, Q) for route in routes],
+            'lb_routes': lb_routes, 'lb_distance': lb_distance}
+
+def vrptw_solver(directory_path, output_filename, processes=None):
+    """
+    ACO-based solution for VRPTW with lower bound and GAP calculation, and saves results.
+    :param directory_path: Path to the input files.
+    :param output_filename: Path to save the output results (Excel file).
+    :param processes: Number of worker processes for the instances (None uses every core, 1 runs serially).
+    """
+    wb = new_result_workbook()  # Write-only workbook, each sheet is streamed as it is written
 
-        # Apply ACO to find the best routes and distance
-        routes, best_distance = aco_vrptw(nodes, Q, times, **aco_params)
-        computation_time = (time.time() - file_start_time) * 1000  # Execution time in milliseconds
+    execution_times = []  # List to store the execution time for each instance
+    solutions = {}  # Sheet name -> routes, distance and time, saved with solution_store
+
+    # Solve all instances from VRPTW1 to VRPTW18 in parallel, results are exported as they arrive
+    wall_start_time = time.time()
+    results = imap_in_pool(solve_instance, range(1, 19), processes, directory_path=directory_path)
+
+    for result in results:
+        routes = result['routes']
+        best_distance = result['distance']
+        computation_time = result['time']
+        lb_routes = result['lb_routes']
+        lb_distance = result['lb_distance']
         execution_times.append(computation_time)
 
         # Calculate the GAP for the number of routes and distance
@@ -192,7 +363,7 @@ def vrptw_solver(directory_path, output_filename):
         gap_distance = max(((best_distance - lb_distance) / lb_distance) * 100 if lb_distance > 0 else 0, 0)
 
         # Print the solution details
-        print(f"Solution for {filename}:")
+        print(f"Solution for {result['filename']}:")
         print(f"  - Total Distance = {best_distance}")
         print(f"  - Lower Bound Distance (MST) = {lb_distance:.2f}")
         print(f"  - GAP Distance = {gap_distance:.2f}%")
@@ -202,18 +373,23 @@ def vrptw_solver(directory_path, output_filename):
         print(f"  - Execution Time = {computation_time:.0f} ms\n")
 
         # Save results to Excel
-        sheet_name = f'VRPTW{i}'
-        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, times)
+        sheet_name = f'VRPTW{result["i"]}'
+        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, result['times'], result['route_states'])
+        solutions[sheet_name] = {'routes': routes, 'distance': best_distance, 'time': computation_time}  # Same results in binary form
 
         # Save the plot of routes
         save_routes_plot_in_folder(routes, f"{sheet_name}.png", folder='1-constructive-heuristics/figures/aco')
 
     # Save the Excel workbook with all results
     wb.save(output_filename)
+    export_solutions('ACO', solutions)  # Binary copy read by the later stages (fast to load)
 
     total_elapsed_time = sum(execution_times)  # Calculate total execution time
+    wall_elapsed_time = (time.time() - wall_start_time) * 1000  # Wall-clock time of the whole batch
     print(f"\nTotal execution time: {total_elapsed_time:.0f} ms")  # Display total execution time
+    print(f"Wall-clock time: {wall_elapsed_time:.0f} ms")
 
 
-# Execute the ACO solution with lower bound and GAP calculation
-vrptw_solver('VRPTW Instances', output_filename)
+# Execute the ACO solution with lower bound and GAP calculation (the guard keeps worker processes from running it again)
+if __name__ == "__main__":
+    vrptw_solver('VRPTW Instances', output_filename)
@@ -5,14 +5,32 @@ import numpy as np
 def dist(n1, n2):
     return math.sqrt((n1.x - n2.x) ** 2 + (n1.y - n2.y) ** 2)
 
+# Build the full Euclidean distance matrix from coordinate arrays in a single batched operation
+def build_distance_matrix(x, y, dtype=np.float64, storage='symmetric'):
+    """
+    Compute every pairwise Euclidean distance at once.
+    :param x: Array-like of X-coordinates, one per node (in node index order).
+    :param y: Array-like of Y-coordinates, one per node (in node index order).
+    :param dtype: np.float64 (same values as dist) or np.float32 (half the memory).
+    :param storage: 'symmetric' for the full n x n matrix, 'upper' to keep only the upper triangle (zeros below the diagonal).
+    :return: Matrix of distances between all nodes.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    dx = x[:, None] - x[None, :]  # Pairwise X differences (n x n)
+    dy = y[:, None] - y[None, :]  # Pairwise Y differences (n x n)
+    matrix = np.sqrt(dx ** 2 + dy ** 2)  # Same operations as dist, so float64 results match it bit for bit
+    if storage == 'upper':
+        matrix = np.triu(matrix)
+    elif storage != 'symmetric':
+        raise ValueError(f"Unknown storage '{storage}', use 'symmetric' or 'upper'")
+    return matrix.astype(dtype, copy=False)
+
 # Generate a matrix of travel times (or distances) between all nodes
-def travel_times_matrix(nodes):
-    n = len(nodes)
-    travel_times = np.zeros((n, n))  # Initialize an empty matrix of size n x n
-    for i in range(n):
-        for j in range(n):
-            travel_times[i][j] = dist(nodes[i], nodes[j])  # Compute distance between nodes i and j
-    return travel_times
+def travel_times_matrix(nodes, dtype=np.float64, storage='symmetric'):
+    x = [node.x for node in nodes]  # Nodes are stored in index order, so row i is node i
+    y = [node.y for node in nodes]
+    return build_distance_matrix(x, y, dtype=dtype, storage=storage)
 
 # Calculate the total distance of a single route, given the travel times matrix
 def calculate_route_distance(route, times):
@@ -35,4 +53,5 @@ def calculate_min_max_times(nodes):
 
 # Calculate the minimum and maximum distances between nodes from the travel time matrix
 def calculate_min_max_distances(times):
-    return min(min(row) for row in times), max(max(row) for row in times)  # Return minimum and maximum values from the matrix
+    times = np.asarray(times)
+    return times.min(), times.max()  # Return minimum and maximum values from the matrix in one pass each
@@ -1,5 +1,9 @@
+import numpy as np
+
 # Define a class for representing a Node (or customer) in the VRPTW problem
 class Node:
+    __slots__ = ('index', 'x', 'y', 'q', 'inf', 'sup', 't_serv')  # No per-node __dict__: smaller objects and faster attribute access
+
     def __init__(self, index, x, y, q, inf, sup, t_serv):
         """
         Initialize a node with the following attributes:
@@ -19,27 +23,68 @@ class Node:
         self.sup = sup      # Latest allowable arrival time (time window end)
         self.t_serv = t_serv  # Time required to serve this node
 
-# Function to read input data from a text file and create a list of nodes
-def read_txt_file(file_path):
+# Define a class that stores a whole instance as one NumPy array per attribute (structure of arrays)
+class Instance:
+    def __init__(self, capacity, index, x, y, q, inf, sup, t_serv):
+        """
+        Initialize an instance from per-node arrays, all indexed by node index (position 0 is the depot).
+        :param capacity: Vehicle capacity.
+        :param index: Node ids, as read from the first column of the file.
+        :param x: X-coordinates.
+        :param y: Y-coordinates.
+        :param q: Demands.
+        :param inf: Time window lower bounds.
+        :param sup: Time window upper bounds.
+        :param t_serv: Service times.
+        """
+        self.capacity = capacity
+        self.index = np.asarray(index)
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.q = np.asarray(q)
+        self.inf = np.asarray(inf)
+        self.sup = np.asarray(sup)
+        self.t_serv = np.asarray(t_serv)
+        self._nodes = None
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def nodes(self):
+        """
+        Thin Node views over the arrays, for the code that works with Node objects (built once per instance).
+        """
+        if self._nodes is None:
+            columns = [self.x.tolist(), self.y.tolist(), self.q.tolist(), self.inf.tolist(), self.sup.tolist(), self.t_serv.tolist()]
+            self._nodes = [Node(*values) for values in zip(self.index.tolist(), *columns)]
+        return self._nodes
+
+# Function to read an instance file directly into arrays
+def read_instance(file_path):
     """
-    Read a text file that describes the VRPTW problem and extract nodes.
+    Read a text file that describes the VRPTW problem into an Instance.
     :param file_path: Path to the input file.
-    :return: Number of nodes (n), vehicle capacity (Q), and a list of Node objects.
+    :return: Number of nodes (n) and the Instance.
     """
     with open(file_path, 'r') as file:
-        lines = file.readlines()  # Read all lines from the file
-
         # First line contains the number of nodes (n) and vehicle capacity (Q)
-        first_line = lines[0].strip().split()
-        n = int(first_line[0])  # Number of nodes
-        Q = int(first_line[1])  # Vehicle capacity
+        first_line = file.readline().strip().split()
 
-        nodes = []  # Initialize an empty list to store Node objects
+        # Remaining lines: one row per node with index, x, y, q, inf, sup, t_serv (row i is node i)
+        data = np.loadtxt(file, dtype=np.int64, ndmin=2)
 
-        # For each line representing a node, create a Node object and append it to the list
-        for line in lines[1:]:
-            parts = list(map(int, line.strip().split()))  # Convert each line into a list of integers
-            node = Node(parts[0], parts[1], parts[2], parts[3], parts[4], parts[5], parts[6])
-            nodes.append(node)  # Add the node to the list
+    if not np.array_equal(data[:, 0], np.arange(len(data))):
+        raise ValueError(f"Node ids in {file_path} must be 0, 1, ..., n in row order")  # Distance matrices are indexed by row
+    instance = Instance(int(first_line[1]), data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4], data[:, 5], data[:, 6])
+    return int(first_line[0]), instance
 
-    return n, Q, nodes  # Return the number of nodes, vehicle capacity, and list of nodes
+# Function to read input data from a text file and create a list of nodes
+def read_txt_file(file_path):
+    """
+    Read a text file that describes the VRPTW problem and extract nodes.
+    :param file_path: Path to the input file.
+    :return: Number of nodes (n), vehicle capacity (Q), and a list of Node objects.
+    """
+    n, instance = read_instance(file_path)
+    return n, instance.capacity, instance.nodes  # Return the number of nodes, vehicle capacity, and list of nodes
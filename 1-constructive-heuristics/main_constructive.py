@@ -3,12 +3,13 @@ import time  # Used to measure execution time
 import math  # Mathematical functions like ceiling
 import numpy as np  # For numerical operations and matrix manipulation
 from scipy.sparse.csgraph import minimum_spanning_tree  # To compute the minimum spanning tree (MST)
-from openpyxl import Workbook  # To write results into Excel files
 from distance_finder import travel_times_matrix, calculate_total_distance  # Helper functions to compute distances
-from feasibility import is_feasible  # Check feasibility of routes (capacity and time window constraints)
 from file_reader import read_txt_file  # Read the input data files
-from file_writer import save_to_excel  # Save results into an Excel file
+from file_writer import save_to_excel, new_result_workbook  # Save results into an Excel file
+from feasibility import RouteState  # Schedule of every route, kept by the construction and read by the Excel export
 from visualization import save_routes_plot_in_folder  # To generate and save visualizations of the routes
+from solution_store import export_solutions  # Binary copy of the results
+from batch_runner import imap_in_pool  # Solve the instances in parallel worker processes
 
 # Constants used for customer selection based on weighted criteria
 c_distance = 0.5  # Weight for distance
@@ -40,13 +41,10 @@ def lower_bound_mst(depot, customers, distance_matrix):
     :return: Lower bound on the total distance using MST.
     """
     nodes = [depot] + customers  # Combine the depot and customer nodes to form the full graph
-    n = len(nodes)  # Total number of nodes
 
     # Create a distance matrix for all nodes
-    full_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            full_matrix[i, j] = distance_matrix[nodes[i].index][nodes[j].index]  # Fill the matrix with distances
+    indexes = [node.index for node in nodes]
+    full_matrix = np.asarray(distance_matrix)[np.ix_(indexes, indexes)]  # Pick the sub-matrix of these nodes in one step
 
     # Compute the MST of the full graph and sum its edges to get the lower bound distance
     mst = minimum_spanning_tree(full_matrix).toarray()
@@ -55,69 +53,121 @@ def lower_bound_mst(depot, customers, distance_matrix):
     return mst_distance  # Return the MST-based lower bound on total distance
 
 # Function to perform constructive route selection based on capacity and time windows
-def constructive_route_selection(nodes, capacity, times):
+def constructive_route_selection(nodes, capacity, times, return_states=False):
+    """
+    Build routes one at a time, appending the feasible customer with the lowest weighted score
+    c_distance * travel time from the last node + c_inf * inf + c_sup * sup.
+    The unrouted customers are a boolean mask (O(1) removal) and each route keeps the candidates still
+    reachable: the vehicle only leaves later and, with triangle inequality, arrives later at every other
+    customer, so a customer that misses its window (or no longer fits) stays out until the route closes.
+    :param nodes: List of nodes (depot + customers), node i at position i.
+    :param capacity: Maximum capacity of a single vehicle.
+    :param times: Matrix of travel times between nodes.
+    :param return_states: Also return the RouteState that scheduled each route while it was built.
+    :return: List of routes, each starting and ending at the depot (and their RouteStates if return_states).
+    """
     depot = nodes[0]  # The depot node (starting point and end point of all routes)
-    customers = nodes[1:]  # All other nodes are customer nodes
+    times = np.asarray(times, dtype=float)
+    demands = np.array([node.q for node in nodes], dtype=float)
+    inf = np.array([node.inf for node in nodes], dtype=float)
+    sup = np.array([node.sup for node in nodes], dtype=float)
+    t_serv = np.array([node.t_serv for node in nodes], dtype=float)
+    inf_score = c_inf * inf  # Parts of the score that do not depend on the route
+    sup_score = c_sup * sup
+
+    unrouted = np.ones(len(nodes), dtype=bool)  # Customers still to be served
+    unrouted[0] = False
     routes = []  # List to store the constructed routes
+    states = []  # Schedule and load of each route, kept up to date while it is built
 
-    while customers:  # While there are still customers to be served
-        route = [depot]  # Start a new route from the depot
-        current_load = 0  # Initialize the current load of the vehicle
+    while unrouted.any():  # While there are still customers to be served
+        state = RouteState([depot], times, capacity)  # Start a new route from the depot
+        route = state.route
+        last = 0
+        candidates = np.flatnonzero(unrouted)  # Unrouted customers, ascending like the customer list
 
-        while True:
+        while len(candidates):
             # Find all feasible customers based on vehicle capacity and time windows
-            feasible_customers = [cust for cust in customers if is_feasible(route, cust, capacity, times)]
-            if not feasible_customers:
-                break  # If no feasible customers, break out of the loop
-
-            # Select the next customer using weighted criteria (distance, time window bounds)
-            next_customer = min(feasible_customers, key=lambda x:
-                c_distance * (times[route[-1].index][x.index]) +  # Minimize distance
-                c_inf * x.inf +  # Time window lower bound
-                c_sup * x.sup)  # Time window upper bound
-
-            # Check if adding the next customer exceeds the vehicle capacity
-            if current_load + next_customer.q <= capacity:
-                route.append(next_customer)  # Add the customer to the route
-                current_load += next_customer.q  # Update the current load
-                customers.remove(next_customer)  # Remove the customer from the list
-            else:
-                break  # Stop if capacity is exceeded
-
-        route.append(depot)  # Return to the depot at the end of the route
+            arrival = state.departure[-1] + times[last, candidates]  # The vehicle leaves the last node at departure[-1]
+            fits = state.total_load + demands[candidates] <= capacity
+            candidates, arrival = candidates[fits], arrival[fits]
+            reachable = arrival <= sup[candidates] + 1e-6  # Small slack so rounding never drops a feasible customer
+            candidates, arrival = candidates[reachable], arrival[reachable]
+            feasible = arrival <= sup[candidates]
+            if not feasible.any():
+                break  # If no feasible customers, close the route
+
+            # Select the next customer using weighted criteria (first one on ties, like min over the list)
+            scores = c_distance * times[last, candidates] + inf_score[candidates] + sup_score[candidates]
+            position = np.argmin(np.where(feasible, scores, np.inf))
+            next_customer = nodes[candidates[position]]
+
+            state.append(next_customer)  # Add the customer to the route, its schedule and load
+            unrouted[next_customer.index] = False  # Remove the customer from the unrouted set
+            candidates = np.delete(candidates, position)
+            last = next_customer.index
+
+        if len(route) == 1:
+            raise ValueError("Some customers cannot be served by any route (capacity or time window)")
+        state.append(depot)  # Return to the depot at the end of the route
         routes.append(route)  # Add the route to the list of routes
+        states.append(state)
 
+    if return_states:
+        return routes, states
     return routes  # Return the constructed routes
 
-# Main function to solve the VRPTW using the constructive heuristic method
-def vrptw_solver(directory_path, output_filename):
-    wb = Workbook()  # Initialize a new Excel workbook
-    wb.remove(wb.active)  # Remove the default empty sheet
+# Function to solve a single instance (runs inside a worker process)
+def solve_instance(i, directory_path):
+    """
+    Solve one VRPTW instance with the constructive heuristic.
+    :param i: Number of the instance (VRPTWi.txt).
+    :param directory_path: Directory with the VRPTW problem instances.
+    :return: Dictionary with the routes, distances, lower bounds and execution time of the instance.
+    """
+    filename = f'{directory_path}/VRPTW{i}.txt'  # Generate the file name for the instance
+    file_start_time = time.time()  # Record the start time for the instance
 
-    execution_times = []  # List to store execution times for each instance
-    gaps_k = []  # List to store gaps for number of routes (K)
-    gaps_d = []  # List to store gaps for distances (D)
+    # Read the number of nodes, vehicle capacity, and nodes (customers) from the file
+    n, Q, nodes = read_txt_file(filename)
+    times = travel_times_matrix(nodes)  # Calculate the travel time matrix
+
+    depot = nodes[0]  # The depot node
+    customers = nodes[1:]  # List of customer nodes
 
-    # Loop over all problem instances from VRPTW1 to VRPTW18
-    for i in range(1, 19):
-        filename = f'{directory_path}/VRPTW{i}.txt'  # Generate the file name for each instance
-        file_start_time = time.time()  # Record the start time for each instance
+    # Calculate the lower bounds (for routes and total distance)
+    lb_routes = lower_bound_routes(customers, Q)
+    lb_distance = lower_bound_mst(depot, customers, times)  # Use MST to get the lower bound distance
 
-        # Read the number of nodes, vehicle capacity, and nodes (customers) from the file
-        n, Q, nodes = read_txt_file(filename)
-        times = travel_times_matrix(nodes)  # Calculate the travel time matrix
+    # Generate routes using the constructive heuristic method
+    routes, route_states = constructive_route_selection(nodes, Q, times, return_states=True)
+    best_distance = calculate_total_distance(routes, times)  # Calculate the total distance for the solution
+    computation_time = (time.time() - file_start_time) * 1000  # Compute the execution time in milliseconds
 
-        depot = nodes[0]  # The depot node
-        customers = nodes[1:]  # List of customer nodes
+    return {'i': i, 'filename': filename, 'routes': routes, 'distance': best_distance, 'time': computation_time,
+            'times': times, 'route_states': route_states,
+            'lb_routes': lb_routes, 'lb_distance': lb_distance}
+
+# Main function to solve the VRPTW using the constructive heuristic method
+def vrptw_solver(directory_path, output_filename, processes=None):
+    wb = new_result_workbook()  # Write-only workbook, each sheet is streamed as it is written
 
-        # Calculate the lower bounds (for routes and total distance)
-        lb_routes = lower_bound_routes(customers, Q)
-        lb_distance = lower_bound_mst(depot, customers, times)  # Use MST to get the lower bound distance
+    execution_times = []  # List to store execution times for each instance
+    solutions = {}  # Sheet name -> routes, distance and time, saved with solution_store
+    gaps_k = []  # List to store gaps for number of routes (K)
+    gaps_d = []  # List to store gaps for distances (D)
 
-        # Generate routes using the constructive heuristic method
-        routes = constructive_route_selection(nodes, Q, times)
-        best_distance = calculate_total_distance(routes, times)  # Calculate the total distance for the solution
-        computation_time = (time.time() - file_start_time) * 1000  # Compute the execution time in milliseconds
+    # Solve all problem instances from VRPTW1 to VRPTW18 in parallel, results are exported as they arrive
+    wall_start_time = time.time()
+    results = imap_in_pool(solve_instance, range(1, 19), processes, directory_path=directory_path)
+
+    # Report, save and plot the results in this process only
+    for result in results:
+        routes = result['routes']
+        best_distance = result['distance']
+        computation_time = result['time']
+        lb_routes = result['lb_routes']
+        lb_distance = result['lb_distance']
         execution_times.append(computation_time)  # Store the execution time
 
         # Calculate the GAP for number of routes and total distance
@@ -130,7 +180,7 @@ def vrptw_solver(directory_path, output_filename):
         gaps_d.append(gap_distance)
 
         # Print the solution details for this instance
-        print(f"Solution for {filename}:")
+        print(f"Solution for {result['filename']}:")
         print(f"  - Total Distance = {best_distance}")
         print(f"  - Lower Bound Distance (MST) = {lb_distance:.3f}")
         print(f"  - GAP Distance = {gap_distance:.3f}%")
@@ -140,22 +190,27 @@ def vrptw_solver(directory_path, output_filename):
         print(f"  - Execution Time = {computation_time:.3f} ms\n")
 
         # Save the results to Excel and plot the routes
-        sheet_name = f'VRPTW{i}'  # Each sheet is named based on the instance
-        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, times)  # Save to Excel
+        sheet_name = f'VRPTW{result["i"]}'  # Each sheet is named based on the instance
+        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, result['times'], result['route_states'])  # Save to Excel
+        solutions[sheet_name] = {'routes': routes, 'distance': best_distance, 'time': computation_time}  # Same results in binary form
         save_routes_plot_in_folder(routes, f"{sheet_name}.png", folder='1-constructive-heuristics/figures/constructive')  # Save the plot
 
     # Save the final Excel workbook with all the results
     wb.save(output_filename)
+    export_solutions('constructive', solutions)  # Binary copy read by the later stages (fast to load)
 
     # Calculate the total and mean execution times
-    total_elapsed_time = sum(execution_times)  # Total time
+    total_elapsed_time = sum(execution_times)  # Total time (sum over instances)
+    wall_elapsed_time = (time.time() - wall_start_time) * 1000  # Wall-clock time of the whole batch
     mean_gap_k = sum(gaps_k) / len(gaps_k)  # Mean GAP for routes
     mean_gap_d = sum(gaps_d) / len(gaps_d)  # Mean GAP for distances
 
     # Print total execution time and mean GAPs
     print(f"\nTotal execution time: {total_elapsed_time:.0f} ms")
+    print(f"Wall-clock time: {wall_elapsed_time:.0f} ms")
     print(f"Mean GAP for routes (K): {mean_gap_k:.3f}%")
     print(f"Mean GAP for distances (D): {mean_gap_d:.3f}%")
 
-# Run the solver function
-vrptw_solver(directory_path, output_filename)
+# Run the solver function (the guard keeps worker processes from running it again)
+if __name__ == "__main__":
+    vrptw_solver(directory_path, output_filename)
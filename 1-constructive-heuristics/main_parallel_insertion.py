@@ -0,0 +1,137 @@
+import os
+import time
+import math
+import numpy as np
+from scipy.sparse.csgraph import minimum_spanning_tree  # Used for calculating the MST lower bound
+from distance_finder import travel_times_matrix, calculate_total_distance  # Functions to handle travel distances
+from file_reader import read_txt_file  # Function to read data from the problem instance files
+from file_writer import save_to_excel, new_result_workbook  # Function to write results into an Excel file
+from visualization import save_routes_plot_in_folder  # Function to visualize and save routes
+from parallel_insertion import parallel_insertion  # Import the parallel insertion heuristic
+from solution_store import export_solutions  # Binary copy of the results
+from batch_runner import imap_in_pool  # Solve the instances in parallel worker processes
+
+# Directory where problem instances are located and where results will be stored
+directory_path = 'VRPTW Instances'
+output_filename = '1-constructive-heuristics/results/VRPTW_tm_insertion.xlsx'  # Excel output file
+
+# Function to calculate the lower bound for the number of routes based on total demand and vehicle capacity
+def lower_bound_routes(customers, vehicle_capacity):
+    """
+    Calculate the lower bound on the number of routes based on total demand and vehicle capacity.
+    :param customers: List of customer nodes, each with a demand attribute.
+    :param vehicle_capacity: Maximum capacity of a single vehicle.
+    :return: Lower bound on the number of routes (vehicles).
+    """
+    total_demand = sum(customer.q for customer in customers)  # Total demand of all customers
+    return math.ceil(total_demand / vehicle_capacity)  # Lower bound on number of routes based on vehicle capacity
+
+# Function to calculate the lower bound on total distance using Minimum Spanning Tree (MST)
+def lower_bound_mst(depot, customers, distance_matrix):
+    """
+    Calculate the lower bound on the total distance using the Minimum Spanning Tree (MST).
+    :param depot: The depot node (starting point for all routes).
+    :param customers: List of customer nodes.
+    :param distance_matrix: Precomputed matrix of distances between nodes.
+    :return: Lower bound on the total distance using MST.
+    """
+    # Combine depot and customers to form a full graph
+    nodes = [depot] + customers
+
+    # Create a distance matrix for all nodes
+    indexes = [node.index for node in nodes]
+    full_matrix = np.asarray(distance_matrix)[np.ix_(indexes, indexes)]  # Pick the sub-matrix of these nodes in one step
+
+    # Compute the MST for the graph and sum its edges to get the lower bound distance
+    mst = minimum_spanning_tree(full_matrix).toarray()
+    mst_distance = mst.sum()  # Total MST distance
+
+    return mst_distance  # Return the MST lower bound distance
+
+# Function to solve a single instance with parallel insertion (runs inside a worker process)
+def solve_instance(i, directory_path):
+    """
+    Solve one VRPTW instance with the parallel insertion heuristic.
+    :param i: Number of the instance (VRPTWi.txt).
+    :param directory_path: Directory with the VRPTW problem instances.
+    :return: Dictionary with the routes, distances, lower bounds and execution time of the instance.
+    """
+    filename = f'{directory_path}/VRPTW{i}.txt'  # Build the filename
+    file_start_time = time.time()  # Start timing the execution
+
+    # Read the number of customers (n), vehicle capacity (Q), and nodes from the file
+    n, Q, nodes = read_txt_file(filename)
+    times = travel_times_matrix(nodes)  # Calculate travel time matrix
+
+    depot = nodes[0]  # First node is the depot
+    customers = nodes[1:]  # All other nodes are customers
+
+    # Calculate lower bounds for routes and total distance
+    lb_routes = lower_bound_routes(customers, Q)
+    lb_distance = lower_bound_mst(depot, customers, times)  # MST-based lower bound
+
+    # Insert the customers into several routes at once (Solomon I1 criteria)
+    routes, route_states = parallel_insertion(nodes, Q, times, return_states=True)
+    best_distance = calculate_total_distance(routes, times)  # Calculate the total distance for the solution
+    computation_time = (time.time() - file_start_time) * 1000  # Calculate execution time in milliseconds
+
+    return {'i': i, 'filename': filename, 'routes': routes, 'distance': best_distance, 'time': computation_time,
+            'times': times, 'route_states': route_states,
+            'lb_routes': lb_routes, 'lb_distance': lb_distance}
+
+# Function to solve the VRPTW using the parallel insertion heuristic
+def vrptw_solver(directory_path, output_filename, processes=None):
+    wb = new_result_workbook()  # Write-only workbook, each sheet is streamed as it is written
+
+    execution_times = []  # List to store execution times for each file
+    solutions = {}  # Sheet name -> routes, distance and time, saved with solution_store
+
+    # Solve each problem instance (VRPTW1 to VRPTW18) in parallel, results are exported as they arrive
+    wall_start_time = time.time()
+    results = imap_in_pool(solve_instance, range(1, 19), processes, directory_path=directory_path)
+
+    for result in results:
+        routes = result['routes']
+        best_distance = result['distance']
+        computation_time = result['time']
+        lb_routes = result['lb_routes']
+        lb_distance = result['lb_distance']
+        execution_times.append(computation_time)  # Store the execution time
+
+        # Calculate the GAP for both routes and distances
+        actual_routes = len(routes)  # Number of routes found
+        gap_routes = max(((actual_routes - lb_routes) / lb_routes) * 100 if lb_routes > 0 else 0, 0)  # GAP for routes
+        gap_distance = max(((best_distance - lb_distance) / lb_distance) * 100 if lb_distance > 0 else 0, 0)  # GAP for distances
+
+        # Print solution details for this problem instance
+        print(f"Solution for {result['filename']}:")
+        print(f"  - Total Distance = {best_distance}")
+        print(f"  - Lower Bound Distance (MST) = {lb_distance:.3f}")
+        print(f"  - GAP Distance = {gap_distance:.3f}%")
+        print(f"  - Actual Routes = {actual_routes}")
+        print(f"  - Lower Bound Routes = {lb_routes}")
+        print(f"  - GAP Routes = {gap_routes:.3f}%")
+        print(f"  - Execution Time = {computation_time:.0f} ms\n")
+
+        # Save the results to Excel
+        sheet_name = f'VRPTW{result["i"]}'  # Each sheet named according to the problem instance
+        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, result['times'], result['route_states'])
+        solutions[sheet_name] = {'routes': routes, 'distance': best_distance, 'time': computation_time}  # Same results in binary form
+
+        # Save a plot of the routes to the figures folder
+        save_routes_plot_in_folder(routes, f"{sheet_name}.png", folder='1-constructive-heuristics/figures/insertion')
+
+    # Save the entire Excel workbook with all results
+    wb.save(output_filename)
+    export_solutions('insertion', solutions)  # Binary copy read by the later stages (fast to load)
+
+    # Print the total execution time for all instances
+    total_elapsed_time = sum(execution_times)  # Sum the execution times
+    wall_elapsed_time = (time.time() - wall_start_time) * 1000  # Wall-clock time of the whole batch
+    print(f"\nTotal execution time: {total_elapsed_time:.0f} ms")
+    print(f"Wall-clock time: {wall_elapsed_time:.0f} ms")
+
+
+# Execute the VRPTW solver using parallel insertion (the guard keeps worker processes from running it again)
+if __name__ == "__main__":
+    vrptw_solver(directory_path, output_filename)
@@ -1,19 +1,31 @@
 import os
 import time
+import random
 import math
 import numpy as np
 from scipy.sparse.csgraph import minimum_spanning_tree  # Used for calculating the MST lower bound
-from openpyxl import Workbook  # Used to write results to Excel
 from distance_finder import travel_times_matrix, calculate_total_distance  # Functions to handle travel distances
 from file_reader import read_txt_file  # Function to read data from the problem instance files
-from file_writer import save_to_excel  # Function to write results into an Excel file
+from file_writer import save_to_excel, new_result_workbook  # Function to write results into an Excel file
+from feasibility import RouteState  # Schedule of every route, read by the Excel export
 from visualization import save_routes_plot_in_folder  # Function to visualize and save routes
-from reactive_grasp import reactive_grasp_route_selection  # Import the GRASP algorithm function
+from multiprocessing import parent_process  # Tells whether this process is a worker of the instance pool
+from reactive_grasp import reactive_grasp_route_selection, batched_reactive_grasp  # Import the GRASP algorithm functions
+from solution_store import export_solutions  # Binary copy of the results
+from batch_runner import imap_in_pool  # Solve the instances in parallel worker processes
 
 # Directory where problem instances are located and where results will be stored
 directory_path = 'VRPTW Instances'
 output_filename = '1-constructive-heuristics/results/VRPTW_tm_GRASP.xlsx'  # Excel output file
 
+# Reactive GRASP mode: 'sequential' runs reactive_grasp_route_selection (the published results), 'batched' runs
+# batched_reactive_grasp, whose seeded constructions give different solutions even with workers=1
+grasp_mode = 'sequential'
+batched_params = {
+    'block_size': 10,  # Constructions drawn with the same alpha probabilities between two updates
+    'workers': 1       # Processes for the constructions of a block, forced to 1 inside the instance pool
+}
+
 # Function to calculate the lower bound for the number of routes based on total demand and vehicle capacity
 def lower_bound_routes(customers, vehicle_capacity):
     """
@@ -36,13 +48,10 @@ def lower_bound_mst(depot, customers, distance_matrix):
     """
     # Combine depot and customers to form a full graph
     nodes = [depot] + customers
-    n = len(nodes)
 
     # Create a distance matrix for all nodes
-    full_matrix = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            full_matrix[i, j] = distance_matrix[nodes[i].index][nodes[j].index]  # Fill matrix with distances
+    indexes = [node.index for node in nodes]
+    full_matrix = np.asarray(distance_matrix)[np.ix_(indexes, indexes)]  # Pick the sub-matrix of these nodes in one step
 
     # Compute the MST for the graph and sum its edges to get the lower bound distance
     mst = minimum_spanning_tree(full_matrix).toarray()
@@ -50,32 +59,61 @@ def lower_bound_mst(depot, customers, distance_matrix):
 
     return mst_distance  # Return the MST lower bound distance
 
-# Function to solve the VRPTW using the Reactive GRASP approach
-def vrptw_solver(directory_path, output_filename):
-    wb = Workbook()  # Initialize a new Excel workbook
-    wb.remove(wb.active)  # Remove the default empty sheet
-
-    execution_times = []  # List to store execution times for each file
-
-    # Loop through each problem instance (VRPTW1 to VRPTW18)
-    for i in range(1, 19):
-        filename = f'{directory_path}/VRPTW{i}.txt'  # Build the filename
-        file_start_time = time.time()  # Start timing the execution
-
-        # Read the number of customers (n), vehicle capacity (Q), and nodes from the file
-        n, Q, nodes = read_txt_file(filename)
-        times = travel_times_matrix(nodes)  # Calculate travel time matrix
+# Function to solve a single instance with Reactive GRASP (runs inside a worker process)
+def solve_instance(i, directory_path, seed=15):
+    """
+    Solve one VRPTW instance with Reactive GRASP.
+    :param i: Number of the instance (VRPTWi.txt).
+    :param directory_path: Directory with the VRPTW problem instances.
+    :param seed: Base random seed, each instance uses seed + i so results do not depend on the worker that runs it.
+    :return: Dictionary with the routes, distances, lower bounds and execution time of the instance.
+    """
+    random.seed(seed + i)  # Reproducible randomness per instance
+    filename = f'{directory_path}/VRPTW{i}.txt'  # Build the filename
+    file_start_time = time.time()  # Start timing the execution
+
+    # Read the number of customers (n), vehicle capacity (Q), and nodes from the file
+    n, Q, nodes = read_txt_file(filename)
+    times = travel_times_matrix(nodes)  # Calculate travel time matrix
+
+    depot = nodes[0]  # First node is the depot
+    customers = nodes[1:]  # All other nodes are customers
+
+    # Calculate lower bounds for routes and total distance
+    lb_routes = lower_bound_routes(customers, Q)
+    lb_distance = lower_bound_mst(depot, customers, times)  # MST-based lower bound
+
+    # Apply the Reactive GRASP algorithm to find the best routes and total distance
+    if grasp_mode == 'batched':
+        params = dict(batched_params)
+        if parent_process() is not None:
+            params['workers'] = 1  # Already inside a worker of the instance pool, no nested pool of constructions
+        routes, best_distance = batched_reactive_grasp(nodes, Q, times, seed=seed + i, **params)
+    else:
+        routes, best_distance = reactive_grasp_route_selection(nodes, Q, times)
+    computation_time = (time.time() - file_start_time) * 1000  # Calculate execution time in milliseconds
 
-        depot = nodes[0]  # First node is the depot
-        customers = nodes[1:]  # All other nodes are customers
+    return {'i': i, 'filename': filename, 'routes': routes, 'distance': best_distance, 'time': computation_time,
+            'times': times, 'route_states': [RouteState(route, times, Q) for route in routes],
+            'lb_routes': lb_routes, 'lb_distance': lb_distance}
 
-        # Calculate lower bounds for routes and total distance
-        lb_routes = lower_bound_routes(customers, Q)
-        lb_distance = lower_bound_mst(depot, customers, times)  # MST-based lower bound
+# Function to solve the VRPTW using the Reactive GRASP approach
+def vrptw_solver(directory_path, output_filename, processes=None):
+    wb = new_result_workbook()  # Write-only workbook, each sheet is streamed as it is written
 
-        # Apply the Reactive GRASP algorithm to find the best routes and total distance
-        routes, best_distance = reactive_grasp_route_selection(nodes, Q, times)
-        computation_time = (time.time() - file_start_time) * 1000  # Calculate execution time in milliseconds
+    execution_times = []  # List to store execution times for each file
+    solutions = {}  # Sheet name -> routes, distance and time, saved with solution_store
+
+    # Solve each problem instance (VRPTW1 to VRPTW18) in parallel, results are exported as they arrive
+    wall_start_time = time.time()
+    results = imap_in_pool(solve_instance, range(1, 19), processes, directory_path=directory_path)
+
+    for result in results:
+        routes = result['routes']
+        best_distance = result['distance']
+        computation_time = result['time']
+        lb_routes = result['lb_routes']
+        lb_distance = result['lb_distance']
         execution_times.append(computation_time)  # Store the execution time
 
         # Calculate the GAP for both routes and distances
@@ -84,7 +122,7 @@ def vrptw_solver(directory_path, output_filename):
         gap_distance = max(((best_distance - lb_distance) / lb_distance) * 100 if lb_distance > 0 else 0, 0)  # GAP for distances
 
         # Print solution details for this problem instance
-        print(f"Solution for {filename}:")
+        print(f"Solution for {result['filename']}:")
         print(f"  - Total Distance = {best_distance}")
         print(f"  - Lower Bound Distance (MST) = {lb_distance:.3f}")
         print(f"  - GAP Distance = {gap_distance:.3f}%")
@@ -94,19 +132,24 @@ def vrptw_solver(directory_path, output_filename):
         print(f"  - Execution Time = {computation_time:.0f} ms\n")
 
         # Save the results to Excel
-        sheet_name = f'VRPTW{i}'  # Each sheet named according to the problem instance
-        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, times)
+        sheet_name = f'VRPTW{result["i"]}'  # Each sheet named according to the problem instance
+        save_to_excel(wb, sheet_name, routes, best_distance, computation_time, result['times'], result['route_states'])
+        solutions[sheet_name] = {'routes': routes, 'distance': best_distance, 'time': computation_time}  # Same results in binary form
 
         # Save a plot of the routes to the figures folder
         save_routes_plot_in_folder(routes, f"{sheet_name}.png", folder='1-constructive-heuristics/figures/grasp')
 
     # Save the entire Excel workbook with all results
     wb.save(output_filename)
+    export_solutions('GRASP', solutions)  # Binary copy read by the later stages (fast to load)
 
     # Print the total execution time for all instances
     total_elapsed_time = sum(execution_times)  # Sum the execution times
+    wall_elapsed_time = (time.time() - wall_start_time) * 1000  # Wall-clock time of the whole batch
     print(f"\nTotal execution time: {total_elapsed_time:.0f} ms")
+    print(f"Wall-clock time: {wall_elapsed_time:.0f} ms")
 
 
-# Execute the VRPTW solver using Reactive GRASP
-vrptw_solver(directory_path, output_filename)
+# Execute the VRPTW solver using Reactive GRASP (the guard keeps worker processes from running it again)
+if __name__ == "__main__":
+    vrptw_solver(directory_path, output_filename)
@@ -0,0 +1,130 @@
+import math
+import numpy as np
+from feasibility import RouteState
+
+# Insertion criteria weights (Solomon, 1987)
+mu = 1.0  # Weight of the removed arc (i, j) in the detour c11 = t(i,u) + t(u,j) - mu * t(i,j)
+lam = 1.0  # Weight of the depot distance in the selection criterion c2 = lam * t(0,u) - c1
+alpha1 = 0.9  # Weight of the detour in c1
+alpha2 = 0.1  # Weight of the push forward of the next service start in c1
+
+# Function to pick the customer that seeds a new route
+def select_seed(unrouted, seeds, times, single_route_ok):
+    """
+    Choose the unrouted customer farthest from the depot and from the seeds already used.
+    :param unrouted: Boolean mask of the customers not yet in a route.
+    :param seeds: Indexes of the customers that already seeded a route.
+    :param times: Matrix of travel times between nodes (NumPy array).
+    :param single_route_ok: Boolean mask of the customers that can be served alone (depot, customer, depot).
+    :return: Index of the seed customer.
+    """
+    candidates = np.flatnonzero(unrouted & single_route_ok)
+    if len(candidates) == 0:
+        raise ValueError("Some customers cannot be served by any route (capacity or time window)")
+    spread = times[0, candidates]
+    if seeds:
+        spread = np.minimum(spread, times[np.ix_(seeds, candidates)].min(axis=0))
+    return candidates[np.argmax(spread)]
+
+# Function to compute the best insertion of every unrouted customer into one route
+def best_insertions(state, unrouted, times, demands, inf, sup, t_serv, capacity):
+    """
+    Evaluate every gap of the route for every unrouted customer at once, with the same O(1) test as
+    RouteState.can_insert (arrival inside the window and next node still before its latest start).
+    :param state: RouteState of the route.
+    :return: Tuple (c2, position) with one entry per node: the selection value of the cheapest feasible
+             insertion (-inf if none) and the position after which the customer would be inserted.
+    """
+    num_nodes = len(demands)
+    c2 = np.full(num_nodes, -np.inf)
+    positions = np.zeros(num_nodes, dtype=np.intp)
+    candidates = np.flatnonzero(unrouted & (state.total_load + demands <= capacity))
+    if len(candidates) == 0:
+        return c2, positions
+
+    route = np.array([node.index for node in state.route])
+    before, after = route[:-1], route[1:]  # Gap g goes from before[g] to after[g]
+    departure = np.array(state.departure[:-1])[:, None]
+    start_after = np.array(state.earliest[1:])[:, None]
+    latest_after = np.array(state.latest[1:])[:, None]
+
+    to_customer = times[np.ix_(before, candidates)]  # t(i, u) per gap and customer
+    from_customer = times[np.ix_(after, candidates)]  # t(u, j), the matrix is symmetric
+    arrival = departure + to_customer
+    new_start_after = np.maximum(np.maximum(arrival, inf[candidates]) + t_serv[candidates] + from_customer, inf[after][:, None])
+    feasible = (arrival <= sup[candidates]) & (new_start_after <= latest_after)
+
+    detour = to_customer + from_customer - mu * times[before, after][:, None]
+    c1 = np.where(feasible, alpha1 * detour + alpha2 * (new_start_after - start_after), np.inf)
+    gap = np.argmin(c1, axis=0)  # First cheapest gap of each customer
+    cost = c1[gap, np.arange(len(candidates))]
+    c2[candidates] = np.where(np.isfinite(cost), lam * times[0, candidates] - cost, -np.inf)
+    positions[candidates] = gap
+    return c2, positions
+
+# Function to build routes by parallel insertion (Solomon I1 criteria)
+def parallel_insertion(nodes, capacity, times, num_routes=None, return_states=False):
+    """
+    Seed several routes and repeatedly insert the unrouted customer with the largest c2 at its cheapest
+    feasible position over all routes. The best insertion of each (customer, route) pair is cached and only
+    the column of the route that received the last customer is recomputed. A new route is seeded when no
+    customer fits anywhere.
+    :param nodes: List of nodes (depot + customers), node i at position i.
+    :param capacity: Vehicle capacity.
+    :param times: Matrix of travel times between nodes.
+    :param num_routes: Number of routes seeded at the start (default: lower bound from the total demand).
+    :param return_states: Also return the RouteState of each route, as kept up to date by the insertions.
+    :return: List of routes, each starting and ending at the depot (and their RouteStates if return_states).
+    """
+    depot = nodes[0]
+    times = np.asarray(times, dtype=float)
+    demands = np.array([node.q for node in nodes], dtype=float)
+    inf = np.array([node.inf for node in nodes], dtype=float)
+    sup = np.array([node.sup for node in nodes], dtype=float)
+    t_serv = np.array([node.t_serv for node in nodes], dtype=float)
+    instance = (times, demands, inf, sup, t_serv, capacity)
+
+    # Customers that can be served by a route of their own
+    back_home = np.maximum(times[0], inf) + t_serv + times[:, 0]
+    single_route_ok = (demands <= capacity) & (times[0] <= sup) & (back_home <= depot.sup)
+    single_route_ok[0] = False
+
+    unrouted = np.ones(len(nodes), dtype=bool)
+    unrouted[0] = False
+    if num_routes is None:
+        num_routes = math.ceil(demands.sum() / capacity)
+
+    routes, states, seeds = [], [], []
+    c2_columns, position_columns = [], []  # Cached best insertion of every customer in every route
+
+    def open_route():
+        seed = select_seed(unrouted, seeds, times, single_route_ok)
+        seeds.append(seed)
+        unrouted[seed] = False
+        route = [depot, nodes[seed], depot]
+        routes.append(route)
+        states.append(RouteState(route, times, capacity))
+        c2, positions = best_insertions(states[-1], unrouted, *instance)  # Other columns just lose the seed
+        c2_columns.append(c2)
+        position_columns.append(positions)
+
+    for _ in range(min(num_routes, int(single_route_ok.sum()))):
+        open_route()
+
+    while unrouted.any():
+        c2 = np.column_stack(c2_columns)
+        c2[~unrouted] = -np.inf
+        customer, r = np.unravel_index(np.argmax(c2), c2.shape)
+        if c2[customer, r] == -np.inf:
+            open_route()  # No customer fits in the current routes
+            continue
+
+        # Insert the customer and refresh only the touched route
+        routes[r].insert(position_columns[r][customer] + 1, nodes[customer])
+        unrouted[customer] = False
+        states[r] = RouteState(routes[r], times, capacity)
+        c2_columns[r], position_columns[r] = best_insertions(states[r], unrouted, *instance)
+
+    if return_states:
+        return routes, states
+    return routes
@@ -1,7 +1,7 @@
 import random
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from distance_finder import calculate_total_distance, calculate_min_max_times, calculate_min_max_distances
-from feasibility import is_feasible
 
 random.seed(15)
 
@@ -10,74 +10,202 @@ c_inf = 0.4
 c_sup = 0.1
 
 
+# Precomputed pieces of the normalized RCL score of one instance
+class ScoreCache:
+    """
+    The score of moving from node i to customer j is
+        c_distance * norm(times[i][j]) + c_inf * norm(j.inf) + c_sup * norm(j.sup)
+    where norm scales to [0, 1] with the instance minimum and maximum. The normalized distance matrix and the
+    two per-customer terms never change, so a construction step only looks up one row and adds them in the
+    same order as before (the scores are bit for bit the old ones).
+    :param nodes: List of nodes (depot + customers), node i at position i.
+    :param times: Matrix of travel times between nodes.
+    """
+    def __init__(self, nodes, times):
+        min_inf, max_inf, min_sup, max_sup = calculate_min_max_times(nodes)
+        min_time, max_time = calculate_min_max_distances(times)
+
+        self.times = np.asarray(times, dtype=float)
+        self.demands = np.array([node.q for node in nodes], dtype=float)
+        self.inf = np.array([node.inf for node in nodes], dtype=float)
+        self.sup = np.array([node.sup for node in nodes], dtype=float)
+        self.t_serv = np.array([node.t_serv for node in nodes], dtype=float)
+
+        self.distance_term = c_distance * (self.times - min_time) / (max_time - min_time)  # Normalized distance
+        self.inf_term = c_inf * (self.inf - min_inf) / (max_inf - min_inf)  # Normalized lower bound
+        self.sup_term = c_sup * (self.sup - min_sup) / (max_sup - min_sup)  # Normalized upper bound
+
+    def scores(self, last, candidates):
+        return self.distance_term[last, candidates] + self.inf_term[candidates] + self.sup_term[candidates]
+
+
+
+# Function to build the restricted candidate list of one construction step
+def restricted_candidate_list(scores, rcl_size):
+    """
+    Positions of the rcl_size best scores, ordered by (score, position) as a stable sort of all of them would.
+    argpartition finds the cut value and only the candidates up to it (ties included) are sorted.
+    """
+    if rcl_size < len(scores):
+        cut = scores[np.argpartition(scores, rcl_size - 1)[rcl_size - 1]]
+        candidates = np.flatnonzero(scores <= cut)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates], kind='stable')][:rcl_size]
+
+
+
+# Function to build one GRASP solution with a fixed alpha
+def grasp_construction(nodes, capacity, cache, alpha, rng=random):
+    depot = nodes[0]
+    unrouted = np.ones(len(nodes), dtype=bool)  # Customers not yet in a route
+    unrouted[0] = False
+    routes = []
+
+    # While there are still customers, build routes
+    while unrouted.any():
+        route = [depot]
+        last = 0
+        current_load = 0
+        current_time = 0  # Time at which the vehicle leaves the last node of the route
+
+        while True:
+            # Get feasible customers based on capacity and time windows (same rule as is_feasible)
+            arrival = current_time + cache.times[last]
+            feasible = np.flatnonzero(unrouted & (current_load + cache.demands <= capacity) & (np.maximum(arrival, cache.inf) <= cache.sup))
+            if len(feasible) == 0:
+                break
+
+            # Rank by normalized score and form the RCL
+            rcl_size = max(1, int(len(feasible) * alpha))
+            rcl = feasible[restricted_candidate_list(cache.scores(last, feasible), rcl_size)]
+
+            # Randomly select a customer from the RCL
+            next_customer = nodes[rng.choice(rcl)]
+            route.append(next_customer)
+            current_load += next_customer.q
+            current_time = max(arrival[next_customer.index], next_customer.inf) + next_customer.t_serv
+            unrouted[next_customer.index] = False
+            last = next_customer.index
+
+        if len(route) == 1:
+            raise ValueError("Some customers cannot be served by any route (capacity or time window)")
+        route.append(depot)  # Return to depot at the end of the route
+        routes.append(route)
+
+    return routes
+
+
+
+# Function to reward the alpha that produced a solution and renormalize the probabilities
+def update_alpha_probs(alpha_probs, alpha, total_distance, best_distance, alphas, min_prob=1e-6):
+    # Update probabilities based on the current alpha
+    for alpha_key in alpha_probs:
+        if alpha_key == alpha:
+            alpha_probs[alpha_key] += 1 / (1 + total_distance - best_distance)
+        else:
+            alpha_probs[alpha_key] = max(min_prob, alpha_probs[alpha_key] - 1 / (1 + total_distance - best_distance))
+
+    # Normalize probabilities
+    total_prob = sum(alpha_probs.values())
+    if total_prob == 0 or total_prob != total_prob:  # Handle edge cases
+        return {alpha: 1/len(alphas) for alpha in alphas}
+    return {k: v / total_prob for k, v in alpha_probs.items()}
+
+
+
 def reactive_grasp_route_selection(nodes, capacity, times, alphas = list(np.arange(0.03, 0.3, 0.1)), iterations=100):
     alpha_probs = {alpha: 1/len(alphas) for alpha in alphas}  # Initialize probabilities for each alpha
     best_routes = None
     best_distance = float('inf')
     min_prob = 1e-6  # Minimum threshold for probabilities
+    cache = ScoreCache(nodes, times)  # Normalization bounds and static score terms are computed once
 
     for _ in range(iterations):
-        min_inf, max_inf, min_sup, max_sup = calculate_min_max_times(nodes)
-        min_time, max_time = calculate_min_max_distances(times)
-
         # Choose an alpha based on the probabilities
         alpha = random.choices(list(alpha_probs.keys()), weights=alpha_probs.values())[0]
-        depot = nodes[0]
-        customers = nodes[1:]
-        routes = []
+        routes = grasp_construction(nodes, capacity, cache, alpha)
+
+        # Calculate total distance for the current solution
+        total_distance = calculate_total_distance(routes, times)
+        if total_distance < best_distance:
+            best_distance = total_distance
+            best_routes = routes
 
-        # While there are still customers, build routes
-        while customers:
-            route = [depot]
-            current_load = 0
+        alpha_probs = update_alpha_probs(alpha_probs, alpha, total_distance, best_distance, alphas, min_prob)
 
-            while True:
-                # Get feasible customers based on capacity and time windows
-                feasible_customers = [cust for cust in customers if is_feasible(route, cust, capacity, times)]
-                if not feasible_customers:
-                    break
+    return best_routes, best_distance
 
-                # Sort by distance to the current node and form the RCL
-                feasible_customers.sort(key=lambda x:
-                    c_distance * (times[route[-1].index][x.index] - min_time) / (max_time - min_time) +  # Normalizamos la distancia
-                    c_inf * (x.inf - min_inf) / (max_inf - min_inf) +  # Normalizamos el límite inferior
-                    c_sup * (x.sup - min_sup) / (max_sup - min_sup))   # Normalizamos el límite superior
 
 
-                rcl_size = max(1, int(len(feasible_customers) * alpha))
-                rcl = feasible_customers[:rcl_size]
+# State of a GRASP worker process, filled once by init_grasp_worker
+grasp_worker = {}
 
-                # Randomly select a customer from the RCL
-                next_customer = random.choice(rcl)
+def init_grasp_worker(nodes, capacity, times):
+    grasp_worker['nodes'] = nodes
+    grasp_worker['capacity'] = capacity
+    grasp_worker['times'] = times
+    grasp_worker['cache'] = ScoreCache(nodes, times)
 
-                if current_load + next_customer.q <= capacity:
-                    route.append(next_customer)
-                    current_load += next_customer.q
-                    customers.remove(next_customer)
-                else:
-                    break
 
-            route.append(depot)  # Return to depot at the end of the route
-            routes.append(route)
 
-        # Calculate total distance for the current solution
-        total_distance = calculate_total_distance(routes, times)
-        if total_distance < best_distance:
-            best_distance = total_distance
-            best_routes = routes
+# Function to run one seeded construction of a block (in a worker process or in this one)
+def seeded_grasp_construction(task):
+    alpha, construction_seed = task
+    routes = grasp_construction(grasp_worker['nodes'], grasp_worker['capacity'], grasp_worker['cache'], alpha,
+                                rng=random.Random(construction_seed))
+    return routes, calculate_total_distance(routes, grasp_worker['times'])
 
-        # Update probabilities based on the current alpha
-        for alpha_key in alpha_probs:
-            if alpha_key == alpha:
-                alpha_probs[alpha_key] += 1 / (1 + total_distance - best_distance)
-            else:
-                alpha_probs[alpha_key] = max(min_prob, alpha_probs[alpha_key] - 1 / (1 + total_distance - best_distance))
-
-        # Normalize probabilities
-        total_prob = sum(alpha_probs.values())
-        if total_prob == 0 or total_prob != total_prob:  # Handle edge cases
-            alpha_probs = {alpha: 1/len(alphas) for alpha in alphas}
-        else:
-            alpha_probs = {k: v / total_prob for k, v in alpha_probs.items()}
+
+
+def batched_reactive_grasp(nodes, capacity, times, alphas = list(np.arange(0.03, 0.3, 0.1)), iterations=100,
+                           block_size=10, workers=1, seed=15):
+    """
+    Reactive GRASP in blocks of independent constructions.
+    The alphas of a block are drawn from the current alpha_probs, every construction gets its own
+    random.Random seeded from SeedSequence([seed, construction number]) and the block results are reduced
+    in construction order with the same best-solution and alpha_probs update as reactive_grasp_route_selection.
+    The result only depends on seed and block_size, workers=1 runs the same computation in this process.
+    Because the constructions draw from their own generators instead of the global random module, workers=1 does
+    not reproduce the solutions of reactive_grasp_route_selection, only the same learning scheme.
+    :param nodes: List of nodes (depot + customers).
+    :param capacity: Vehicle capacity.
+    :param times: Matrix of travel times between nodes.
+    :param alphas: Candidate RCL sizes (fractions of the feasible customers).
+    :param iterations: Total number of constructions.
+    :param block_size: Constructions run with the same alpha_probs between two updates.
+    :param workers: Number of worker processes for the constructions of a block.
+    :param seed: Seed of the alpha draws and of the constructions.
+    :return: Best routes found and their total distance.
+    """
+    alpha_probs = {alpha: 1/len(alphas) for alpha in alphas}  # Initialize probabilities for each alpha
+    best_routes = None
+    best_distance = float('inf')
+    min_prob = 1e-6  # Minimum threshold for probabilities
+    alpha_rng = random.Random(seed)  # Draws the alphas of each block
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_grasp_worker, initargs=(nodes, capacity, times))
+    else:
+        init_grasp_worker(nodes, capacity, times)
+
+    try:
+        for block_start in range(0, iterations, block_size):
+            # Choose the alphas of the whole block with the probabilities learned so far
+            block = range(block_start, min(block_start + block_size, iterations))
+            block_alphas = alpha_rng.choices(list(alpha_probs.keys()), weights=alpha_probs.values(), k=len(block))
+            tasks = [(alpha, int(np.random.SeedSequence([seed, k]).generate_state(1)[0])) for alpha, k in zip(block_alphas, block)]
+            results = executor.map(seeded_grasp_construction, tasks) if executor else map(seeded_grasp_construction, tasks)
+
+            # Reduce in construction order so the learning does not depend on the number of workers
+            for alpha, (routes, total_distance) in zip(block_alphas, results):
+                if total_distance < best_distance:
+                    best_distance = total_distance
+                    best_routes = routes
+                alpha_probs = update_alpha_probs(alpha_probs, alpha, total_distance, best_distance, alphas, min_prob)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     return best_routes, best_distance
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+
+# Compact binary storage of solutions: one .npz archive per method, one entry per instance.
+# Each instance keeps its routes as a flat int32 buffer of node indexes plus the offsets where every route starts,
+# next to the total distance, the number of routes K and the computation time (all stored exactly).
+
+# Folders where the later stages read the constructive solutions (paths from the repository root)
+stage_input_folders = ['2-local-search/constructive-results', '3-neighborhood-search/constructive-results',
+                       '4-evolutionary-methods/constructive-results']
+
+# Flat int32 buffer and int64 offsets (route r is buffer[offsets[r]:offsets[r + 1]]) from routes of indexes or of Node objects
+def pack_routes(routes):
+    route_indexes = [[node.index for node in route] if route and hasattr(route[0], 'index') else route for route in routes]
+    lengths = [len(route) for route in route_indexes]
+    offsets = np.zeros(len(route_indexes) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    buffer = np.concatenate([np.asarray(route, dtype=np.int32) for route in route_indexes]) if route_indexes else np.zeros(0, dtype=np.int32)
+    return buffer, offsets
+
+# Route index arrays (views on the buffer) from a flat buffer and its offsets
+def unpack_routes(buffer, offsets):
+    return np.split(buffer, offsets[1:-1])
+
+# Save several solutions in one archive: solutions maps a name (e.g. 'VRPTW1') to a dict with 'routes', 'distance' and 'time'
+def save_solutions(path, solutions):
+    arrays = {}
+    for name, solution in solutions.items():
+        buffer, offsets = pack_routes(solution['routes'])
+        arrays[f'{name}/routes'] = buffer
+        arrays[f'{name}/offsets'] = offsets
+        arrays[f'{name}/distance'] = np.float64(solution['distance'])
+        arrays[f'{name}/K'] = np.int64(len(offsets) - 1)
+        arrays[f'{name}/time'] = np.float64(solution['time'])
+    np.savez(path, **arrays)  # Uncompressed: loading is a plain memory copy
+
+# Load every solution of an archive: name -> dict with 'routes' (int32 index arrays), 'distance', 'K' and 'time'
+def load_solutions(path):
+    solutions = {}
+    with np.load(path) as archive:
+        for key in archive.files:
+            name, field = key.rsplit('/', 1)
+            solutions.setdefault(name, {})[field] = archive[key]
+    for name, solution in solutions.items():
+        solutions[name] = {'routes': unpack_routes(solution['routes'], solution['offsets']),
+                           'distance': float(solution['distance']),
+                           'K': int(solution['K']),
+                           'time': float(solution['time'])}
+    return solutions
+
+# Save the solutions of a method where every later stage reads them (<folder>/VRPTW_tm_<method>.npz)
+def export_solutions(method, solutions, folders=stage_input_folders):
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+        save_solutions(os.path.join(folder, f'VRPTW_tm_{method}.npz'), solutions)
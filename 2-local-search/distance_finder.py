@@ -7,14 +7,34 @@ def dist(n1, n2):
 
 
 
+# Build the full Euclidean distance matrix from coordinate arrays in a single batched operation
+def build_distance_matrix(x, y, dtype=np.float64, storage='symmetric'):
+    """
+    Compute every pairwise Euclidean distance at once.
+    :param x: Array-like of X-coordinates, one per node (in node index order).
+    :param y: Array-like of Y-coordinates, one per node (in node index order).
+    :param dtype: np.float64 (same values as dist) or np.float32 (half the memory).
+    :param storage: 'symmetric' for the full n x n matrix, 'upper' to keep only the upper triangle (zeros below the diagonal).
+    :return: Matrix of distances between all nodes.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    dx = x[:, None] - x[None, :]  # Pairwise X differences (n x n)
+    dy = y[:, None] - y[None, :]  # Pairwise Y differences (n x n)
+    matrix = np.sqrt(dx ** 2 + dy ** 2)  # Same operations as dist, so float64 results match it bit for bit
+    if storage == 'upper':
+        matrix = np.triu(matrix)
+    elif storage != 'symmetric':
+        raise ValueError(f"Unknown storage '{storage}', use 'symmetric' or 'upper'")
+    return matrix.astype(dtype, copy=False)
+
+
+
 # Generate a matrix of travel times (or distances) between all nodes
-def distance_matrix_generator(nodes):
-    n = len(nodes)
-    travel_times = np.zeros((n, n))  # Initialize an empty matrix of size n x n
-    for i in range(n):
-        for j in range(n):
-            travel_times[i][j] = dist(nodes[i], nodes[j])  # Compute distance between nodes i and j
-    return travel_times
+def distance_matrix_generator(nodes, dtype=np.float64, storage='symmetric'):
+    x = [node.x for node in nodes]  # Nodes are stored in index order, so row i is node i
+    y = [node.y for node in nodes]
+    return build_distance_matrix(x, y, dtype=dtype, storage=storage)
 
 
 
@@ -27,6 +47,187 @@ def calculate_route_distance(route, times):
 
 
 
+# Distance of a route given as an integer index array (e.g. the route index arrays handed over by run_pipeline)
+def calculate_route_distance_from_indexes(indexes, times):
+    indexes = np.asarray(indexes)
+    arcs = np.asarray(times)[indexes[:-1], indexes[1:]]  # Gather every arc length at once
+    return sum(arcs.tolist(), 0.0)  # Added in route order, same value as calculate_route_distance
+
+
+
+# Total distance of routes given as integer index arrays
+def calculate_total_distance_from_indexes(route_indexes, times):
+    return sum(calculate_route_distance_from_indexes(indexes, times) for indexes in route_indexes)
+
+
+
 # Calculate the total distance for all routes
 def calculate_total_distance(routes, times):
-    return sum(calculate_route_distance(route, times) for route in routes)  # Sum up the distance of all routes
\ No newline at end of file
+    return sum(calculate_route_distance(route, times) for route in routes)  # Sum up the distance of all routes
+
+
+
+# -----------------------------------------------------------------------------------------------------------
+# Move deltas: change in distance of a move computed in O(1) from its endpoints (symmetric distances)
+
+# Reverse route[i..j] (2-opt inside a route)
+def two_opt_delta(route, i, j, times):
+    a, b, c, d = route[i - 1].index, route[i].index, route[j].index, route[j + 1].index
+    return times[a][c] + times[b][d] - times[a][b] - times[c][d]
+
+
+
+# Move route[i:i+length] so that it ends up at position j of the route without it (or-opt inside a route)
+def or_opt_delta(route, i, length, j, times):
+    first, last = route[i].index, route[i + length - 1].index
+    before, after = route[i - 1].index, route[i + length].index
+    if j == i:
+        return 0.0  # Segment goes back where it was
+    removal = times[before][after] - times[before][first] - times[last][after]
+    # Neighbours of position j in the route without the segment
+    prev_node = (route[j - 1] if j <= i else route[j - 1 + length]).index
+    next_node = (route[j] if j < i else route[j + length]).index
+    insertion = times[prev_node][first] + times[last][next_node] - times[prev_node][next_node]
+    return removal + insertion
+
+
+
+# Remove arcs (i-1, i), (j, j+1) and (k, k+1) and reconnect B = route[i..j] and C = route[j+1..k] (3-opt inside a route)
+# Reconnections that replace the three arcs (' marks a reversed segment): 0 = A B' C' D, 1 = A C B D (or-opt), 2 = A C B' D, 3 = A C' B D
+def three_opt_delta(route, i, j, k, reconnection, times):
+    a, b, c = route[i - 1].index, route[i].index, route[j].index
+    d, e, f = route[j + 1].index, route[k].index, route[k + 1].index
+    removed = times[a][b] + times[c][d] + times[e][f]
+    if reconnection == 0:
+        return times[a][c] + times[b][e] + times[d][f] - removed
+    if reconnection == 1:
+        return times[a][d] + times[e][b] + times[c][f] - removed
+    if reconnection == 2:
+        return times[a][d] + times[e][c] + times[b][f] - removed
+    return times[a][e] + times[d][b] + times[c][f] - removed
+
+
+
+# three_opt_delta of every (j, k) with i <= j < k <= len(route) - 2 at once: array (reconnection, j - i, k - i - 1)
+# Entries are nan where k <= j and, given a granular_matrix, where no new arc of the move is granular (as in the
+# inter-route moves, one granular arc is enough)
+def three_opt_deltas(indexes, i, times, allowed=None):
+    times = np.asarray(times)
+    indexes = np.asarray(indexes)
+    n = len(indexes)
+    a, b = indexes[i - 1], indexes[i]
+    c, d = indexes[i:n - 2][:, None], indexes[i + 1:n - 1][:, None]      # One row per j
+    e, f = indexes[i + 1:n - 1][None, :], indexes[i + 2:n][None, :]      # One column per k
+    removed = times[a, b] + times[c, d] + times[e, f]
+    deltas = np.stack([times[a, c] + times[b, e] + times[d, f],
+                       times[a, d] + times[e, b] + times[c, f],
+                       times[a, d] + times[e, c] + times[b, f],
+                       times[a, e] + times[d, b] + times[c, f]]) - removed
+    invalid = ~np.triu(np.ones((n - 2 - i, n - 2 - i), dtype=bool))
+    if allowed is None:
+        deltas[:, invalid] = np.nan
+    else:
+        granular = np.stack([allowed[a, c] | allowed[b, e] | allowed[d, f],
+                             allowed[a, d] | allowed[e, b] | allowed[c, f],
+                             allowed[a, d] | allowed[e, c] | allowed[b, f],
+                             allowed[a, e] | allowed[d, b] | allowed[c, f]])
+        deltas[~granular | invalid] = np.nan
+    return deltas
+
+
+
+# Exchange route1[i] and route2[j] (swap between routes)
+def swap_delta(route1, i, route2, j, times):
+    a, b = route1[i].index, route2[j].index
+    a_prev, a_next = route1[i - 1].index, route1[i + 1].index
+    b_prev, b_next = route2[j - 1].index, route2[j + 1].index
+    return (times[a_prev][b] + times[b][a_next] - times[a_prev][a] - times[a][a_next] +
+            times[b_prev][a] + times[a][b_next] - times[b_prev][b] - times[b][b_next])
+
+
+
+# Exchange route[i] and route[j] of the same route, i < j (adjacent positions share an arc)
+def exchange_delta(route, i, j, times):
+    a, b = route[i].index, route[j].index
+    a_prev, a_next = route[i - 1].index, route[i + 1].index
+    b_prev, b_next = route[j - 1].index, route[j + 1].index
+    if j == i + 1:
+        return times[a_prev][b] + times[a][b_next] - times[a_prev][a] - times[b][b_next]
+    return (times[a_prev][b] + times[b][a_next] - times[a_prev][a] - times[a][a_next] +
+            times[b_prev][a] + times[a][b_next] - times[b_prev][b] - times[b][b_next])
+
+
+
+# Move route_from[i:i+length] in front of route_to[k] (relocate between routes)
+def relocate_delta(route_from, i, length, route_to, k, times):
+    first, last = route_from[i].index, route_from[i + length - 1].index
+    before, after = route_from[i - 1].index, route_from[i + length].index
+    prev_node, next_node = route_to[k - 1].index, route_to[k].index
+    return (times[before][after] - times[before][first] - times[last][after] +
+            times[prev_node][first] + times[last][next_node] - times[prev_node][next_node])
+
+
+
+# Exchange route1[i:i+length1] and route2[j:j+length2] keeping their orientation (CROSS exchange between routes)
+def cross_delta(route1, i, length1, route2, j, length2, times):
+    a_prev, a_first, a_last, a_next = route1[i - 1].index, route1[i].index, route1[i + length1 - 1].index, route1[i + length1].index
+    b_prev, b_first, b_last, b_next = route2[j - 1].index, route2[j].index, route2[j + length2 - 1].index, route2[j + length2].index
+    return (times[a_prev][b_first] + times[b_last][a_next] + times[b_prev][a_first] + times[a_last][b_next] -
+            times[a_prev][a_first] - times[a_last][a_next] - times[b_prev][b_first] - times[b_last][b_next])
+
+
+
+# Exchange the tails route1[i:] and route2[j:] (2-opt* between routes)
+def two_opt_star_delta(route1, i, route2, j, times):
+    a_prev, a = route1[i - 1].index, route1[i].index
+    b_prev, b = route2[j - 1].index, route2[j].index
+    return times[a_prev][b] + times[b_prev][a] - times[a_prev][a] - times[b_prev][b]
+
+
+
+# -----------------------------------------------------------------------------------------------------------
+# Granular neighborhoods: short candidate lists of promising arcs, built once per instance
+
+# For each node, its k nearest customers that can be visited right after it without breaking their time windows
+def build_granular_neighbors(nodes, times, k=20):
+    times = np.asarray(times)
+    inf = np.array([node.inf for node in nodes], dtype=np.float64)
+    sup = np.array([node.sup for node in nodes], dtype=np.float64)
+    t_serv = np.array([node.t_serv for node in nodes], dtype=np.float64)
+
+    # Arc i -> j is reachable if serving i as early as possible still lets the vehicle reach j in time
+    reachable = (inf + t_serv)[:, None] + times <= sup[None, :]
+    candidates = np.where(reachable, times, np.inf)
+    np.fill_diagonal(candidates, np.inf)
+    candidates[:, 0] = np.inf                                   # Arcs to and from the depot are always allowed (see is_granular_arc)
+
+    neighbors = [set()]
+    for i in range(1, len(nodes)):
+        row = candidates[i]
+        count = min(k, int(np.isfinite(row).sum()))
+        nearest = np.argpartition(row, count - 1)[:count] if count > 0 else []
+        neighbors.append(set(int(j) for j in nearest))
+    return neighbors
+
+
+
+# Check if arc a -> b (node indexes) belongs to the granular neighborhood (always true without one)
+def is_granular_arc(neighbors, a, b):
+    return neighbors is None or a == 0 or b == 0 or b in neighbors[a]
+
+
+
+# Insertion of customer between prev_node and next_node creates an arc of the granular neighborhood (always true without one)
+def is_granular_insertion(neighbors, prev_node, customer, next_node):
+    return is_granular_arc(neighbors, prev_node.index, customer.index) or is_granular_arc(neighbors, customer.index, next_node.index)
+
+
+
+# Boolean matrix version of is_granular_arc (every arc allowed without a neighborhood)
+def granular_matrix(neighbors, num_nodes):
+    allowed = np.ones((num_nodes, num_nodes), dtype=bool)
+    if neighbors is not None:
+        allowed[1:, 1:] = False
+        for a in range(1, num_nodes):
+            allowed[a, list(neighbors[a])] = True
+    return allowed
@@ -1,5 +1,9 @@
+import numpy as np
+
 # Define a class for representing a Node (or customer) in the VRPTW problem
 class Node:
+    __slots__ = ('index', 'x', 'y', 'q', 'inf', 'sup', 't_serv')  # No per-node __dict__: smaller objects and faster attribute access
+
     def __init__(self, index, x, y, q, inf, sup, t_serv):
         self.index = index  # Node ID
         self.x = x          # X-coordinate
@@ -11,22 +15,46 @@ class Node:
 
 
 
-# Function to read input data from a text file and create a list of nodes
-def read_txt_file(file_path):
+# Structure-of-arrays storage of an instance: one NumPy array per attribute, indexed by node index
+class Instance:
+    def __init__(self, capacity, index, x, y, q, inf, sup, t_serv):
+        self.capacity = capacity                    # Vehicle capacity
+        self.index = np.asarray(index)              # Node ids (first column of the file)
+        self.x = np.asarray(x)                      # X-coordinates
+        self.y = np.asarray(y)                      # Y-coordinates
+        self.q = np.asarray(q)                      # Demands
+        self.inf = np.asarray(inf)                  # Time window starts
+        self.sup = np.asarray(sup)                  # Time window ends
+        self.t_serv = np.asarray(t_serv)            # Service times
+        self._nodes = None
+
+    def __len__(self):
+        return len(self.x)
+
+    # Thin Node views over the arrays for the code that works with Node objects (built once per instance)
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            columns = [self.x.tolist(), self.y.tolist(), self.q.tolist(), self.inf.tolist(), self.sup.tolist(), self.t_serv.tolist()]
+            self._nodes = [Node(*values) for values in zip(self.index.tolist(), *columns)]
+        return self._nodes
+
+
+
+# Function to read an instance file directly into arrays
+def read_instance(file_path):
     with open(file_path, 'r') as file:
-        lines = file.readlines()  # Read all lines from the file
+        first_line = file.readline().strip().split()  # Number of nodes (n) and vehicle capacity (Q)
+        data = np.loadtxt(file, dtype=np.int64, ndmin=2)  # Row i is node i: index, x, y, q, inf, sup, t_serv (all integers)
 
-        # First line contains the number of nodes (n) and vehicle capacity (Q)
-        first_line = lines[0].strip().split()
-        n = int(first_line[0])  # Number of nodes
-        Q = int(first_line[1])  # Vehicle capacity
+    if not np.array_equal(data[:, 0], np.arange(len(data))):
+        raise ValueError(f"Node ids in {file_path} must be 0, 1, ..., n in row order")  # Distance matrices are indexed by row
+    instance = Instance(int(first_line[1]), data[:, 0], data[:, 1], data[:, 2], data[:, 3], data[:, 4], data[:, 5], data[:, 6])
+    return int(first_line[0]), instance
 
-        nodes = []  # Initialize an empty list to store Node objects
 
-        # For each line representing a node, create a Node object and append it to the list
-        for line in lines[1:]:
-            parts = list(map(int, line.strip().split()))  # Convert each line into a list of integers
-            node = Node(parts[0], parts[1], parts[2], parts[3], parts[4], parts[5], parts[6])
-            nodes.append(node)  # Add the node to the list
 
-    return n, Q, nodes  # Return the number of nodes, vehicle capacity, and list of nodes
+# Function to read input data from a text file and create a list of nodes
+def read_txt_file(file_path):
+    n, instance = read_instance(file_path)
+    return n, instance.capacity, instance.nodes  # Return the number of nodes, vehicle capacity, and list of nodes
@@ -1,9 +1,10 @@
 import time
 from file_reader import read_txt_file
-from solution_interpreter import info_of_all_routes
-from distance_finder import distance_matrix_generator, calculate_route_distance ,calculate_total_distance
-from neighborhoods import interchange_two_positions, two_opt, three_opt, length_L_reinsertion
-from file_writer import save_to_excel
+from solution_interpreter import info_of_all_routes, info_of_stored_routes
+from solution_store import load_solutions, solution_path
+from distance_finder import distance_matrix_generator, calculate_route_distance ,calculate_total_distance, build_granular_neighbors, granular_matrix
+from neighborhoods import interchange_two_positions, two_opt, three_opt, length_L_reinsertion, local_search
+from file_writer import save_to_excel, new_result_workbook
 from gap_calculator import read_lower_bounds, write_GAP_excel
 from openpyxl import Workbook
 
@@ -11,17 +12,20 @@ from openpyxl import Workbook
 
 initial_method = 'ACO'                                # Select between 'constructive', 'GRASP' or 'ACO'
 neighborhood_method = 'length_L_reinsertion'                  # Select between 'Change2Indexes', '2-opt', '3-opt', 'length_L_reinsertion', destroy_route', 'VND'
+improvement = 'best'                                  # Select between 'best' or 'first' improvement (Change2Indexes, 2-opt and 3-opt)
+granular_k = 20                                       # Nearest feasible neighbors per customer considered by 3-opt
+local_optimum = True                                  # Repeat the neighborhood until no improving move remains (False: a single pass)
 
 instances_directory_path = 'VRPTW Instances'
 excel_path = f'C:\\Users\\thomm\\Documents\\GitHub\\heuristica\\2-local-search\\local-search-results\\{initial_method}\\VRTPW_tm_{initial_method}_LS_{neighborhood_method}.xlsx'
-initial_solution_path = f'C:\\Users\\thomm\\Documents\\GitHub\\heuristica\\2-local-search\\constructive-results\\VRPTW_tm_{initial_method}.xlsx'
+initial_solution_path = solution_path('C:\\Users\\thomm\\Documents\\GitHub\\heuristica\\2-local-search\\constructive-results', initial_method)  # .npz of stage 1, else .xlsx
 GAP_excel_path = f'C:\\Users\\thomm\\Documents\\GitHub\\heuristica\\2-local-search\\local-search-results\\{initial_method}\\gaps\\GAPs_for_{initial_method}_with_{neighborhood_method}.xlsx'
 LB_file_directory = 'C:\\Users\\thomm\\Documents\\GitHub\\heuristica\\VRPTW Instances\\LB_VRPTW.xlsx'
 
 
 
-wb = Workbook()             # Initialize a new Excel workbook
-wb.remove(wb.active)        # Remove the default empty sheet
+stored_solutions = load_solutions(initial_solution_path) if initial_solution_path.endswith('.npz') else None  # Read once for all instances
+wb = new_result_workbook()  # Write-only workbook, each sheet is streamed as it is written
 all_18_routes = []
 computation_times = []
 D = []
@@ -36,9 +40,13 @@ for i in range(1, 19, 1):
     # Read the number of nodes, vehicle capacity, and nodes (customers) from the file
     n, Q, nodes = read_txt_file(instance_filename)
     distances = distance_matrix_generator(nodes)                                            # Calculate the travel time matrix
+    granular_arcs = granular_matrix(build_granular_neighbors(nodes, distances, granular_k), len(distances)) if neighborhood_method == '3-opt' else None  # Arcs kept by 3-opt
 
-    # Initial solution from excel
-    initial_solution, constructive_total_distance, constructive_execution_time = info_of_all_routes(initial_solution_path, sheet_name)
+    # Initial solution from the binary archive of stage 1, or from excel if there is none
+    if stored_solutions is not None:
+        initial_solution, constructive_total_distance, constructive_execution_time = info_of_stored_routes(stored_solutions[sheet_name], nodes)
+    else:
+        initial_solution, constructive_total_distance, constructive_execution_time = info_of_all_routes(initial_solution_path, sheet_name)
 
     for route_data in initial_solution:
         route_data['route_objects'] = [nodes[node_index] for node_index in route_data['route_indexes']]
@@ -46,17 +54,20 @@ for i in range(1, 19, 1):
     start_time = time.time()
 
     local_search_results = []
+    route_states = None  # Schedules kept by local_search, the single passes leave them to save_to_excel
 
     # Neighborhood selection and LS
-    if neighborhood_method == 'Change2Indexes':
+    if local_optimum and neighborhood_method in ['Change2Indexes', '2-opt', '3-opt', 'length_L_reinsertion']:
+        local_search_results, route_states = local_search(initial_solution, neighborhood_method, Q, distances, improvement, L=3, granular_arcs=granular_arcs, return_states=True)
+    elif neighborhood_method == 'Change2Indexes':
         for i in initial_solution:
-            local_search_results.append(interchange_two_positions(i, distances=distances))
+            local_search_results.append(interchange_two_positions(i, distances=distances, improvement=improvement))
     elif neighborhood_method == '2-opt':
         for i in initial_solution:
-            local_search_results.append(two_opt(i, distances=distances))
+            local_search_results.append(two_opt(i, distances=distances, improvement=improvement))
     elif neighborhood_method == '3-opt':
         for i in initial_solution:
-            local_search_results.append(three_opt(i, distances=distances))
+            local_search_results.append(three_opt(i, distances=distances, improvement=improvement, allowed=granular_arcs))
     elif neighborhood_method == 'length_L_reinsertion':
         local_search_results = length_L_reinsertion(initial_solution, capacity = Q, distances = distances, L = 3)
     # elif neighborhood_method == 'destroy_routes':
@@ -75,7 +86,7 @@ for i in range(1, 19, 1):
     all_18_routes.append(routes)
 
     D.append(calculate_total_distance(routes, distances))
-    save_to_excel(wb, f'VRPTW{sheet_number}', routes, calculate_total_distance(routes, distances), computation_time = computation_time_ls + constructive_execution_time, times=distances)
+    save_to_excel(wb, f'VRPTW{sheet_number}', routes, calculate_total_distance(routes, distances), computation_time = computation_time_ls + constructive_execution_time, times=distances, route_states=route_states)
 
 wb.save(excel_path)
 
@@ -1,24 +1,45 @@
-from feasibility import is_feasible, is_time_feasible
-from distance_finder import calculate_route_distance, calculate_total_distance
+import numpy as np
+from feasibility import RouteState, node_segment, concatenate, is_concatenation_feasible
+from distance_finder import exchange_delta, two_opt_delta, three_opt_deltas, cross_delta
+
+
+# -----------------------------------------------------------------------------------------------------------
+# Intra-route moves: O(1) delta cost first, then O(1) time-window check on prefix/suffix segments of the route.
+# Only the accepted move builds a new route. improvement='best' applies the best move of the neighborhood,
+# improvement='first' applies the first improving one.
+
+def apply_intra_route_move(x_dict, x_prime):
+    x_dict['route_objects'] = x_prime
+    x_dict['route_indexes'] = [node.index for node in x_prime]
+    return x_dict
 
 
 # -----------------------------------------------------------------------------------------------------------
 # Interchange two positions
 
-def interchange_two_positions(x_dict, distances):         # x is a node object
+def interchange_two_positions(x_dict, distances, improvement='best', state=None):         # x is a node object
     x = x_dict['route_objects']
-    best = x
+    state = RouteState(x, distances) if state is None else state
+    best_move, best_delta = None, -1e-6
     R = len(x)
     for i in range(1, R-1):
+        before = state.prefix(i - 1)
+        middle, end = None, i + 1                   # Segment of x[i+1..end-1], only extended when a move needs it
         for j in range(i+1, R-1):
-            x_prime = x.copy()                      # Create a copy of x before making changes
-            x_prime = swap_two(x_prime, i, j)
-            if is_time_feasible(x_prime, distances):
-                if calculate_route_distance(x_prime, distances) < calculate_route_distance(best, distances):
-                    x_dict['route_objects'] = x_prime
-                    x_dict['route_indexes'] = [i.index for i in x_prime]
-                    best = x_prime
-
+            delta = exchange_delta(x, i, j, distances)
+            if delta >= best_delta:
+                continue
+            while end < j:
+                middle = node_segment(x[end]) if middle is None else concatenate(middle, node_segment(x[end]), distances)
+                end += 1
+            segments = [before, node_segment(x[j])] + ([middle] if middle is not None else []) + [node_segment(x[i]), state.suffix(j + 1)]
+            if is_concatenation_feasible(segments, distances, float('inf')):
+                best_move, best_delta = (i, j), delta
+                if improvement == 'first':
+                    return apply_intra_route_move(x_dict, swap_two(x.copy(), i, j))
+
+    if best_move is not None:
+        apply_intra_route_move(x_dict, swap_two(x.copy(), *best_move))
     return x_dict
 
 
@@ -32,18 +53,28 @@ def swap_two(arr, i,j):
 # -----------------------------------------------------------------------------------------------------------
 # 2-opt
 
-def two_opt(x_dict, distances):
+def two_opt(x_dict, distances, improvement='best', state=None):
     x = x_dict['route_objects']
-    best = x
+    state = RouteState(x, distances) if state is None else state
+    best_move, best_delta = None, -1e-6
     R = len(x)
     for i in range(1, R-1):
+        before = state.prefix(i - 1)
+        reversed_segment = None                     # Segment of x[j], x[j-1], ..., x[i]
         for j in range(i+1, R-1):
-            x_prime = invert_subsequence(x, i, j)
-            if is_time_feasible(x_prime, distances):
-                if calculate_route_distance(x_prime, distances) < calculate_route_distance(best, distances):
-                    x_dict['route_objects'] = x_prime
-                    x_dict['route_indexes'] = [i.index for i in x_prime]
-                    best = x_prime
+            reversed_segment = concatenate(node_segment(x[j]), reversed_segment or node_segment(x[i]), distances)
+            if not reversed_segment.feasible:
+                break                               # Longer reversals keep the same infeasible part
+            delta = two_opt_delta(x, i, j, distances)
+            if delta >= best_delta:
+                continue
+            if is_concatenation_feasible([before, reversed_segment, state.suffix(j + 1)], distances, float('inf')):
+                best_move, best_delta = (i, j), delta
+                if improvement == 'first':
+                    return apply_intra_route_move(x_dict, invert_subsequence(x, i, j))
+
+    if best_move is not None:
+        apply_intra_route_move(x_dict, invert_subsequence(x, *best_move))
     return x_dict
 
 
@@ -57,64 +88,60 @@ def invert_subsequence(seq, i, j):
 # -----------------------------------------------------------------------------------------------------------
 # 3-opt
 
-
-def three_opt(x_dict, distances):
+def three_opt(x_dict, distances, improvement='best', allowed=None, reversals=True, state=None):
     x = x_dict['route_objects']
-    best = x
-    R = len(x)
-    for i in range(1, R-1):
-        for j in range(i+1, R-1):
-            for k in range(j+1, R-1):
-                candidates = generate_three_opt_candidates(x.copy(), i, j, k)
-                for candidate in candidates:
-                    # Ensure the last node (zero) is not moved
-                    if candidate[-1] != 0:
-                        continue  # Skip this candidate if the last element is not zero
-
-                    if is_time_feasible(candidate, distances):
-                        print(2)
-                        if calculate_route_distance(candidate, distances) < calculate_route_distance(best, distances):
-                            best = candidate  # Update the best route if candidate is better
-                            print(1)
-
-    # Update the x_dict with the best solution found
-    x_dict['route_objects'] = best
-    x_dict['route_indexes'] = [node.index for node in best]  # Update route indexes if needed
-
+    move = find_three_opt_move(x, distances, float('inf'), allowed, reversals, improvement, state)
+    if move is not None:
+        apply_intra_route_move(x_dict, apply_three_opt(x, *move))
     return x_dict
 
 
+# Segment visiting route[p..q] (route[q..p] when reverse); each cached row is extended one node at a time when needed
+def cached_segment(cache, route, p, q, times, reverse=False):
+    row = cache.setdefault((p, reverse), [node_segment(route[p])])
+    while len(row) <= q - p:
+        node = node_segment(route[p + len(row)])
+        row.append(concatenate(node, row[-1], times) if reverse else concatenate(row[-1], node, times))
+    return row[q - p]
 
-def generate_three_opt_candidates(seq, i, j, k):
+
+def find_three_opt_move(route, times, capacity, allowed=None, reversals=True, improvement='best', state=None):
     """
-    Generate all unique and valid 3-opt reconnections by avoiding 2-opt moves.
+    Best (or first) improving 3-opt move of the route as (i, j, k, reconnection), None if there is none.
+    The cost of every reconnection comes from its six endpoint distances (three_opt_deltas, all (j, k) of an i at once);
+    time windows are only checked for improving moves, joining the prefix, the cached B and C segments (forward or
+    reversed) and the suffix. allowed is the granular_matrix of the instance (built once with the neighbor lists): at
+    least one new arc of the move must be granular. reversals=False keeps the or-opt reconnection only. state is the
+    RouteState of the route, built here when it is not given.
     """
-    subseq1 = seq[:i]      # First segment before i
-    subseq2 = seq[i:j+1]   # Second segment between i and j
-    subseq3 = seq[j+1:k+1] # Third segment between j and k
-    subseq4 = seq[k+1:]    # Remaining segment after k
-
-    # List to store all possible new reconnections
-    candidates = []
-
-    # Only generate combinations that involve at least two subsequences being altered
-
-    # 1. Reverse two subsequences, leave others intact
-    candidates.append(subseq1[::-1] + subseq2[::-1] + subseq3 + subseq4)  # Reverse subseq1 and subseq2
-    candidates.append(subseq1[::-1] + subseq2 + subseq3[::-1] + subseq4)  # Reverse subseq1 and subseq3
-    candidates.append(subseq1 + subseq2[::-1] + subseq3[::-1] + subseq4)  # Reverse subseq2 and subseq3
-
-    # 2. Reverse all three subsequences
-    candidates.append(subseq1[::-1] + subseq2[::-1] + subseq3[::-1] + subseq4)
-
-    # 3. Swap subsequences B and C (subseq2 and subseq3)
-    candidates.append(subseq1 + subseq3 + subseq2 + subseq4)              # Swap subseq2 and subseq3
-    candidates.append(subseq1[::-1] + subseq3 + subseq2 + subseq4[::-1])  # Swap subseq2 and subseq3, reverse subseq1 and subseq4
-
-    # 4. Reverse the order of subsequences in various combinations
-    candidates.append(subseq1 + subseq3[::-1] + subseq2[::-1] + subseq4)  # Reverse subseq3 and subseq2
-
-    return candidates
+    indexes = [node.index for node in route]
+    reconnections = np.array([0, 1, 2, 3] if reversals else [1])
+    moves = []                                      # Arrays (delta, i, j, k, reconnection) of the improving moves of every i
+    for i in range(1, len(route) - 2):
+        deltas = three_opt_deltas(indexes, i, times, allowed)[reconnections]
+        r, j, k = np.nonzero(deltas < -1e-6)
+        moves.append((deltas[r, j, k], np.full(len(r), i), i + j, i + 1 + k, reconnections[r]))
+    deltas, first, second, third, reconnection = (np.concatenate(column) for column in zip(*moves)) if moves else ([],) * 5
+    if len(deltas) == 0:
+        return None
+    order = np.argsort(deltas, kind='stable') if improvement == 'best' else range(len(deltas))
+
+    state = RouteState(route, times, capacity) if state is None else state
+    cache = {}
+    for move in order:
+        i, j, k, r = int(first[move]), int(second[move]), int(third[move]), int(reconnection[move])
+        b = cached_segment(cache, route, i, j, times, reverse=r in (0, 2))
+        c = cached_segment(cache, route, j + 1, k, times, reverse=r in (0, 3))
+        middle = (b, c) if r == 0 else (c, b)
+        if is_concatenation_feasible([state.prefix(i - 1), *middle, state.suffix(k + 1)], times, capacity):
+            return i, j, k, r
+    return None
+
+
+def apply_three_opt(route, i, j, k, reconnection):
+    a, b, c, d = route[:i], route[i:j+1], route[j+1:k+1], route[k+1:]
+    middle = (b[::-1] + c[::-1], c + b, c + b[::-1], c[::-1] + b)[reconnection]
+    return a + middle + d
 
 
 
@@ -122,9 +149,16 @@ def generate_three_opt_candidates(seq, i, j, k):
 # -----------------------------------------------------------------------------------------------------------
 # Remover dos secuencias y reinsertarlas en nuevas posiciones (entre rutas)
 
-def length_L_reinsertion(all_routes, capacity, distances, L=2):
+def length_L_reinsertion(all_routes, capacity, distances, L=2, improvement='first', active_routes=None, states=None):
+    # Intercambio CROSS: costo en O(1) (cross_delta) y factibilidad uniendo prefijo, subsecuencia y sufijo de cada ruta
+    # active_routes: solo se evalúan pares con alguna ruta de este conjunto (None evalúa todos)
+    # states: RouteState de cada ruta si ya se tienen (None los construye)
     x = [t['route_objects'] for t in all_routes]
     R = len(x)  # Número de rutas
+    if states is None:
+        states = [RouteState(route, distances, capacity) for route in x]  # Cargas y horarios de cada ruta
+    caches = [{} for _ in range(R)]  # Subsecuencias de cada ruta (cached_segment)
+    best_move, best_delta = None, -1e-6
 
     for l1 in range(L, 0, -1):  # Bucle para la longitud de la subsecuencia en la primera ruta
         for l2 in range(L, 0, -1):  # Bucle para la longitud de la subsecuencia en la segunda ruta
@@ -134,40 +168,106 @@ def length_L_reinsertion(all_routes, capacity, distances, L=2):
                 if len(route1) - 2 <= l1:  # Verificar que route1 tiene una subsecuencia de longitud l1
                     continue  # Si no es suficiente, saltar
 
-                for i2 in range(1, len(route1) - 1 - l1 + 1):  # Posición inicial de subsecuencia en route1
-                    subseq1 = route1[i2 : i2 + l1]  # Extraer subsecuencia de longitud l1
+                # Segundas rutas posibles: con active_routes, solo pares con alguna ruta activa
+                partners = [j for j in range(i + 1, R) if active_routes is None or i in active_routes or j in active_routes]
 
-                    for j in range(i + 1, R):  # Iterar sobre la segunda ruta
+                for i2 in range(1, len(route1) - 1 - l1 + 1):  # Posición inicial de subsecuencia en route1
+                    for j in partners:  # Iterar sobre la segunda ruta
                         route2 = x[j]
                         if len(route2) - 2 < l2:  # Verificar que route2 tiene una subsecuencia de longitud l2
                             continue  # Si no es suficiente, saltar
 
                         for j2 in range(1, len(route2) - 1 - l2 + 1):  # Posición inicial en route2
-                            subseq2 = route2[j2 : j2 + l2]  # Extraer subsecuencia de longitud l2
+                            # Evaluar primero el costo; solo los intercambios que mejoran se revisan
+                            delta = cross_delta(route1, i2, l1, route2, j2, l2, distances)
+                            if delta >= best_delta:
+                                continue
+
+                            # Verificar factibilidad sin construir las nuevas rutas
+                            subseq1 = cached_segment(caches[i], route1, i2, i2 + l1 - 1, distances)
+                            subseq2 = cached_segment(caches[j], route2, j2, j2 + l2 - 1, distances)
+                            if (is_concatenation_feasible([states[i].prefix(i2 - 1), subseq2, states[i].suffix(i2 + l1)], distances, capacity) and
+                                    is_concatenation_feasible([states[j].prefix(j2 - 1), subseq1, states[j].suffix(j2 + l2)], distances, capacity)):
+                                best_move, best_delta = (i, i2, l1, j, j2, l2), delta
+                                if improvement == 'first':
+                                    return apply_cross_exchange(all_routes, *best_move)  # Retornar al encontrar la primera mejora
+
+    if best_move is not None:
+        apply_cross_exchange(all_routes, *best_move)  # Aplicar el mejor intercambio
+    return all_routes  # Retornar si no se encuentran mejoras
 
-                            # Crear nuevas rutas con subsecuencias intercambiadas
-                            new_route1 = route1[:i2] + subseq2 + route1[i2 + l1:]
-                            new_route2 = route2[:j2] + subseq1 + route2[j2 + l2:]
 
-                            # Verificar factibilidad
-                            if is_feasible(new_route1, capacity, distances) and is_feasible(new_route2, capacity, distances):
-                                # Evaluar si la nueva solución es mejor
-                                if calculate_route_distance(new_route1, distances) + calculate_route_distance(new_route2, distances) < \
-                                   calculate_route_distance(x[i], distances) + calculate_route_distance(x[j], distances):
+def apply_cross_exchange(all_routes, i, i2, l1, j, j2, l2):
+    route1, route2 = all_routes[i]['route_objects'], all_routes[j]['route_objects']
 
-                                    # Actualizar la mejor solución encontrada
-                                    all_routes[i]['route_objects'] = new_route1
-                                    all_routes[i]['route_indexes'] = [t.index for t in new_route1]
+    # Crear nuevas rutas con subsecuencias intercambiadas
+    new_route1 = route1[:i2] + route2[j2 : j2 + l2] + route1[i2 + l1:]
+    new_route2 = route2[:j2] + route1[i2 : i2 + l1] + route2[j2 + l2:]
+
+    all_routes[i]['route_objects'] = new_route1
+    all_routes[i]['route_indexes'] = [t.index for t in new_route1]
+
+    all_routes[j]['route_objects'] = new_route2
+    all_routes[j]['route_indexes'] = [t.index for t in new_route2]
+    return all_routes
 
-                                    all_routes[j]['route_objects'] = new_route2
-                                    all_routes[j]['route_indexes'] = [t.index for t in new_route2]
 
-                                    return all_routes  # Retornar al encontrar la primera mejora
-    return all_routes  # Retornar si no se encuentran mejoras
 
 
 
 
+# -----------------------------------------------------------------------------------------------------------
+# Local search to a local optimum with don't-look bits per route
+
+intra_route_neighborhoods = {'Change2Indexes': interchange_two_positions, '2-opt': two_opt, '3-opt': three_opt}
+
+
+def local_search(all_routes, neighborhood_method, capacity, distances, improvement='best', L=3, granular_arcs=None, return_states=False):
+    """
+    Apply the neighborhood until no improving move remains. A route that was scanned without finding an improving move
+    (inside it, or with any other route for length_L_reinsertion) is not scanned again until it changes.
+    :param all_routes: List of route dicts with 'route_objects' and 'route_indexes' (updated in place).
+    :param neighborhood_method: 'Change2Indexes', '2-opt', '3-opt' or 'length_L_reinsertion'.
+    :param improvement: 'best' or 'first' for the intra-route neighborhoods. length_L_reinsertion always takes the
+                        first improving exchange, as in its single pass.
+    :param granular_arcs: granular_matrix of the granular neighbor lists for 3-opt, None considers every move.
+    :param return_states: Also return the RouteState of every final route (schedules for save_to_excel).
+    :return: all_routes at a local optimum of the neighborhood, or (all_routes, route_states) with return_states.
+    """
+    if neighborhood_method in intra_route_neighborhoods:
+        move = intra_route_neighborhoods[neighborhood_method]
+        extra = {'allowed': granular_arcs} if neighborhood_method == '3-opt' else {}
+        states = []
+        for x_dict in all_routes:
+            state = RouteState(x_dict['route_objects'], distances, capacity)
+            while True:
+                route = x_dict['route_objects']
+                move(x_dict, distances, improvement=improvement, state=state, **extra)
+                if x_dict['route_objects'] is route:
+                    break  # Don't-look bit: intra-route moves of other routes cannot change this one
+                state = RouteState(x_dict['route_objects'], distances, capacity)
+            states.append(state)
+        return (all_routes, states) if return_states else all_routes
+
+    if neighborhood_method != 'length_L_reinsertion':
+        raise ValueError(f"Unknown neighborhood method '{neighborhood_method}'")
+
+    active = set(range(len(all_routes)))  # Don't-look bits: routes whose pairs must be scanned again
+    states = [RouteState(t['route_objects'], distances, capacity) for t in all_routes]  # Only changed routes are rebuilt
+    while active:
+        r = min(active)
+        previous = [t['route_objects'] for t in all_routes]
+        length_L_reinsertion(all_routes, capacity, distances, L, 'first', active_routes={r}, states=states)
+        changed = {s for s in range(len(all_routes)) if all_routes[s]['route_objects'] is not previous[s]}
+        for s in changed:
+            states[s] = RouteState(all_routes[s]['route_objects'], distances, capacity)
+        if changed:
+            active |= changed  # Both routes of the exchange are scanned again
+        else:
+            active.discard(r)  # No improving exchange with any other route until one of them changes
+    return (all_routes, states) if return_states else all_routes
+
+
 
 
 # -----------------------------------------------------------------------------------------------------------
@@ -17,7 +17,7 @@ def select_operator(operators, operator_scores):
     return operators[-1]
 
 # ALNS algorithm
-def alns_algorithm(routes, times, capacity, destroy_operators, repair_operators, time_limit, start_time, alpha=10.0, beta=450.0):
+def alns_algorithm(routes, times, capacity, destroy_operators, repair_operators, time_limit, start_time, alpha=10.0, beta=450.0, neighbors=None):
     best_routes = [route.copy() for route in routes]
     best_cost = calculate_total_cost(best_routes, times, alpha, beta)
     current_routes = best_routes.copy()
@@ -37,7 +37,7 @@ def alns_algorithm(routes, times, capacity, destroy_operators, repair_operators,
 
         # Apply destroy and repair operators
         partial_routes, customers_to_reinsert = destroy_op(current_routes, times, capacity)
-        new_routes = repair_op(partial_routes, customers_to_reinsert, times, capacity)
+        new_routes = repair_op(partial_routes, customers_to_reinsert, times, capacity, neighbors=neighbors)  # Granular insertion positions when neighbors is given
         new_cost = calculate_total_cost(new_routes, times, alpha, beta)
 
         # Update best solution
@@ -1,5 +1,6 @@
 import random
-from feasibility import is_feasible
+from feasibility import is_feasible, RouteState
+from distance_finder import is_granular_insertion
 
 # Destroy Operator: Random Removal
 def destroy_random(routes, times, capacity):
@@ -61,16 +62,18 @@ def destroy_least_utilized(routes, times, capacity):
     return destroyed_routes, customers_to_reinsert
 
 # Repair Operator: Greedy Insertion
-def repair_greedy(partial_routes, customers_to_insert, times, capacity):
+def repair_greedy(partial_routes, customers_to_insert, times, capacity, neighbors=None):
     routes = [route.copy() for route in partial_routes]
+    states = [RouteState(route, times, capacity) for route in routes]  # Cached schedules, rebuilt only for the route that changes
     for customer in customers_to_insert:
         best_position = None
         best_increase = float('inf')
         best_route_idx = None
         for idx, route in enumerate(routes):
             for pos in range(1, len(route)):
-                new_route = route[:pos] + [customer] + route[pos:]
-                if is_feasible(new_route, capacity, times):
+                if not is_granular_insertion(neighbors, route[pos - 1], customer, route[pos]):
+                    continue
+                if states[idx].can_insert(customer, pos - 1):
                     increase = times[route[pos - 1].index][customer.index] + times[customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
                     if increase < best_increase:
                         best_increase = increase
@@ -78,15 +81,18 @@ def repair_greedy(partial_routes, customers_to_insert, times, capacity):
                         best_route_idx = idx
         if best_position is not None:
             routes[best_route_idx] = routes[best_route_idx][:best_position] + [customer] + routes[best_route_idx][best_position:]
+            states[best_route_idx] = RouteState(routes[best_route_idx], times, capacity)
         else:
             new_route = [routes[0][0], customer, routes[0][0]]
             if is_feasible(new_route, capacity, times):
                 routes.append(new_route)
+                states.append(RouteState(new_route, times, capacity))
     return routes
 
 # Repair Operator: Regret Insertion
-def repair_regret(partial_routes, customers_to_insert, times, capacity):
+def repair_regret(partial_routes, customers_to_insert, times, capacity, neighbors=None):
     routes = [route.copy() for route in partial_routes]
+    states = [RouteState(route, times, capacity) for route in routes]
     while customers_to_insert:
         regrets = []
         for customer in customers_to_insert:
@@ -94,8 +100,9 @@ def repair_regret(partial_routes, customers_to_insert, times, capacity):
             for idx, route in enumerate(routes):
                 best_increase = float('inf')
                 for pos in range(1, len(route)):
-                    new_route = route[:pos] + [customer] + route[pos:]
-                    if is_feasible(new_route, capacity, times):
+                    if not is_granular_insertion(neighbors, route[pos - 1], customer, route[pos]):
+                        continue
+                    if states[idx].can_insert(customer, pos - 1):
                         increase = times[route[pos - 1].index][customer.index] + times[customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
                         if increase < best_increase:
                             best_increase = increase
@@ -116,8 +123,9 @@ def repair_regret(partial_routes, customers_to_insert, times, capacity):
         best_route_idx = None
         for idx, route in enumerate(routes):
             for pos in range(1, len(route)):
-                new_route = route[:pos] + [selected_customer] + route[pos:]
-                if is_feasible(new_route, capacity, times):
+                if not is_granular_insertion(neighbors, route[pos - 1], selected_customer, route[pos]):
+                    continue
+                if states[idx].can_insert(selected_customer, pos - 1):
                     increase = times[route[pos - 1].index][selected_customer.index] + times[selected_customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
                     if increase < best_increase:
                         best_increase = increase
@@ -125,15 +133,17 @@ def repair_regret(partial_routes, customers_to_insert, times, capacity):
                         best_route_idx = idx
         if best_position is not None:
             routes[best_route_idx] = routes[best_route_idx][:best_position] + [selected_customer] + routes[best_route_idx][best_position:]
+            states[best_route_idx] = RouteState(routes[best_route_idx], times, capacity)
         else:
             new_route = [routes[0][0], selected_customer, routes[0][0]]
             if is_feasible(new_route, capacity, times):
                 routes.append(new_route)
+                states.append(RouteState(new_route, times, capacity))
         customers_to_insert.remove(selected_customer)
     return routes
 
 # Repair Operator: Savings Insertion
-def repair_savings(partial_routes, customers_to_insert, times, capacity):
+def repair_savings(partial_routes, customers_to_insert, times, capacity, neighbors=None):
     routes = [route.copy() for route in partial_routes]
     depot = routes[0][0]
     savings = []
@@ -152,14 +162,16 @@ def repair_savings(partial_routes, customers_to_insert, times, capacity):
             routes.append(new_route)
             inserted_customers.update([i, j])
     remaining_customers = [c for c in customers_to_insert if c not in inserted_customers]
+    states = [RouteState(route, times, capacity) for route in routes]
     for customer in remaining_customers:
         best_position = None
         best_increase = float('inf')
         best_route_idx = None
         for idx, route in enumerate(routes):
             for pos in range(1, len(route)):
-                new_route = route[:pos] + [customer] + route[pos:]
-                if is_feasible(new_route, capacity, times):
+                if not is_granular_insertion(neighbors, route[pos - 1], customer, route[pos]):
+                    continue
+                if states[idx].can_insert(customer, pos - 1):
                     increase = times[route[pos - 1].index][customer.index] + times[customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
                     if increase < best_increase:
                         best_increase = increase
@@ -167,8 +179,10 @@ def repair_savings(partial_routes, customers_to_insert, times, capacity):
                         best_route_idx = idx
         if best_position is not None:
             routes[best_route_idx] = routes[best_route_idx][:best_position] + [customer] + routes[best_route_idx][best_position:]
+            states[best_route_idx] = RouteState(routes[best_route_idx], times, capacity)
         else:
             new_route = [depot, customer, depot]
             if is_feasible(new_route, capacity, times):
                 routes.append(new_route)
+                states.append(RouteState(new_route, times, capacity))
     return routes
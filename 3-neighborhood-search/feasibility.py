@@ -32,3 +32,189 @@ def is_time_feasible(x, distances):
 # Function to check if adding a new node to the route is feasible based on both capacity and time
 def is_feasible(route, capacity, distances):
     return is_capacity_feasible(route, capacity) and is_time_feasible(route, distances)
+
+
+
+# -----------------------------------------------------------------------------------------------------------
+# Incremental feasibility: cached route schedules and O(1) segment concatenation
+
+class Segment:
+    """
+    Time-window summary of a sequence of consecutive visits (Vidal et al., 2013).
+    Joining two summaries tells in O(1) whether visiting both sequences one after the other is feasible.
+    :param first: First node of the sequence.
+    :param last: Last node of the sequence.
+    :param duration: Shortest time from the start of service at first to the end of service at last.
+    :param earliest: Earliest start of service at first (later starts only add waiting).
+    :param latest: Latest start of service at first that keeps every node inside its time window.
+    :param load: Total demand of the sequence.
+    :param feasible: False when some node is always reached after its time window.
+    """
+    __slots__ = ('first', 'last', 'duration', 'earliest', 'latest', 'load', 'feasible')
+
+    def __init__(self, first, last, duration, earliest, latest, load, feasible=True):
+        self.first = first
+        self.last = last
+        self.duration = duration
+        self.earliest = earliest
+        self.latest = latest
+        self.load = load
+        self.feasible = feasible
+
+
+
+# Segment made of a single node
+def node_segment(node):
+    return Segment(node, node, node.t_serv, node.inf, node.sup, node.q)
+
+
+
+# Segment obtained by visiting seg1 and then seg2 (O(1))
+def concatenate(seg1, seg2, times):
+    travel = times[seg1.last.index][seg2.first.index]
+    delta = seg1.duration + travel                                    # Time from the start at seg1.first to the arrival at seg2.first
+    waiting = max(seg2.earliest - delta - seg1.latest, 0)             # Waiting that cannot be absorbed by starting later
+    lateness = max(seg1.earliest + delta - seg2.latest, 0)            # Arrival after the window even when starting as soon as possible
+    return Segment(seg1.first, seg2.last,
+                   seg1.duration + seg2.duration + travel + waiting,
+                   max(seg2.earliest - delta, seg1.earliest) - waiting,
+                   min(seg2.latest - delta, seg1.latest),
+                   seg1.load + seg2.load,
+                   seg1.feasible and seg2.feasible and lateness <= 0)
+
+
+
+# Check if visiting the given segments in order respects time windows and vehicle capacity
+def is_concatenation_feasible(segments, times, capacity):
+    joined = segments[0]
+    for segment in segments[1:]:
+        joined = concatenate(joined, segment, times)
+        if not joined.feasible:
+            return False
+    return joined.feasible and joined.load <= capacity
+
+
+
+class RouteState:
+    """
+    Cached schedule of a route (list of Node objects that starts at the depot).
+    Positions are indexes in the route list. The vehicle leaves the depot at time 0, as in is_time_feasible.
+    :param route: The route being described (kept by reference, use append to extend it).
+    :param times: Matrix of travel times between nodes.
+    :param capacity: Vehicle capacity (no limit if omitted).
+
+    Cached per position i:
+    - earliest[i]: start of service at i when every node is served as soon as possible.
+    - departure[i]: time at which the vehicle leaves i.
+    - latest[i]: latest start of service at i that keeps positions i..end inside their time windows (-inf if none does).
+    - load[i]: cumulative demand of positions 0..i.
+    """
+
+    def __init__(self, route, times, capacity=float('inf')):
+        self.route = route
+        self.times = times
+        self.capacity = capacity
+        self.earliest = []
+        self.departure = []
+        self.load = []
+        self.feasible_until = 0         # Positions before this one are reached inside their time windows
+        self._latest = None             # Backward data is rebuilt on demand after appends
+        self._prefixes = None
+        self._suffixes = None
+        for node in route:
+            self._push(node)
+
+    def _push(self, node):
+        position = len(self.earliest)
+        if position == 0:
+            current_time = 0
+            self.load.append(node.q)
+        else:
+            current_time = self.departure[-1] + self.times[self.route[position - 1].index][node.index]
+            if current_time < node.inf:
+                current_time = node.inf
+            self.load.append(self.load[-1] + node.q)
+        self.earliest.append(current_time)
+        self.departure.append(current_time + node.t_serv if position > 0 else current_time)
+        if self.feasible_until == position and current_time <= node.sup:
+            self.feasible_until = position + 1
+
+    @property
+    def latest(self):
+        if self._latest is None:
+            route, times = self.route, self.times
+            latest = [0.0] * len(route)
+            latest_start = float('inf')
+            for i in range(len(route) - 1, -1, -1):
+                node = route[i]
+                if i < len(route) - 1:
+                    service = node.t_serv if i > 0 else 0
+                    latest_start = latest_start - times[node.index][route[i + 1].index] - service
+                latest_start = min(latest_start, node.sup)
+                if latest_start < node.inf:
+                    latest_start = float('-inf')  # No start time keeps this suffix feasible
+                latest[i] = latest_start
+            self._latest = latest
+        return self._latest
+
+    @property
+    def total_load(self):
+        return self.load[-1]
+
+    @property
+    def arrival_times(self):
+        """Start of service at every position after the depot (waiting included), as reported in the result files."""
+        return self.earliest[1:]
+
+    @property
+    def waiting_times(self):
+        """Time spent waiting for the time window to open at every position after the depot."""
+        return [self.earliest[i] - self.departure[i - 1] - self.times[self.route[i - 1].index][self.route[i].index]
+                for i in range(1, len(self.route))]
+
+    def is_feasible(self):
+        return self.feasible_until == len(self.route) and self.total_load <= self.capacity
+
+    def append(self, node):
+        """Add node at the end of the route in O(1) (backward data is recomputed when next needed)."""
+        self.route.append(node)
+        self._push(node)
+        self._latest = None
+        self._prefixes = None
+        self._suffixes = None
+
+    def can_append(self, node):
+        """Same answer as is_feasible(route, node, capacity, times) from the constructive stage, in O(1)."""
+        if self.total_load + node.q > self.capacity or self.feasible_until < len(self.route):
+            return False
+        return self.departure[-1] + self.times[self.route[-1].index][node.index] <= node.sup
+
+    def can_insert(self, node, i):
+        """Check in O(1) if node can be visited between positions i and i + 1."""
+        if self.total_load + node.q > self.capacity or self.feasible_until <= i:
+            return False
+        arrival = self.departure[i] + self.times[self.route[i].index][node.index]
+        if arrival > node.sup:
+            return False
+        if arrival < node.inf:
+            arrival = node.inf
+        following = self.route[i + 1]
+        arrival = arrival + node.t_serv + self.times[node.index][following.index]
+        return max(arrival, following.inf) <= self.latest[i + 1]
+
+    def prefix(self, i):
+        """Segment of positions 0..i."""
+        if self._prefixes is None:
+            self._prefixes = [node_segment(self.route[0])]
+            for node in self.route[1:]:
+                self._prefixes.append(concatenate(self._prefixes[-1], node_segment(node), self.times))
+        return self._prefixes[i]
+
+    def suffix(self, j):
+        """Segment of positions j..end."""
+        if self._suffixes is None:
+            suffixes = [node_segment(self.route[-1])]
+            for node in reversed(self.route[:-1]):
+                suffixes.append(concatenate(node_segment(node), suffixes[-1], self.times))
+            self._suffixes = suffixes[::-1]
+        return self._suffixes[j]
@@ -2,16 +2,22 @@ import os
 import time
 from openpyxl import Workbook
 from file_reader import read_txt_file
-from file_writer import save_to_excel
-from distance_finder import distance_matrix_generator, calculate_total_distance
+from file_writer import save_to_excel, new_result_workbook
+from feasibility import RouteState
+from distance_finder import distance_matrix_generator, calculate_total_distance_from_indexes, build_granular_neighbors, granular_matrix
 from gap_calculator import read_lower_bounds, write_GAP_excel
-from solution_interpreter import info_of_all_routes
+from solution_interpreter import info_of_all_routes, routes_from_indexes
 from simulated_annealing import simulated_annealing_robust
 from tabu import tabu_search_dynamic
 from alns import alns_algorithm
 from alns_operators import destroy_random, destroy_worst, destroy_route_removal, destroy_least_utilized
 from alns_operators import repair_greedy, repair_regret, repair_savings
 from vnd import vnd_algorithm
+from route_minimization import route_minimization
+from savings import savings_construction
+from batch_runner import imap_in_pool
+from pipeline import run_pipeline
+from solution_store import load_solutions, solution_path
 
 
 
@@ -22,6 +28,9 @@ initial_temperature = 300
 cooling_rate = 0.95
 tabu_tenure = 10
 MAX_NO_IMPROVEMENT = 500  # Number of iterations without improvement
+granular_k = 20  # Nearest time-compatible customers kept per customer for inter-route moves
+route_minimization_share = 0.1  # Fraction of the time budget given to removing routes before optimizing the distance
+route_minimization_seed = 15  # Base seed of the route removals, each instance uses seed + instance number
 
 
 destroy_operators = [destroy_random, destroy_worst, destroy_route_removal, destroy_least_utilized]
@@ -29,16 +38,77 @@ repair_operators = [repair_greedy, repair_regret, repair_savings]
 
 
 def get_initial_solution(method, nodes, Q, distances, initial_solution_path, sheet_name):
+    # Savings routes are built in memory, the other methods are read from the stage-1 results
+    if method == "savings":
+        return savings_construction(nodes, Q, distances, build_granular_neighbors(nodes, distances, granular_k))
+    # Binary solutions (solution_store) load in milliseconds, Excel sheets are parsed with pandas
+    if initial_solution_path.endswith('.npz'):
+        return routes_from_indexes(load_solutions(initial_solution_path)[sheet_name]['routes'], nodes)
     initial_solution, _, _ = info_of_all_routes(initial_solution_path, sheet_name)
-    for route_data in initial_solution:
-        route_data['route_objects'] = [nodes[node_index] for node_index in route_data['route_indexes']]
-    return [i['route_objects'] for i in initial_solution]
+    return routes_from_indexes([route_data['route_indexes'] for route_data in initial_solution], nodes)
+
+# Function to solve one (initial method, instance) pair, runs inside a worker process
+def solve_instance(task, folder_name, instances_directory_path):
+    initial_method, sheet_number = task
+    sheet_name = f'VRPTW{sheet_number}'
+    instance_filename = f'{instances_directory_path}/{sheet_name}.txt'
+
+    # Configure remaining time based on the instance
+    if sheet_number >= 1 and sheet_number <= 6:
+        remaining_time = 50e3
+    elif sheet_number >= 7 and sheet_number <= 12:
+        remaining_time = 200e3
+    else:
+        remaining_time = 750e3
+
+    # Read input data
+    n, Q, nodes = read_txt_file(instance_filename)
+    distances = distance_matrix_generator(nodes)
+    neighbors = build_granular_neighbors(nodes, distances, granular_k)
+    granular_arcs = granular_matrix(neighbors, len(distances))  # Arcs kept by the 3-opt of the VND
+
+    start_time = time.time()
+    initial_solution_path = solution_path(f'{folder_name}/constructive-results', initial_method) if initial_method != 'savings' else None
+
+    # Get initial solution
+    initial_solution = get_initial_solution(initial_method, nodes, Q, distances, initial_solution_path, sheet_name)
+
+    # Phases applied in order while time remains, the solution is handed over in memory
+    phases = [
+        # Route minimization (fleet size first)
+        lambda routes, time_limit, phase_start: route_minimization(
+            routes, distances, Q, route_minimization_share * time_limit, phase_start, neighbors=neighbors,
+            seed=route_minimization_seed + sheet_number),
+        # Simulated Annealing
+        lambda routes, time_limit, phase_start: simulated_annealing_robust(
+            routes, distances, Q, initial_temperature, cooling_rate, time_limit, phase_start, alpha, beta),
+        # Tabu Search
+        lambda routes, time_limit, phase_start: tabu_search_dynamic(
+            routes, distances, Q, tabu_tenure, time_limit, phase_start, alpha, beta),
+        # ALNS
+        lambda routes, time_limit, phase_start: alns_algorithm(
+            routes, distances, Q, destroy_operators, repair_operators, time_limit, phase_start, alpha, beta, neighbors=neighbors),
+        # VND
+        lambda routes, time_limit, phase_start: vnd_algorithm(
+            routes, distances, Q, time_limit, phase_start, neighbors=neighbors, return_states=True,
+            granular_arcs=granular_arcs),
+    ]
+    route_indexes, elapsed_time, remaining_time, route_states = run_pipeline(nodes, initial_solution, phases, remaining_time, start_time)
+    routes = routes_from_indexes(route_indexes, nodes)
+    if route_states is None:
+        route_states = [RouteState(route, distances, Q) for route in routes]  # VND did not run, no schedules to reuse
+
+    return {'routes': routes, 'distance': calculate_total_distance_from_indexes(route_indexes, distances), 'time': elapsed_time,
+            'remaining_time': remaining_time, 'distances': distances,
+            'route_states': route_states}
 
 if __name__ == "__main__":
-    initial_methods = ['constructive', 'GRASP', 'ACO']
+    initial_methods = ['constructive', 'GRASP', 'ACO', 'savings']
     folder_name = '3-neighborhood-search'
     instances_directory_path = 'VRPTW Instances'
     LB_file_directory = 'VRPTW Instances/LB_VRPTW.xlsx'
+    processes = None  # Worker processes for the (method, instance) runs, None uses every core and 1 runs serially
+    save_excel = True  # Excel is only the final sink, set to False to keep the results in memory
 
     computation_times = {method: [] for method in initial_methods}
     all_18_routes = {method: [] for method in initial_methods}
@@ -48,74 +118,32 @@ if __name__ == "__main__":
     # Read lower bounds
     LB_K, LB_D = read_lower_bounds(LB_file_directory, 'Hoja1')
 
+    # Solve every (initial method, instance) pair in parallel, results come back in task order
+    tasks = [(initial_method, sheet_number) for initial_method in initial_methods for sheet_number in range(1, 19)]
+    results = imap_in_pool(solve_instance, tasks, processes, folder_name=folder_name,
+                           instances_directory_path=instances_directory_path)
+
     for initial_method in initial_methods:
         print(f"\nProcessing for initial method: {initial_method}")
 
         # Create an Excel file for results
         results_excel_path = f"{folder_name}/results/VRPTW_tm_metaheuristic_ini_{initial_method}.xlsx"
-        wb_results = Workbook()
-        if "Sheet" in wb_results.sheetnames:
-            wb_results.remove(wb_results["Sheet"])
+        wb_results = new_result_workbook() if save_excel else None  # Write-only, sheets are streamed
 
         for sheet_number in range(1, 19):  # Iterate through all instances
             sheet_name = f'VRPTW{sheet_number}'
-            instance_filename = f'{instances_directory_path}/{sheet_name}.txt'
-
-            # Configure remaining time based on the instance
-            if sheet_number >= 1 and sheet_number <= 6:
-                remaining_time = 50e3
-            elif sheet_number >= 7 and sheet_number <= 12:
-                remaining_time = 200e3
-            else:
-                remaining_time = 750e3
-
-            # Read input data
-            n, Q, nodes = read_txt_file(instance_filename)
-            distances = distance_matrix_generator(nodes)
-
-            print(f" - Processing {sheet_name} with initial method: {initial_method}")
-            start_time = time.time()
-            initial_solution_path = f'{folder_name}/constructive-results/VRPTW_tm_{initial_method}.xlsx'
-
-            # Get initial solution
-            initial_solution = get_initial_solution(initial_method, nodes, Q, distances, initial_solution_path, sheet_name)
-
-            # Apply Simulated Annealing
-            routes = simulated_annealing_robust(
-                initial_solution, distances, Q, initial_temperature, cooling_rate,
-                remaining_time, start_time, alpha, beta
-            )
-            elapsed_time = time.time() - start_time
-            remaining_time -= elapsed_time
-
-            # Apply Tabu Search
-            if remaining_time > 0:
-                routes = tabu_search_dynamic(
-                    routes, distances, Q, tabu_tenure, remaining_time, time.time(), alpha, beta
-                )
-                elapsed_time = time.time() - start_time
-                remaining_time -= elapsed_time
-
-            # Apply ALNS
-            if remaining_time > 0:
-                routes = alns_algorithm(
-                    routes, distances, Q, destroy_operators, repair_operators,
-                    remaining_time, time.time(), alpha, beta
-                )
-                elapsed_time = time.time() - start_time
-                remaining_time -= elapsed_time
-
-            # Apply VND
-            if remaining_time > 0:
-                routes = vnd_algorithm(routes, distances, Q, remaining_time, time.time())
+            result = next(results)  # Same order as tasks, exported while the pool solves the next ones
+            routes = result['routes']
+            elapsed_time = result['time']
 
             # Calculate total distance and number of routes
-            total_distance = calculate_total_distance(routes, distances)
+            total_distance = result['distance']
             route_count = len(routes)
 
+            print(f" - Processing {sheet_name} with initial method: {initial_method}")
             print(f"   - Total Distance: {total_distance}")
             print(f"   - Number of Routes: {route_count}")
-            print(f"   - Remaining Time: {remaining_time:.2f} ms")
+            print(f"   - Remaining Time: {result['remaining_time']:.2f} ms")
 
             # Save results
             computation_times[initial_method].append(elapsed_time)
@@ -124,18 +152,22 @@ if __name__ == "__main__":
             all_18_routes[initial_method].append(routes)
 
             # Save sheet in results Excel file
-            save_to_excel(wb_results, sheet_name, routes, total_distance, elapsed_time, distances)
+            if save_excel:
+                save_to_excel(wb_results, sheet_name, routes, total_distance, elapsed_time, result['distances'],
+                              route_states=result['route_states'])
 
         # Save Excel file after all instances
-        wb_results.save(results_excel_path)
+        if save_excel:
+            wb_results.save(results_excel_path)
 
-    # Create a single file for GAPs
-    wb_gaps = Workbook()
-    if "Sheet" in wb_gaps.sheetnames:
-        wb_gaps.remove(wb_gaps["Sheet"])
+    # Create a single file for GAPs (results stay in memory in all_18_routes, D and K otherwise)
+    if save_excel:
+        wb_gaps = Workbook()
+        if "Sheet" in wb_gaps.sheetnames:
+            wb_gaps.remove(wb_gaps["Sheet"])
 
-    for method in initial_methods:
-        sheet_name = f"{method}"
-        write_GAP_excel(wb_gaps, LB_K, K[method], LB_D, D[method], computation_times[method], sheet_name)
+        for method in initial_methods:
+            sheet_name = f"{method}"
+            write_GAP_excel(wb_gaps, LB_K, K[method], LB_D, D[method], computation_times[method], sheet_name)
 
-    wb_gaps.save(f"{folder_name}/results/GAPs_for_metaheuristic_with_all_methods.xlsx")
+        wb_gaps.save(f"{folder_name}/results/GAPs_for_metaheuristic_with_all_methods.xlsx")
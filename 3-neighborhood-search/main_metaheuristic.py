@@ -2,20 +2,31 @@ import os
 import math
 import numpy as np
 import time
-from feasibility import is_feasible
+from feasibility import is_feasible, RouteState
 from openpyxl import load_workbook, Workbook
-from file_writer import save_to_excel
+from file_writer import save_to_excel, new_result_workbook
 from file_reader import Node, read_txt_file
-from distance_finder import calculate_total_distance, distance_matrix_generator
+from distance_finder import calculate_total_distance, calculate_total_distance_from_indexes, distance_matrix_generator, build_granular_neighbors, granular_matrix
 from gap_calculator import read_lower_bounds, write_GAP_excel
-from solution_interpreter import info_of_all_routes
+from solution_interpreter import info_of_all_routes, routes_from_indexes
+from alns import alns_algorithm
+from alns_operators import destroy_random, destroy_worst, destroy_route_removal, destroy_least_utilized
+from alns_operators import repair_greedy, repair_regret, repair_savings
 from vnd import vnd_algorithm
+from route_minimization import route_minimization
+from savings import savings_construction
+from batch_runner import imap_in_pool
+from pipeline import run_pipeline
+from solution_store import load_solutions, solution_path
 import random
 
 # Global parameters
 alpha = 1
 beta = 1000
 MAX_NO_IMPROVEMENT = 500  # Número máximo de iteraciones sin mejora
+granular_k = 20  # Clientes más cercanos (compatibles en tiempo) por cliente para los movimientos entre rutas
+route_minimization_share = 0.1  # Fracción del tiempo para eliminar rutas antes de optimizar la distancia
+route_minimization_seed = 15  # Semilla base de la eliminación de rutas, cada instancia usa semilla + número de instancia
 
 
 # Simulated annneaing parameters
@@ -29,10 +40,14 @@ tabu_tenure = 10
 
 
 def get_initial_solution(method, nodes, Q, distances, initial_solution_path, sheet_name):
+    # La solución de ahorros se construye en memoria, los demás métodos se leen de los resultados de la etapa 1
+    if method == "savings":
+        return savings_construction(nodes, Q, distances, build_granular_neighbors(nodes, distances, granular_k))
+    # Las soluciones binarias (solution_store) cargan en milisegundos; las hojas de Excel se leen con pandas
+    if initial_solution_path.endswith('.npz'):
+        return routes_from_indexes(load_solutions(initial_solution_path)[sheet_name]['routes'], nodes)
     initial_solution, _, _ = info_of_all_routes(initial_solution_path, sheet_name)
-    for route_data in initial_solution:
-        route_data['route_objects'] = [nodes[node_index] for node_index in route_data['route_indexes']]
-    return [i['route_objects'] for i in initial_solution]
+    return routes_from_indexes([route_data['route_indexes'] for route_data in initial_solution], nodes)
 
 
 def calculate_total_cost(routes, times, alpha=alpha, beta=beta):
@@ -172,219 +187,6 @@ def tabu_search_dynamic(routes, times, capacity, initial_tabu_tenure, time_limit
 
     return best_routes
 
-def select_operator(operators, operator_scores):
-    total_score = sum(operator_scores[op] for op in operators)
-    pick = random.uniform(0, total_score)
-    current = 0
-    for op in operators:
-        current += operator_scores[op]
-        if current >= pick:
-            return op
-    return operators[-1]
-
-def alns_algorithm(routes, times, capacity, destroy_operators, repair_operators, time_limit, start_time, alpha=10.0, beta=450.0):
-    best_routes = [route.copy() for route in routes]
-    best_cost = calculate_total_cost(best_routes, times, alpha, beta)
-    current_routes = best_routes.copy()
-
-    operator_scores = {op: 1 for op in destroy_operators + repair_operators}
-
-    no_improvement_counter = 0
-
-    while no_improvement_counter < MAX_NO_IMPROVEMENT:
-        current_time = time.time()
-        if current_time - start_time >= time_limit:
-            break
-
-        destroy_op = select_operator(destroy_operators, operator_scores)
-        repair_op = select_operator(repair_operators, operator_scores)
-
-        partial_routes, customers_to_reinsert = destroy_op(current_routes, times, capacity)
-        new_routes = repair_op(partial_routes, customers_to_reinsert, times, capacity)
-        new_cost = calculate_total_cost(new_routes, times, alpha, beta)
-
-        if new_cost < best_cost:
-            best_routes = new_routes
-            best_cost = new_cost
-            operator_scores[destroy_op] += 1
-            operator_scores[repair_op] += 1
-            no_improvement_counter = 0  # Reset counter
-        else:
-            operator_scores[destroy_op] = max(1, operator_scores[destroy_op] - 1)
-            operator_scores[repair_op] = max(1, operator_scores[repair_op] - 1)
-            no_improvement_counter += 1
-
-        current_routes = new_routes
-
-    return best_routes
-
-def destroy_route_removal(routes, times, capacity):
-    destroyed_routes = [route.copy() for route in routes]
-    num_routes_to_remove = max(1, int(0.1 * len(routes)))
-    routes_to_remove = random.sample(destroyed_routes, num_routes_to_remove)
-    customers_to_reinsert = []
-
-    for route in routes_to_remove:
-        customers_to_reinsert.extend(route[1:-1])
-        destroyed_routes.remove(route)
-    return destroyed_routes, customers_to_reinsert
-
-def destroy_least_utilized(routes, times, capacity):
-    destroyed_routes = [route.copy() for route in routes]
-    route_loads = [(sum(node.q for node in route[1:-1]), idx) for idx, route in enumerate(destroyed_routes)]
-    route_loads.sort(key=lambda x: x[0])
-    num_routes_to_remove = max(1, int(0.1 * len(routes)))
-    routes_to_remove = [destroyed_routes[idx] for _, idx in route_loads[:num_routes_to_remove]]
-    customers_to_reinsert = []
-    for route in routes_to_remove:
-        customers_to_reinsert.extend(route[1:-1])
-        destroyed_routes.remove(route)
-    return destroyed_routes, customers_to_reinsert
-
-def repair_greedy(partial_routes, customers_to_insert, times, capacity):
-    routes = [route.copy() for route in partial_routes]
-    for customer in customers_to_insert:
-        best_position = None
-        best_increase = float('inf')
-        best_route_idx = None
-        for idx, route in enumerate(routes):
-            for pos in range(1, len(route)):
-                new_route = route[:pos] + [customer] + route[pos:]
-                if is_feasible(new_route, capacity, times):
-                    increase = times[route[pos - 1].index][customer.index] + times[customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
-                    if increase < best_increase:
-                        best_increase = increase
-                        best_position = pos
-                        best_route_idx = idx
-        if best_position is not None:
-            routes[best_route_idx] = routes[best_route_idx][:best_position] + [customer] + routes[best_route_idx][best_position:]
-        else:
-            new_route = [routes[0][0], customer, routes[0][0]]
-            if is_feasible(new_route, capacity, times):
-                routes.append(new_route)
-    return routes
-
-def repair_regret(partial_routes, customers_to_insert, times, capacity):
-    routes = [route.copy() for route in partial_routes]
-    while customers_to_insert:
-        regrets = []
-        for customer in customers_to_insert:
-            insertion_costs = []
-            for idx, route in enumerate(routes):
-                best_increase = float('inf')
-                for pos in range(1, len(route)):
-                    new_route = route[:pos] + [customer] + route[pos:]
-                    if is_feasible(new_route, capacity, times):
-                        increase = times[route[pos - 1].index][customer.index] + times[customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
-                        if increase < best_increase:
-                            best_increase = increase
-                if best_increase < float('inf'):
-                    insertion_costs.append(best_increase)
-            if len(insertion_costs) >= 2:
-                insertion_costs.sort()
-                regret = insertion_costs[1] - insertion_costs[0]
-            elif len(insertion_costs) == 1:
-                regret = insertion_costs[0]
-            else:
-                regret = float('inf')
-            regrets.append((regret, customer))
-        regrets.sort(key=lambda x: x[0], reverse=True)
-        _, selected_customer = regrets[0]
-        best_position = None
-        best_increase = float('inf')
-        best_route_idx = None
-        for idx, route in enumerate(routes):
-            for pos in range(1, len(route)):
-                new_route = route[:pos] + [selected_customer] + route[pos:]
-                if is_feasible(new_route, capacity, times):
-                    increase = times[route[pos - 1].index][selected_customer.index] + times[selected_customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
-                    if increase < best_increase:
-                        best_increase = increase
-                        best_position = pos
-                        best_route_idx = idx
-        if best_position is not None:
-            routes[best_route_idx] = routes[best_route_idx][:best_position] + [selected_customer] + routes[best_route_idx][best_position:]
-        else:
-            new_route = [routes[0][0], selected_customer, routes[0][0]]
-            if is_feasible(new_route, capacity, times):
-                routes.append(new_route)
-        customers_to_insert.remove(selected_customer)
-    return routes
-
-def repair_savings(partial_routes, customers_to_insert, times, capacity):
-    routes = [route.copy() for route in partial_routes]
-    depot = routes[0][0]
-    savings = []
-    for i in customers_to_insert:
-        for j in customers_to_insert:
-            if i != j:
-                s = times[depot.index][i.index] + times[depot.index][j.index] - times[i.index][j.index]
-                savings.append((s, i, j))
-    savings.sort(key=lambda x: x[0], reverse=True)
-    inserted_customers = set()
-    for s, i, j in savings:
-        if i in inserted_customers or j in inserted_customers:
-            continue
-        new_route = [depot, i, j, depot]
-        if is_feasible(new_route, capacity, times):
-            routes.append(new_route)
-            inserted_customers.update([i, j])
-    remaining_customers = [c for c in customers_to_insert if c not in inserted_customers]
-    for customer in remaining_customers:
-        best_position = None
-        best_increase = float('inf')
-        best_route_idx = None
-        for idx, route in enumerate(routes):
-            for pos in range(1, len(route)):
-                new_route = route[:pos] + [customer] + route[pos:]
-                if is_feasible(new_route, capacity, times):
-                    increase = times[route[pos - 1].index][customer.index] + times[customer.index][route[pos].index] - times[route[pos - 1].index][route[pos].index]
-                    if increase < best_increase:
-                        best_increase = increase
-                        best_position = pos
-                        best_route_idx = idx
-        if best_position is not None:
-            routes[best_route_idx] = routes[best_route_idx][:best_position] + [customer] + routes[best_route_idx][best_position:]
-        else:
-            new_route = [depot, customer, depot]
-            if is_feasible(new_route, capacity, times):
-                routes.append(new_route)
-    return routes
-
-
-def destroy_random(routes, times, capacity):
-    destroyed_routes = [route.copy() for route in routes]
-    num_customers_to_remove = max(1, int(0.1 * sum(len(route) - 2 for route in routes)))
-    customers_to_remove = []
-    while len(customers_to_remove) < num_customers_to_remove:
-        route_idx = random.randint(0, len(destroyed_routes) - 1)
-        route = destroyed_routes[route_idx]
-        if len(route) > 3:
-            cust_idx = random.randint(1, len(route) - 2)
-            customer = route.pop(cust_idx)
-            customers_to_remove.append(customer)
-    return destroyed_routes, customers_to_remove
-
-def destroy_worst(routes, times, capacity):
-    destroyed_routes = [route.copy() for route in routes]
-    customer_costs = []
-    for route in destroyed_routes:
-        for idx in range(1, len(route) - 1):
-            prev_node = route[idx - 1]
-            current_node = route[idx]
-            next_node = route[idx + 1]
-            cost = times[prev_node.index][current_node.index] + times[current_node.index][next_node.index] - times[prev_node.index][next_node.index]
-            customer_costs.append((cost, current_node, route))
-    customer_costs.sort(key=lambda x: x[0], reverse=True)
-    num_customers_to_remove = max(1, int(0.1 * len(customer_costs)))
-    customers_to_remove = []
-    for i in range(num_customers_to_remove):
-        cost, customer, route = customer_costs[i]
-        route.remove(customer)
-        customers_to_remove.append(customer)
-    return destroyed_routes, customers_to_remove
-
-
 def generate_multiple_neighbors(current_routes, times, capacity, num_neighbors=20):
     # Generamos varios vecinos y seleccionamos los más prometedores en términos de costo
     candidate_neighbors = []
@@ -502,89 +304,109 @@ def simulated_annealing_robust(routes, times, capacity, initial_temperature, coo
 
 
 
+# Operadores de destrucción y reparación del ALNS
+destroy_operators = [destroy_random, destroy_worst, destroy_route_removal, destroy_least_utilized]
+repair_operators = [repair_greedy, repair_regret, repair_savings]
+
+
+
+# Función para resolver un par (método inicial, instancia), se ejecuta en un proceso trabajador
+def solve_instance(task, folder_name, instances_directory_path):
+    initial_method, sheet_number = task
+    sheet_name = f'VRPTW{sheet_number}'
+    instance_filename = f'{instances_directory_path}/{sheet_name}.txt'
+
+    # Configurar tiempo restante según la instancia
+    if sheet_number >= 1 and sheet_number <= 6:
+        remaining_time = 50e3
+    elif sheet_number >= 7 and sheet_number <= 12:
+        remaining_time = 200e3
+    else:
+        remaining_time = 750e3
+
+    # Leer datos de entrada
+    n, Q, nodes = read_txt_file(instance_filename)
+    distances = distance_matrix_generator(nodes)
+    neighbors = build_granular_neighbors(nodes, distances, granular_k)
+    granular_arcs = granular_matrix(neighbors, len(distances))  # Arcos del 3-opt del VND
+
+    start_time = time.time()
+    initial_solution_path = solution_path(f'{folder_name}/constructive-results', initial_method) if initial_method != 'savings' else None
+
+    # Obtener solución inicial
+    initial_solution = get_initial_solution(initial_method, nodes, Q, distances, initial_solution_path, sheet_name)
+
+    # Fases aplicadas en orden mientras quede tiempo; la solución pasa de una a otra en memoria
+    phases = [
+        # Minimización de rutas primero (tamaño de la flota)
+        lambda routes, time_limit, phase_start: route_minimization(
+            routes, distances, Q, route_minimization_share * time_limit, phase_start, neighbors=neighbors,
+            seed=route_minimization_seed + sheet_number),
+        lambda routes, time_limit, phase_start: simulated_annealing_robust(
+            routes, distances, Q, initial_temperature, cooling_rate, time_limit, phase_start, alpha, beta),
+        lambda routes, time_limit, phase_start: tabu_search_dynamic(
+            routes, distances, Q, tabu_tenure, time_limit, phase_start, alpha, beta),
+        lambda routes, time_limit, phase_start: alns_algorithm(
+            routes, distances, Q, destroy_operators, repair_operators, time_limit, phase_start, alpha, beta, neighbors=neighbors),
+        # VND al final si queda tiempo
+        lambda routes, time_limit, phase_start: vnd_algorithm(
+            routes, distances, Q, time_limit, phase_start, neighbors=neighbors, return_states=True,
+            granular_arcs=granular_arcs),
+    ]
+    route_indexes, elapsed_time, remaining_time, route_states = run_pipeline(nodes, initial_solution, phases, remaining_time, start_time)
+    routes = routes_from_indexes(route_indexes, nodes)
+    if route_states is None:
+        route_states = [RouteState(route, distances, Q) for route in routes]  # El VND no corrió, no hay horarios para reutilizar
+
+    return {'routes': routes, 'distance': calculate_total_distance_from_indexes(route_indexes, distances), 'time': elapsed_time,
+            'remaining_time': remaining_time, 'distances': distances,
+            'route_states': route_states}
+
+
+
+
 if __name__ == "__main__":
-    initial_methods = ['constructive', 'GRASP', 'ACO']
+    initial_methods = ['constructive', 'GRASP', 'ACO', 'savings']
     folder_name = '3-neighborhood-search'
     instances_directory_path = 'VRPTW Instances'
     LB_file_directory = 'VRPTW Instances/LB_VRPTW.xlsx'
+    processes = None  # Procesos trabajadores para los pares (método, instancia); None usa todos los núcleos y 1 corre en serie
+    save_excel = True  # El Excel es solo el destino final; con False los resultados quedan en memoria
 
     computation_times = {method: [] for method in initial_methods}
     all_18_routes = {method: [] for method in initial_methods}
     D = {method: [] for method in initial_methods}
     K = {method: [] for method in initial_methods}
 
-    destroy_operators = [destroy_random, destroy_worst, destroy_route_removal, destroy_least_utilized]
-    repair_operators = [repair_greedy, repair_regret, repair_savings]
-
     # Leer los valores de referencia (Lower Bounds)
     LB_K, LB_D = read_lower_bounds(LB_file_directory, 'Hoja1')
 
+    # Resolver todos los pares (método inicial, instancia) en paralelo; los resultados vuelven en el orden de las tareas
+    tasks = [(initial_method, sheet_number) for initial_method in initial_methods for sheet_number in range(1, 19)]
+    results = imap_in_pool(solve_instance, tasks, processes, folder_name=folder_name,
+                           instances_directory_path=instances_directory_path)
+
     for initial_method in initial_methods:
         print(f"\nProcessing for initial method: {initial_method}")
 
         # Crear un archivo Excel para resultados
         results_excel_path = f"{folder_name}/results/VRPTW_tm_metaheuristic_ini_{initial_method}.xlsx"
-        wb_results = Workbook()
-        if "Sheet" in wb_results.sheetnames:
-            wb_results.remove(wb_results["Sheet"])
+        wb_results = new_result_workbook() if save_excel else None  # Write-only, sheets are streamed
 
         for sheet_number in range(1, 19):  # Iterar por todas las instancias
             sheet_name = f'VRPTW{sheet_number}'
-            instance_filename = f'{instances_directory_path}/{sheet_name}.txt'
-
-            # Configurar tiempo restante según la instancia
-            if sheet_number >= 1 and sheet_number <= 6:
-                remaining_time = 50e3
-            elif sheet_number >= 7 and sheet_number <= 12:
-                remaining_time = 200e3
-            else:
-                remaining_time = 750e3
-
-            # Leer datos de entrada
-            n, Q, nodes = read_txt_file(instance_filename)
-            distances = distance_matrix_generator(nodes)
-
-            print(f" - Processing {sheet_name} with initial method: {initial_method}")
-            start_time = time.time()
-            initial_solution_path = f'{folder_name}/constructive-results/VRPTW_tm_{initial_method}.xlsx'
-
-            # Obtener solución inicial
-            initial_solution = get_initial_solution(initial_method, nodes, Q, distances, initial_solution_path, sheet_name)
-
-            # Ejecutar Metaheurísticas y optimización en paralelo
-            routes = simulated_annealing_robust(
-                initial_solution, distances, Q, initial_temperature, cooling_rate, 
-                remaining_time, start_time, alpha, beta
-            )
-            elapsed_time = time.time() - start_time
-            remaining_time -= elapsed_time
-
-            if remaining_time > 0:
-                routes = tabu_search_dynamic(
-                    routes, distances, Q, tabu_tenure, remaining_time, time.time(), alpha, beta
-                )
-                elapsed_time = time.time() - start_time
-                remaining_time -= elapsed_time
-
-            if remaining_time > 0:
-                routes = alns_algorithm(
-                    routes, distances, Q, destroy_operators, repair_operators, 
-                    remaining_time, time.time(), alpha, beta
-                )
-                elapsed_time = time.time() - start_time
-                remaining_time -= elapsed_time
-
-            # Aplicar VND si queda tiempo
-            if remaining_time > 0:
-                routes = vnd_algorithm(routes, distances, Q, remaining_time, time.time())
+            result = next(results)  # Same order as tasks, exported while the pool solves the next ones
+            routes = result['routes']
+            elapsed_time = result['time']
 
             # Calcular distancia total y número de rutas
-            total_distance = calculate_total_distance(routes, distances)
+            total_distance = result['distance']
             route_count = len(routes)
 
+            print(f" - Processing {sheet_name} with initial method: {initial_method}")
             print(f"   - Total Distance: {total_distance}")
             print(f"   - Number of Routes: {route_count}")
-            print(f"   - Remaining Time: {remaining_time:.2f} ms")
+            print(f"   - Remaining Time: {result['remaining_time']:.2f} ms")
 
             # Guardar resultados
             computation_times[initial_method].append(elapsed_time)
@@ -593,18 +415,22 @@ if __name__ == "__main__":
             all_18_routes[initial_method].append(routes)
 
             # Guardar hoja en el Excel de resultados
-            save_to_excel(wb_results, sheet_name, routes, total_distance, elapsed_time, distances)
+            if save_excel:
+                save_to_excel(wb_results, sheet_name, routes, total_distance, elapsed_time, result['distances'],
+                              route_states=result['route_states'])
 
         # Guardar archivo Excel al final
-        wb_results.save(results_excel_path)
+        if save_excel:
+            wb_results.save(results_excel_path)
 
-    # Crear archivo único para los GAPs
-    wb_gaps = Workbook()
-    if "Sheet" in wb_gaps.sheetnames:
-        wb_gaps.remove(wb_gaps["Sheet"])
+    # Crear archivo único para los GAPs (si no, los resultados quedan en memoria en all_18_routes, D y K)
+    if save_excel:
+        wb_gaps = Workbook()
+        if "Sheet" in wb_gaps.sheetnames:
+            wb_gaps.remove(wb_gaps["Sheet"])
 
-    for method in initial_methods:
-        sheet_name = f"{method}"
-        write_GAP_excel(wb_gaps, LB_K, K[method], LB_D, D[method], computation_times[method], sheet_name)
+        for method in initial_methods:
+            sheet_name = f"{method}"
+            write_GAP_excel(wb_gaps, LB_K, K[method], LB_D, D[method], computation_times[method], sheet_name)
 
-    wb_gaps.save(f"{folder_name}/results/GAPs_for_metaheuristic_with_all_methods.xlsx")
+        wb_gaps.save(f"{folder_name}/results/GAPs_for_metaheuristic_with_all_methods.xlsx")
@@ -0,0 +1,34 @@
+import time
+from solution_interpreter import indexes_from_routes, routes_from_indexes
+
+# Function to chain improvement phases on a solution kept in memory (no Excel round-trips between them)
+def run_pipeline(nodes, initial_routes, phases, time_limit, start_time=None):
+    """
+    Hand a solution from one phase to the next as route index arrays, e.g. constructor -> local search -> metaheuristic.
+    :param nodes: List of nodes of the instance (node i at position i).
+    :param initial_routes: Starting solution, as route index arrays or as routes of Node objects.
+    :param phases: Functions phase(routes, time_limit, start_time) returning the improved routes (lists of Node objects),
+                   or a tuple (routes, route_states) when the phase kept the RouteState of every route.
+    :param time_limit: Time budget of the phases, counted from start_time: each phase gets what is left of it and no
+                       phase starts once it is spent.
+    :param start_time: Start of the budget (default: now).
+    :return: Final route index arrays, elapsed time, remaining time and the RouteStates handed back by the last phase
+             (None if it returned only routes).
+    """
+    start_time = time.time() if start_time is None else start_time
+    if initial_routes and hasattr(initial_routes[0][0], 'index'):
+        initial_routes = indexes_from_routes(initial_routes)
+    route_indexes = initial_routes
+    elapsed_time = time.time() - start_time
+    remaining_time = time_limit - elapsed_time
+    route_states = None
+
+    for phase in phases:
+        if remaining_time <= 0:
+            break
+        routes = phase(routes_from_indexes(route_indexes, nodes), remaining_time, time.time())
+        routes, route_states = routes if isinstance(routes, tuple) else (routes, None)
+        route_indexes = indexes_from_routes(routes)
+        elapsed_time = time.time() - start_time
+        remaining_time = time_limit - elapsed_time
+    return route_indexes, elapsed_time, remaining_time, route_states
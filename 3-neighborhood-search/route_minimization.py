@@ -0,0 +1,255 @@
+import math
+import random
+import time
+from feasibility import RouteState, node_segment, concatenate, is_concatenation_feasible
+from distance_finder import is_granular_insertion
+
+# Route-elimination phase (Nagata and Bräysy, 2009): remove one route, keep its customers in an ejection pool and
+# put them back with feasible insertions, squeezes and insertions that eject other customers. The fleet is reduced
+# first and the distance is left to the phases that follow (ALNS, VND).
+
+
+
+# Distance change of removing positions first..last (consecutive) from a route
+def removal_delta(route, first, last, times):
+    removed = times[route[first - 1].index][route[first].index] + times[route[last].index][route[last + 1].index]
+    for p in range(first, last):
+        removed += times[route[p].index][route[p + 1].index]
+    return times[route[first - 1].index][route[last + 1].index] - removed
+
+
+
+# Distance change of visiting customer between prev_node and next_node
+def insertion_delta(prev_node, customer, next_node, times):
+    return times[prev_node.index][customer.index] + times[customer.index][next_node.index] - times[prev_node.index][next_node.index]
+
+
+
+# Distance change of visiting customer between positions i and i + 1 of a route and removing the customer at position w
+def replacement_delta(route, customer, i, w, times):
+    if w == i:
+        return removal_delta(route, w, w, times) + insertion_delta(route[i - 1], customer, route[i + 1], times)
+    if w == i + 1:
+        return removal_delta(route, w, w, times) + insertion_delta(route[i], customer, route[i + 2], times)
+    return removal_delta(route, w, w, times) + insertion_delta(route[i], customer, route[i + 1], times)
+
+
+
+# Function to find the cheapest feasible insertion of a customer, as (route, position, delta) or None
+def cheapest_insertion(customer, routes, states, times, exclude=None):
+    best, best_delta = None, float('inf')
+    for r, route in enumerate(routes):
+        if r == exclude or states[r].total_load + customer.q > states[r].capacity:
+            continue
+        for i in range(len(route) - 1):
+            delta = insertion_delta(route[i], customer, route[i + 1], times)
+            if delta < best_delta and states[r].can_insert(customer, i):
+                best, best_delta = (r, i, delta), delta
+    return best
+
+
+
+# Function to insert a customer by moving one customer of the receiving route to another route
+def best_squeeze(customer, routes, states, times, capacity, neighbors=None):
+    """
+    Insert customer between positions i and i + 1 of a route that cannot take it as it is, and make room by relocating
+    one of the other customers of the route to the cheapest feasible position of another route. Each (i, w) pair is
+    checked in O(1) with the prefixes and suffixes of the cached RouteState, extended one node at a time, and the
+    relocation of each customer is looked up once per call.
+    :return: Tuple (r, i, w, target) with the position w of the relocated customer in the route and its cheapest
+             insertion target (route, position, delta), or None if no squeeze is feasible.
+    """
+    best, best_delta = None, float('inf')
+    segment = node_segment(customer)
+    relocations = {}  # Customer index -> cheapest insertion into another route (None if there is none)
+    for r, route in enumerate(routes):
+        state = states[r]
+        for i in range(len(route) - 1):
+            if not is_granular_insertion(neighbors, route[i], customer, route[i + 1]):
+                continue
+            candidates = []  # Positions w whose removal leaves room for customer
+
+            # w before the insertion: prefix(w - 1) + route[w + 1..i] + customer + suffix(i + 1)
+            rest = concatenate(segment, state.suffix(i + 1), times)
+            for w in range(i, 0, -1):
+                if not rest.feasible:
+                    break  # Visiting more nodes first only starts the rest later
+                if is_concatenation_feasible([state.prefix(w - 1), rest], times, capacity):
+                    candidates.append(w)
+                rest = concatenate(node_segment(route[w]), rest, times)
+
+            # w after the insertion: prefix(i) + customer + route[i + 1..w - 1] + suffix(w + 1)
+            head = concatenate(state.prefix(i), segment, times)
+            for w in range(i + 1, len(route) - 1):
+                if not head.feasible:
+                    break
+                if is_concatenation_feasible([head, state.suffix(w + 1)], times, capacity):
+                    candidates.append(w)
+                head = concatenate(head, node_segment(route[w]), times)
+
+            for w in candidates:
+                delta = replacement_delta(route, customer, i, w, times)
+                if delta >= best_delta:
+                    continue  # Insertions never shorten a route (triangle inequality)
+                moved = route[w]
+                if moved.index not in relocations:
+                    relocations[moved.index] = cheapest_insertion(moved, routes, states, times, exclude=r)
+                target = relocations[moved.index]
+                if target is not None and delta + target[2] < best_delta:
+                    best, best_delta = (r, i, w, target), delta + target[2]
+    return best
+
+
+
+# Function to insert a customer by ejecting up to max_ejections customers of the receiving route
+def best_insert_eject(customer, routes, times, capacity, penalties, neighbors=None, max_ejections=2):
+    """
+    Among the granular insertion positions, pick the one whose route becomes feasible by ejecting the customers with
+    the smallest sum of penalties (number of times each customer went through the ejection pool), ties broken by
+    the distance change. The trial route is summarized once and each ejection set is checked in O(1) by segments.
+    :return: Tuple (r, i, ejected) with the ejected positions in the route after the insertion, or None.
+    """
+    best, best_key = None, (float('inf'), float('inf'))
+    for r, route in enumerate(routes):
+        for i in range(len(route) - 1):
+            if not is_granular_insertion(neighbors, route[i], customer, route[i + 1]):
+                continue
+            trial = route[:i + 1] + [customer] + route[i + 1:]
+            state = RouteState(trial, times, capacity)
+            detour = insertion_delta(route[i], customer, route[i + 1], times)
+            last = len(trial) - 2
+            for w1 in range(1, last + 1):
+                prefix = state.prefix(w1 - 1)
+                if not prefix.feasible:
+                    break
+                penalty1 = penalties.get(trial[w1].index, 0)
+                if w1 == i + 1 or penalty1 > best_key[0]:
+                    continue
+                if is_concatenation_feasible([prefix, state.suffix(w1 + 1)], times, capacity):
+                    key = (penalty1, detour + removal_delta(trial, w1, w1, times))
+                    if key < best_key:
+                        best, best_key = (r, i, [w1]), key
+                if max_ejections < 2:
+                    continue
+                middle = None  # Segment of positions w1 + 1..w2 - 1
+                for w2 in range(w1 + 1, last + 1):
+                    if w2 > w1 + 1:
+                        segment = node_segment(trial[w2 - 1])
+                        middle = segment if middle is None else concatenate(middle, segment, times)
+                        if not middle.feasible:
+                            break
+                    penalty = penalty1 + penalties.get(trial[w2].index, 0)
+                    if w2 == i + 1 or penalty > best_key[0]:
+                        continue
+                    segments = [prefix, state.suffix(w2 + 1)] if middle is None else [prefix, middle, state.suffix(w2 + 1)]
+                    if not is_concatenation_feasible(segments, times, capacity):
+                        continue
+                    if w2 == w1 + 1:
+                        delta = detour + removal_delta(trial, w1, w2, times)
+                    else:
+                        delta = detour + removal_delta(trial, w1, w1, times) + removal_delta(trial, w2, w2, times)
+                    if (penalty, delta) < best_key:
+                        best, best_key = (r, i, [w1, w2]), (penalty, delta)
+    return best
+
+
+
+# Function to apply random feasible relocations of single customers between routes
+def perturb(routes, states, times, capacity, num_moves, rng=random):
+    for _ in range(num_moves):
+        if len(routes) < 2:
+            return
+        r1, r2 = rng.sample(range(len(routes)), 2)
+        route1, route2 = routes[r1], routes[r2]
+        p = rng.randint(1, len(route1) - 2)
+        i = rng.randint(0, len(route2) - 2)
+        customer = route1[p]
+        if not states[r2].can_insert(customer, i):
+            continue
+        if not is_concatenation_feasible([states[r1].prefix(p - 1), states[r1].suffix(p + 1)], times, capacity):
+            continue
+        route2.insert(i + 1, customer)
+        states[r2] = RouteState(route2, times, capacity)
+        del route1[p]
+        if len(route1) > 2:
+            states[r1] = RouteState(route1, times, capacity)
+        else:
+            del routes[r1], states[r1]  # The route was emptied
+
+
+
+# Function to reduce the number of routes before optimizing the distance
+def route_minimization(routes, times, capacity, time_limit, start_time, neighbors=None, max_ejections=2,
+                       perturbation_moves=20, max_iterations=1000, seed=None):
+    """
+    Repeatedly remove a route and reinsert its customers from an ejection pool (last in, first out). Each customer
+    taken from the pool is inserted at its cheapest feasible position; if there is none, it is squeezed in by moving
+    another customer out of the receiving route; otherwise it is inserted ejecting up to max_ejections customers
+    (its penalty grows and the ejected ones go to the pool) and the solution is perturbed by random feasible
+    relocations. The removal succeeds when the pool is empty. A removal that still has customers in the pool after
+    max_iterations is abandoned and another route of the last feasible solution is tried; the phase ends when every
+    route failed, the fleet reaches the capacity lower bound or the time is spent.
+    :param routes: Routes of Node objects, each starting and ending at the depot (routes without customers are dropped).
+    :param times: Matrix of travel times between nodes.
+    :param capacity: Vehicle capacity.
+    :param time_limit: Time budget of the phase.
+    :param start_time: Start of the budget.
+    :param neighbors: Granular neighbor lists (build_granular_neighbors) for the squeeze and ejection positions.
+    :param max_ejections: Largest number of customers ejected by one insertion (1 or 2).
+    :param perturbation_moves: Random relocations attempted after each ejection.
+    :param max_iterations: Customers taken from the pool before a route removal is abandoned.
+    :param seed: Seed of the route choices and perturbations (None for fresh entropy).
+    :return: Feasible routes serving every customer, never more routes than the input.
+    """
+    rng = random.Random(seed)
+    best_routes = [route.copy() for route in routes if len(route) > 2]
+    min_routes = math.ceil(sum(node.q for route in best_routes for node in route[1:-1]) / capacity)
+    candidates = rng.sample(range(len(best_routes)), len(best_routes))  # Routes of best_routes not tried yet
+
+    while len(best_routes) > min_routes and candidates and time.time() - start_time < time_limit:
+        current = [route.copy() for route in best_routes]
+        pool = current.pop(candidates.pop())[1:-1]
+        states = [RouteState(route, times, capacity) for route in current]
+        penalties = {}  # Customer index -> times it was ejected in this removal
+
+        for _ in range(max_iterations):
+            if not pool or time.time() - start_time >= time_limit:
+                break
+            customer = pool.pop()
+
+            insertion = cheapest_insertion(customer, current, states, times)
+            if insertion is not None:
+                r, i, _ = insertion
+                current[r].insert(i + 1, customer)
+                states[r] = RouteState(current[r], times, capacity)
+                continue
+
+            squeeze = best_squeeze(customer, current, states, times, capacity, neighbors)
+            if squeeze is not None:
+                r, i, w, (target, j, _) = squeeze
+                route = current[r].copy()
+                current[target].insert(j + 1, route.pop(w))
+                route.insert(i if w <= i else i + 1, customer)  # The gap moved back one position if w was before it
+                current[r] = route
+                states[r] = RouteState(route, times, capacity)
+                states[target] = RouteState(current[target], times, capacity)
+                continue
+
+            penalties[customer.index] = penalties.get(customer.index, 0) + 1
+            ejection = best_insert_eject(customer, current, times, capacity, penalties, neighbors, max_ejections)
+            if ejection is None:
+                pool.insert(0, customer)  # Retried after the rest of the pool and the perturbation
+            else:
+                r, i, ejected = ejection
+                route = current[r][:i + 1] + [customer] + current[r][i + 1:]
+                for w in reversed(ejected):
+                    pool.append(route.pop(w))
+                current[r] = route
+                states[r] = RouteState(route, times, capacity)
+            perturb(current, states, times, capacity, perturbation_moves, rng)
+
+        if not pool:
+            best_routes = current
+            candidates = rng.sample(range(len(best_routes)), len(best_routes))
+
+    return best_routes
@@ -0,0 +1,68 @@
+import heapq
+from feasibility import RouteState, is_concatenation_feasible
+
+# Savings of serving j right after i instead of going back to the depot in between
+def saving(times, i, j):
+    return times[0][i] + times[0][j] - times[i][j]
+
+
+
+# Savings heap: one entry per candidate arc i -> j (granular arcs only when neighbors is given)
+def build_savings_heap(num_nodes, times, neighbors=None):
+    heap = []
+    for i in range(1, num_nodes):
+        candidates = neighbors[i] if neighbors is not None else range(1, num_nodes)
+        for j in candidates:
+            if j != i and j != 0:
+                heap.append((-saving(times, i, j), i, j))
+    heapq.heapify(heap)  # O(m) instead of sorting every pair
+    return heap
+
+
+
+# Function to build an initial solution with the parallel savings algorithm (Clarke and Wright, 1964)
+def savings_construction(nodes, capacity, times, neighbors=None):
+    """
+    Start with one route per customer and merge the route that ends at i with the route that starts at j,
+    in decreasing order of savings. Entries are checked lazily when they reach the top of the heap: the
+    pair is skipped if i or j is no longer a route end, and the merge is kept if the prefix of the first
+    route followed by the suffix of the second is feasible (O(1) segment concatenation).
+    :param nodes: List of nodes (depot + customers), node i at position i.
+    :param capacity: Vehicle capacity.
+    :param times: Matrix of travel times between nodes.
+    :param neighbors: Granular neighbor lists (build_granular_neighbors), None considers every pair.
+    :return: List of routes, each starting and ending at the depot.
+    """
+    depot = nodes[0]
+    routes = {}  # Route id -> route
+    states = {}  # Route id -> RouteState
+    route_of = [None] * len(nodes)  # Customer index -> route id
+    for customer in nodes[1:]:
+        route = [depot, customer, depot]
+        routes[customer.index] = route
+        states[customer.index] = RouteState(route, times, capacity)
+        route_of[customer.index] = customer.index
+
+    heap = build_savings_heap(len(nodes), times, neighbors)
+    while heap:
+        negative_saving, i, j = heapq.heappop(heap)
+        if negative_saving >= 0:
+            break  # Remaining merges do not shorten the solution
+        first, second = route_of[i], route_of[j]
+        if first == second or routes[first][-2].index != i or routes[second][1].index != j:
+            continue  # i must end one route and j must start another
+
+        state_first, state_second = states[first], states[second]
+        segments = [state_first.prefix(len(routes[first]) - 2), state_second.suffix(1)]
+        if not is_concatenation_feasible(segments, times, capacity):
+            continue
+
+        # Merge the second route into the first one
+        merged = routes[first][:-1] + routes[second][1:]
+        routes[first] = merged
+        states[first] = RouteState(merged, times, capacity)
+        for customer in routes.pop(second)[1:-1]:
+            route_of[customer.index] = first
+        del states[second]
+
+    return list(routes.values())
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from math import isnan
 
@@ -57,6 +58,30 @@ def info_of_all_routes(path, sheet_name):
 
 
 
+# Same output as info_of_all_routes for one instance of a solution_store archive (load_solutions(path)[sheet_name])
+def info_of_stored_routes(stored_solution, nodes):
+    initial_solution = []
+    for i, indexes in enumerate(stored_solution['routes'], start=1):
+        route = indexes.tolist()
+        initial_solution.append({'number_of_visited_nodes': len(route) - 2, 'route_objects' : [], 'total_capacity_used' : sum(nodes[index].q for index in route), 'route_index' : i, 'route_indexes' : route})
+
+    return initial_solution, stored_solution['distance'], stored_solution['time']
+
+
+
+
+# Routes of Node objects from route index arrays (each one starting and ending at the depot)
+def routes_from_indexes(route_indexes, nodes):
+    return [[nodes[node_index] for node_index in indexes.tolist()] for indexes in map(np.asarray, route_indexes)]
+
+
+
+# Route index arrays (int32) from routes of Node objects, the in-memory exchange format between stages
+def indexes_from_routes(routes):
+    return [np.fromiter((node.index for node in route), dtype=np.int32, count=len(route)) for route in routes]
+
+
+
 
 # path = 'C:\\Users\\thomm\\Documents\\GitHub\\heuristica\\2-local-search\\constructive-results\\VRPTW_tm_ACO.xlsx'
 # sheet_name = 'VRPTW1'
@@ -0,0 +1,20 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Yield the result of each task, in task order, as soon as it and the tasks before it are solved
+def imap_in_pool(solve, tasks, processes=None, **kwargs):
+    """
+    Spread independent benchmark runs across processes and hand back the results lazily, so the caller can
+    report and export finished instances while the pool keeps solving the next ones.
+    :param solve: Top-level function of the driver (it must be importable by the workers) called as solve(task, **kwargs).
+    :param tasks: Tasks to solve, e.g. instance numbers or (method, instance number) tuples.
+    :param processes: Number of worker processes (None uses every core, 1 runs everything in this process).
+    :param kwargs: Extra keyword arguments passed to solve.
+    """
+    solve_task = partial(solve, **kwargs) if kwargs else solve
+    tasks = list(tasks)
+    if processes == 1:
+        yield from map(solve_task, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(solve_task, tasks)  # map keeps the order of tasks whatever finishes first
@@ -1,16 +1,24 @@
 import random
 import time
-from feasibility import is_feasible
-from distance_finder import calculate_total_distance, distance_matrix_generator
-from file_writer import save_to_excel
+from feasibility import is_feasible, RouteState
+from distance_finder import calculate_total_distance, calculate_total_distance_from_indexes, distance_matrix_generator, build_granular_neighbors, granular_matrix
+from file_writer import save_to_excel, new_result_workbook
 from file_reader import read_txt_file, Node
-from solution_interpreter import info_of_all_routes
+from solution_interpreter import info_of_all_routes, routes_from_indexes
 from openpyxl import Workbook
 from gap_calculator import read_lower_bounds, write_GAP_excel
 from vnd import vnd_algorithm
+from route_minimization import route_minimization
+from savings import savings_construction
+from batch_runner import imap_in_pool
+from pipeline import run_pipeline
+from solution_store import load_solutions, solution_path
 
 alpha = 1
 beta = 1000
+granular_k = 20  # Clientes más cercanos (compatibles en tiempo) por cliente para los movimientos entre rutas del VND
+route_minimization_share = 0.1  # Fracción del tiempo para eliminar rutas antes del Algoritmo Genético
+route_minimization_seed = 15  # Semilla base de la eliminación de rutas, cada instancia usa semilla + número de instancia
 
 
 def genetic_algorithm(initial_routes, times, Q, remaining_time, start_time):
@@ -224,19 +232,71 @@ def get_initial_solution(method, nodes, Q, distances, initial_solution_path, she
     # Obtener la solución inicial con adaptación de datos similar a `constructive`
     if method == "humble":
         return humble_constructive(nodes, Q, distances)
+    if method == "savings":
+        return savings_construction(nodes, Q, distances, build_granular_neighbors(nodes, distances, granular_k))
+    # Las soluciones binarias (solution_store) cargan en milisegundos; las hojas de Excel se leen con pandas
+    if initial_solution_path.endswith('.npz'):
+        return routes_from_indexes(load_solutions(initial_solution_path)[sheet_name]['routes'], nodes)
     initial_solution, _, _ = info_of_all_routes(initial_solution_path, sheet_name)
-    for route_data in initial_solution:
-        route_data['route_objects'] = [nodes[node_index] for node_index in route_data['route_indexes']]
-    return [i['route_objects'] for i in initial_solution]
+    return routes_from_indexes([route_data['route_indexes'] for route_data in initial_solution], nodes)
+
+# Función para resolver una tarea (método inicial, VND, instancia), se ejecuta en un proceso trabajador
+def solve_instance(task, folder_name, instances_directory_path):
+    initial_method, apply_vnd, sheet_number = task
+    sheet_name = f'VRPTW{sheet_number}'
+    instance_filename = f'{instances_directory_path}/{sheet_name}.txt'
+
+    # Configuración de tiempo restante
+    if sheet_number >= 1 and sheet_number <= 6:
+        remaining_time = 50e3
+    elif sheet_number >= 7 and sheet_number <= 12:
+        remaining_time = 200e3
+    else:
+        remaining_time = 750e3
+
+    # Leer datos de entrada
+    n, Q, nodes = read_txt_file(instance_filename)
+    distances = distance_matrix_generator(nodes)
+    neighbors = build_granular_neighbors(nodes, distances, granular_k)
+    granular_arcs = granular_matrix(neighbors, len(distances))  # Arcos del 3-opt del VND
+
+    start_time = time.time()
+    initial_solution_path = solution_path(f'{folder_name}/constructive-results', initial_method) if initial_method not in ('humble', 'savings') else None
+
+    # Obtener la solución inicial
+    initial_solution = get_initial_solution(initial_method, nodes, Q, distances, initial_solution_path, sheet_name)
+
+    # Minimizar primero la flota, luego el Algoritmo Genético y VND si se habilitó y queda tiempo; la solución pasa en memoria
+    phases = [
+        lambda routes, time_limit, phase_start: route_minimization(
+            routes, distances, Q, route_minimization_share * time_limit, phase_start, neighbors=neighbors,
+            seed=route_minimization_seed + sheet_number),
+        lambda routes, time_limit, phase_start: genetic_algorithm(routes, distances, Q, time_limit, phase_start),
+    ]
+    if apply_vnd:
+        phases.append(lambda routes, time_limit, phase_start: vnd_algorithm(
+            routes, distances, Q, time_limit, start_time=phase_start, neighbors=neighbors, return_states=True,
+            granular_arcs=granular_arcs))
+    route_indexes, computation_time, _, route_states = run_pipeline(nodes, initial_solution, phases, remaining_time, start_time)
+    final_solution = routes_from_indexes(route_indexes, nodes)
+    if route_states is None:
+        route_states = [RouteState(route, distances, Q) for route in final_solution]  # Sin VND no hay horarios para reutilizar
+
+    return {'routes': final_solution, 'distance': calculate_total_distance_from_indexes(route_indexes, distances),
+            'time': computation_time, 'distances': distances,
+            'route_states': route_states}
+
 
 # Main execution
 if __name__ == "__main__":
-    initial_methods = ['constructive', 'GRASP', 'ACO', 'humble']
+    initial_methods = ['constructive', 'GRASP', 'ACO', 'humble', 'savings']
     vnd_options = [True, False]  # Opciones para aplicar VND
     current_method = 'GA'
     folder_name = '4-evolutionary-methods'
     instances_directory_path = 'VRPTW Instances'
     LB_file_directory = 'VRPTW Instances/LB_VRPTW.xlsx'
+    processes = None  # Procesos trabajadores para las tareas; None usa todos los núcleos y 1 corre en serie
+    save_excel = True  # El Excel es solo el destino final; con False los resultados quedan en memoria
 
     LB_K, LB_D = read_lower_bounds(LB_file_directory, 'Hoja1')
 
@@ -245,58 +305,30 @@ if __name__ == "__main__":
     D = {(method, vnd): [] for method in initial_methods for vnd in vnd_options}
     K = {(method, vnd): [] for method in initial_methods for vnd in vnd_options}
 
+    # Resolver todas las combinaciones (método, VND, instancia) en paralelo; los resultados vuelven en el orden de las tareas
+    tasks = [(method, vnd, sheet_number) for method in initial_methods for vnd in vnd_options for sheet_number in range(1, 19)]
+    results = imap_in_pool(solve_instance, tasks, processes, folder_name=folder_name,
+                           instances_directory_path=instances_directory_path)
+
     for initial_method in initial_methods:
         for apply_vnd in vnd_options:
             print(f"\nProcessing for initial method: {initial_method} with VND: {apply_vnd}")
 
             # Crear un archivo Excel para cada combinación de método y VND
             results_excel_path = f"{folder_name}/results/VRPTW_tm_{current_method}_ini_{initial_method}_VND_{apply_vnd}.xlsx"
-            wb_results = Workbook()
-            if "Sheet" in wb_results.sheetnames:
-                wb_results.remove(wb_results["Sheet"])  # Eliminar hoja inicial vacía
+            wb_results = new_result_workbook() if save_excel else None  # Write-only, sheets are streamed
 
             for sheet_number in range(1, 19):
                 sheet_name = f'VRPTW{sheet_number}'
-                instance_filename = f'{instances_directory_path}/{sheet_name}.txt'
-
-                # Configuración de tiempo restante
-                if sheet_number >= 1 and sheet_number <= 6:
-                    remaining_time = 50e3
-                elif sheet_number >= 7 and sheet_number <= 12:
-                    remaining_time = 200e3
-                else:
-                    remaining_time = 750e3
-
-                # Leer datos de entrada
-                n, Q, nodes = read_txt_file(instance_filename)
-                distances = distance_matrix_generator(nodes)
-
-                print(f" - Processing {sheet_name} with initial method: {initial_method}, VND: {apply_vnd}")
-                start_time = time.time()
-                initial_solution_path = f'{folder_name}/constructive-results/VRPTW_tm_{initial_method}.xlsx' if initial_method != 'humble' else None
-
-                # Obtener la solución inicial
-                initial_solution = get_initial_solution(initial_method, nodes, Q, distances, initial_solution_path, sheet_name)
-
-                # Ejecutar el Algoritmo Genético
-                best_solution = genetic_algorithm(initial_solution, distances, Q, remaining_time, start_time)
-
-                # Verificar si aún queda tiempo para ejecutar VND
-                elapsed_time = time.time() - start_time
-                if apply_vnd and elapsed_time < remaining_time:
-                    # Ejecutar VND si se habilitó y queda tiempo
-                    vnd_best_solution = vnd_algorithm(best_solution, distances, Q, remaining_time - elapsed_time, start_time=time.time())
-                    final_solution = vnd_best_solution
-                    computation_time = time.time() - start_time
-                else:
-                    # Usar solo la solución del GA sin VND
-                    final_solution = best_solution
-                    computation_time = elapsed_time
+                result = next(results)  # Same order as tasks, exported while the pool solves the next ones
+                final_solution = result['routes']
+                computation_time = result['time']
 
                 # Calcular el número de rutas y la distancia total
-                total_distance = calculate_total_distance(final_solution, distances)
+                total_distance = result['distance']
                 route_count = len(final_solution)
 
+                print(f" - Processing {sheet_name} with initial method: {initial_method}, VND: {apply_vnd}")
                 print(f"   - Total Distance: {total_distance}")
                 print(f"   - Number of Routes: {route_count}")
                 print(f"   - Computation Time: {computation_time:.2f} seconds")
@@ -308,20 +340,23 @@ if __name__ == "__main__":
                 K[(initial_method, apply_vnd)].append(route_count)
 
                 # Guardar la hoja en el archivo Excel de resultados
-                save_to_excel(wb_results, sheet_name, final_solution, total_distance, computation_time, distances)
+                if save_excel:
+                    save_to_excel(wb_results, sheet_name, final_solution, total_distance, computation_time, result['distances'],
+                                  route_states=result['route_states'])
 
             # Guardar el archivo Excel al final de todas las instancias
-            wb_results.save(results_excel_path)
-
-    # Crear un único archivo para los GAPs
-    wb_gaps = Workbook()
-    if "Sheet" in wb_gaps.sheetnames:
-        wb_gaps.remove(wb_gaps["Sheet"])
+            if save_excel:
+                wb_results.save(results_excel_path)
 
-    for method in initial_methods:
-        for vnd in vnd_options:
-            sheet_name = f"{method}_VND_{vnd}"
-            write_GAP_excel(wb_gaps, LB_K, K[(method, vnd)], LB_D, D[(method, vnd)], computation_times[(method, vnd)], sheet_name)
+    # Crear un único archivo para los GAPs (si no, los resultados quedan en memoria en all_18_routes, D y K)
+    if save_excel:
+        wb_gaps = Workbook()
+        if "Sheet" in wb_gaps.sheetnames:
+            wb_gaps.remove(wb_gaps["Sheet"])
 
-    wb_gaps.save(f"{folder_name}/results/GAPs_for_{current_method}_with_all_methods.xlsx")
+        for method in initial_methods:
+            for vnd in vnd_options:
+                sheet_name = f"{method}_VND_{vnd}"
+                write_GAP_excel(wb_gaps, LB_K, K[(method, vnd)], LB_D, D[(method, vnd)], computation_times[(method, vnd)], sheet_name)
 
+        wb_gaps.save(f"{folder_name}/results/GAPs_for_{current_method}_with_all_methods.xlsx")
@@ -1,6 +1,9 @@
 import time
+import numpy as np
 from distance_finder import calculate_total_distance, calculate_route_distance
-from feasibility import is_feasible
+from distance_finder import two_opt_delta, or_opt_delta, swap_delta, relocate_delta, two_opt_star_delta, is_granular_arc
+from distance_finder import three_opt_deltas, granular_matrix
+from feasibility import is_feasible, RouteState, node_segment, concatenate, is_concatenation_feasible
 
 
 def swap_between_routes(routes, times, capacity):
@@ -46,26 +49,28 @@ def swap_between_routes(routes, times, capacity):
 
 
 def or_opt_within_route_single(route, times, capacity):
-    best_route = route.copy()
-    best_distance = calculate_route_distance(best_route, times)
+    # Primer movimiento or-opt que mejora: costo en O(1) con or_opt_delta y factibilidad uniendo el prefijo, el tramo
+    # movido, el tramo que se corre y el sufijo (segmentos de RouteState); la ruta solo se construye para el movimiento aceptado
+    state = RouteState(route, times, capacity)
+    cache = {}
     n = len(route)
-    improved = False
 
     for segment_size in range(1, 4):
         for i in range(1, n - segment_size - 1):
-            segment = route[i:i+segment_size]
-            rest_route = route[:i] + route[i+segment_size:]
-
-            for j in range(1, len(rest_route)):
-                new_route = rest_route[:j] + segment + rest_route[j:]
-                if is_feasible(new_route, capacity, times):
-                    new_distance = calculate_route_distance(new_route, times)
-                    if new_distance + 1e-6 < best_distance:
-                        best_route = new_route
-                        best_distance = new_distance
-                        improved = True
-                        return best_route, best_distance, improved  # Salir inmediatamente
-    return best_route, best_distance, improved
+            end = i + segment_size - 1
+            for j in range(1, n - segment_size):
+                if or_opt_delta(route, i, segment_size, j, times) >= -1e-6:
+                    continue
+                moved = cached_segment(cache, route, i, end, times)
+                if j < i:
+                    segments = [state.prefix(j - 1), moved, cached_segment(cache, route, j, i - 1, times), state.suffix(end + 1)]
+                else:
+                    segments = [state.prefix(i - 1), cached_segment(cache, route, end + 1, j + segment_size - 1, times), moved, state.suffix(j + segment_size)]
+                if is_concatenation_feasible(segments, times, capacity):
+                    rest_route = route[:i] + route[i + segment_size:]
+                    best_route = rest_route[:j] + route[i:end + 1] + rest_route[j:]
+                    return best_route, calculate_route_distance(best_route, times), True  # Salir inmediatamente
+    return route.copy(), calculate_route_distance(route, times), False
 
 
 def relocate_between_routes(routes, times, capacity):
@@ -137,57 +142,117 @@ def two_opt_within_route(routes, times, capacity):
     return new_routes  # Si no se encontraron mejoras
 
 def two_opt_within_route_single(route, times, capacity):
-    best_route = route.copy()
-    best_distance = calculate_route_distance(best_route, times)
-    n = len(route)
-    improved = False
-
-    for i in range(1, n - 2):
-        for j in range(i + 1, n - 1):
-            new_route = route[:i] + route[i:j+1][::-1] + route[j+1:]
-            if is_feasible(new_route, capacity, times):
-                new_distance = calculate_route_distance(new_route, times)
-                if new_distance + 1e-6 < best_distance:
-                    best_route = new_route
-                    best_distance = new_distance
-                    improved = True
-    return best_route, best_distance, improved
-
-def two_opt_across_routes(routes, times, capacity):
-    best_routes = [route.copy() for route in routes]
-    best_distance = calculate_total_distance(best_routes, times)
-    improved = False
+    # Mejor 2-opt de la ruta: costo en O(1) con two_opt_delta y factibilidad uniendo el prefijo, el tramo invertido y el
+    # sufijo (segmentos de RouteState); la ruta solo se construye para el movimiento elegido
+    state = RouteState(route, times, capacity)
+    cache = {}
+    best_move, best_delta = None, 0.0
+
+    for i in range(1, len(route) - 2):
+        for j in range(i + 1, len(route) - 1):
+            delta = two_opt_delta(route, i, j, times)
+            if delta + 1e-6 < best_delta:
+                reversed_segment = cached_segment(cache, route, i, j, times, reverse=True)
+                if is_concatenation_feasible([state.prefix(i - 1), reversed_segment, state.suffix(j + 1)], times, capacity):
+                    best_move, best_delta = (i, j), delta
+    if best_move is None:
+        return route.copy(), calculate_route_distance(route, times), False
+    i, j = best_move
+    best_route = route[:i] + route[i:j+1][::-1] + route[j+1:]
+    return best_route, calculate_route_distance(best_route, times), True
+
+def three_opt_within_route_single(route, times, capacity, allowed=None):
+    # Mejor movimiento 3-opt de la ruta: costo con seis distancias y factibilidad con segmentos (sin construir candidatos)
+    move = find_three_opt_move(route, times, capacity, allowed)
+    if move is None:
+        return route.copy(), calculate_route_distance(route, times), False
+    best_route = apply_three_opt(route, *move)
+    return best_route, calculate_route_distance(best_route, times), True
+
+# Segmento que recorre route[p..q] (route[q..p] si reverse); cada fila del cache se extiende nodo a nodo solo cuando hace falta
+def cached_segment(cache, route, p, q, times, reverse=False):
+    row = cache.setdefault((p, reverse), [node_segment(route[p])])
+    while len(row) <= q - p:
+        node = node_segment(route[p + len(row)])
+        row.append(concatenate(node, row[-1], times) if reverse else concatenate(row[-1], node, times))
+    return row[q - p]
+
+def find_three_opt_move(route, times, capacity, allowed=None, reversals=True, improvement='best'):
+    """
+    Mejor (o primer) movimiento 3-opt que mejora la ruta como (i, j, k, reconexión), None si no hay ninguno.
+    El costo de cada reconexión sale de sus seis distancias extremas (three_opt_deltas, todos los (j, k) de un i a la vez);
+    las ventanas de tiempo solo se revisan para movimientos que mejoran, uniendo el prefijo, los segmentos B y C (directos
+    o invertidos) y el sufijo. allowed es la granular_matrix de la instancia (construida una vez junto a los vecinos): al
+    menos uno de los arcos nuevos debe ser granular, como en los movimientos entre rutas. reversals=False deja solo or-opt.
+    """
+    indexes = [node.index for node in route]
+    reconnections = np.array([0, 1, 2, 3] if reversals else [1])
+    moves = []  # Arreglos (delta, i, j, k, reconexión) de los movimientos que mejoran, uno por i
+    for i in range(1, len(route) - 2):
+        deltas = three_opt_deltas(indexes, i, times, allowed)[reconnections]
+        r, j, k = np.nonzero(deltas < -1e-6)
+        moves.append((deltas[r, j, k], np.full(len(r), i), i + j, i + 1 + k, reconnections[r]))
+    deltas, first, second, third, reconnection = (np.concatenate(column) for column in zip(*moves)) if moves else ([],) * 5
+    if len(deltas) == 0:
+        return None
+    order = np.argsort(deltas, kind='stable') if improvement == 'best' else range(len(deltas))
+
+    state = RouteState(route, times, capacity)
+    cache = {}
+    for move in order:
+        i, j, k, r = int(first[move]), int(second[move]), int(third[move]), int(reconnection[move])
+        b = cached_segment(cache, route, i, j, times, reverse=r in (0, 2))
+        c = cached_segment(cache, route, j + 1, k, times, reverse=r in (0, 3))
+        middle = (b, c) if r == 0 else (c, b)
+        if is_concatenation_feasible([state.prefix(i - 1), *middle, state.suffix(k + 1)], times, capacity):
+            return i, j, k, r
+    return None
+
+def apply_three_opt(route, i, j, k, reconnection):
+    a, b, c, d = route[:i], route[i:j+1], route[j+1:k+1], route[k+1:]
+    middle = (b[::-1] + c[::-1], c + b, c + b[::-1], c[::-1] + b)[reconnection]
+    return a + middle + d
+
+# Movimientos entre rutas: cada vecindario devuelve (move, delta) con el mejor movimiento como tupla compacta
+# (None si ninguno mejora) y apply_move lo aplica sobre la solución. La factibilidad se revisa uniendo segmentos de
+# RouteState (prefijos, sufijos y secuencias movidas), así que los candidatos rechazados no crean listas de rutas.
+#   ('two_opt_star', i, idx1, j, idx2): intercambia las colas routes[i][idx1:] y routes[j][idx2:]
+#   ('swap', i, idx1, j, idx2): intercambia routes[i][idx1] y routes[j][idx2]
+#   ('relocate', i, start, length, j, k): mueve routes[i][start:start+length] delante de routes[j][k]
+
+def two_opt_across_routes(routes, times, capacity, neighbors=None, active_routes=None, states=None):
+    states = states if states is not None else [RouteState(route, times, capacity) for route in routes]
+    best_move, best_delta = None, 0.0
 
     for i in range(len(routes)):
         for j in range(i + 1, len(routes)):
+            if active_routes is not None and i not in active_routes and j not in active_routes:
+                continue  # Par ya revisado sin mejora y sin cambios desde entonces
             route1 = routes[i]
             route2 = routes[j]
 
             for idx1 in range(1, len(route1) - 1):
                 for idx2 in range(1, len(route2) - 1):
-                    new_route1 = route1[:idx1] + route2[idx2:]
-                    new_route2 = route2[:idx2] + route1[idx1:]
-
-                    if (is_feasible(new_route1, capacity, times) and
-                        is_feasible(new_route2, capacity, times)):
-                        temp_routes = routes.copy()
-                        temp_routes[i] = new_route1
-                        temp_routes[j] = new_route2
-                        temp_distance = calculate_total_distance(temp_routes, times)
-                        if temp_distance + 1e-6 < best_distance:
-                            best_routes = temp_routes
-                            best_distance = temp_distance
-                            improved = True
-    return best_routes, best_distance, improved
-
-
-def swap_between_routes_best(routes, times, capacity):
-    best_routes = [route.copy() for route in routes]
-    best_distance = calculate_total_distance(best_routes, times)
-    improved = False
+                    # Con vecindario granular solo se evalúan movimientos que crean algún arco de la lista
+                    if not (is_granular_arc(neighbors, route1[idx1 - 1].index, route2[idx2].index) or
+                            is_granular_arc(neighbors, route2[idx2 - 1].index, route1[idx1].index)):
+                        continue
+                    delta = two_opt_star_delta(route1, idx1, route2, idx2, times)
+                    if delta + 1e-6 < best_delta:
+                        if (is_concatenation_feasible([states[i].prefix(idx1 - 1), states[j].suffix(idx2)], times, capacity) and
+                                is_concatenation_feasible([states[j].prefix(idx2 - 1), states[i].suffix(idx1)], times, capacity)):
+                            best_move, best_delta = ('two_opt_star', i, idx1, j, idx2), delta
+    return best_move, best_delta
+
+
+def swap_between_routes_best(routes, times, capacity, neighbors=None, active_routes=None, states=None):
+    states = states if states is not None else [RouteState(route, times, capacity) for route in routes]
+    best_move, best_delta = None, 0.0
 
     for i in range(len(routes)):
         for j in range(i + 1, len(routes)):
+            if active_routes is not None and i not in active_routes and j not in active_routes:
+                continue  # Par ya revisado sin mejora y sin cambios desde entonces
             route1 = routes[i]
             route2 = routes[j]
 
@@ -196,81 +261,169 @@ def swap_between_routes_best(routes, times, capacity):
 
             for idx1, cust1 in enumerate(customers1):
                 for idx2, cust2 in enumerate(customers2):
-                    temp_route1 = route1.copy()
-                    temp_route2 = route2.copy()
-
-                    temp_route1[idx1 + 1] = cust2
-                    temp_route2[idx2 + 1] = cust1
-
-                    if (is_feasible(temp_route1, capacity, times) and
-                        is_feasible(temp_route2, capacity, times)):
-                        temp_routes = routes.copy()
-                        temp_routes[i] = temp_route1
-                        temp_routes[j] = temp_route2
-                        temp_distance = calculate_total_distance(temp_routes, times)
-                        if temp_distance + 1e-6 < best_distance:
-                            best_routes = temp_routes
-                            best_distance = temp_distance
-                            improved = True
-    return best_routes, best_distance, improved
-
-def relocate_between_routes_best(routes, times, capacity):
+                    if not (is_granular_arc(neighbors, route1[idx1].index, cust2.index) or
+                            is_granular_arc(neighbors, cust2.index, route1[idx1 + 2].index) or
+                            is_granular_arc(neighbors, route2[idx2].index, cust1.index) or
+                            is_granular_arc(neighbors, cust1.index, route2[idx2 + 2].index)):
+                        continue
+                    delta = swap_delta(route1, idx1 + 1, route2, idx2 + 1, times)
+                    if delta + 1e-6 < best_delta:
+                        # Cada cliente ocupa el lugar del otro (+1 por el depósito al inicio)
+                        if (is_concatenation_feasible([states[i].prefix(idx1), node_segment(cust2), states[i].suffix(idx1 + 2)], times, capacity) and
+                                is_concatenation_feasible([states[j].prefix(idx2), node_segment(cust1), states[j].suffix(idx2 + 2)], times, capacity)):
+                            best_move, best_delta = ('swap', i, idx1 + 1, j, idx2 + 1), delta
+    return best_move, best_delta
+
+def relocate_between_routes_best(routes, times, capacity, neighbors=None, active_routes=None, states=None, max_segment_length=3):
     """
-    Función mejorada para reubicar clientes entre rutas de manera más agresiva.
-    Intenta mover secuencias de clientes de una ruta a otra.
+    Reubicar secuencias de hasta max_segment_length clientes de una ruta a otra (or-opt entre rutas), o todos los
+    clientes de la ruta juntos.
+    Con vecindario granular solo se recorren las posiciones donde la secuencia crea algún arco de la lista.
+    active_routes: índices de rutas; solo se revisan pares con alguna de ellas (None revisa todos).
     """
-    best_routes = [route.copy() for route in routes]
-    best_distance = calculate_total_distance(best_routes, times)
-    improved = False
+    states = states if states is not None else [RouteState(route, times, capacity) for route in routes]
+    best_move, best_delta = None, 0.0
+    position = {route[k].index: (r, k) for r, route in enumerate(routes) for k in range(1, len(route) - 1)}
+    predecessors = granular_predecessors(neighbors) if neighbors is not None else None
+
+    for i, route_from in enumerate(routes):
+        cache = {}  # Secuencias de la ruta origen (cached_segment)
+        customers_from = route_from[1:-1]
+
+        # Secuencias cortas y, además, la ruta completa (vaciarla en otra ruta reduce la flota)
+        lengths = list(range(1, min(max_segment_length, len(customers_from)) + 1))
+        if len(customers_from) > max_segment_length:
+            lengths.append(len(customers_from))
+        for seq_length in lengths:
+            for start in range(1, len(customers_from) - seq_length + 2):
+                from_feasible = None  # Se revisa solo cuando algún destino mejora
+                first = route_from[start].index
+                last = route_from[start + seq_length - 1].index
+
+                for j, k in insertion_positions(routes, i, first, last, neighbors, predecessors, position):
+                    if active_routes is not None and i not in active_routes and j not in active_routes:
+                        continue  # Par ya revisado sin mejora y sin cambios desde entonces
+                    delta = relocate_delta(route_from, start, seq_length, routes[j], k, times)
+                    if delta + 1e-6 >= best_delta:
+                        continue
 
-    for i in range(len(routes)):
-        for j in range(len(routes)):
-            if i == j:
-                continue
+                    if from_feasible is None:
+                        from_feasible = is_concatenation_feasible(
+                            [states[i].prefix(start - 1), states[i].suffix(start + seq_length)], times, capacity)
+                    if not from_feasible:
+                        break  # Quitar la secuencia ya hace infactible la ruta origen
+
+                    segment = cached_segment(cache, route_from, start, start + seq_length - 1, times)
+                    if is_concatenation_feasible([states[j].prefix(k - 1), segment, states[j].suffix(k)], times, capacity):
+                        best_move, best_delta = ('relocate', i, start, seq_length, j, k), delta
+    return best_move, best_delta
+
+
+# Listas inversas del vecindario granular: predecessors[b] tiene los nodos a con b en neighbors[a]
+def granular_predecessors(neighbors):
+    predecessors = [[] for _ in neighbors]
+    for a in range(1, len(neighbors)):
+        for b in neighbors[a]:
+            predecessors[b].append(a)
+    return predecessors
+
+
+# Posiciones (ruta, k) donde insertar delante de routes[j][k] una secuencia first..last de la ruta i: todas sin
+# vecindario granular; con él, las que crean un arco granular (a -> first o last -> b) o tocan el depósito. Los
+# vecinos que no están en ninguna ruta se ignoran
+def insertion_positions(routes, i, first, last, neighbors, predecessors, position):
+    if neighbors is None:
+        return [(j, k) for j in range(len(routes)) if j != i for k in range(1, len(routes[j]))]
+    candidates = set()
+    for j in range(len(routes)):
+        if j != i:
+            candidates.add((j, 1))                      # Depósito -> first
+            candidates.add((j, len(routes[j]) - 1))     # last -> depósito
+    for a in predecessors[first]:
+        entry = position.get(a)                     # None si a no está en ninguna ruta (solución parcial)
+        if entry is not None and entry[0] != i:
+            candidates.add((entry[0], entry[1] + 1))
+    for b in neighbors[last]:
+        entry = position.get(b)
+        if entry is not None and entry[0] != i:
+            candidates.add(entry)
+    return sorted(candidates)
+
+
+# Aplicar un movimiento entre rutas sobre la solución: solo se crean las dos rutas modificadas y se actualizan sus
+# estados; una ruta que queda sin clientes se elimina
+def apply_move(routes, move, times, capacity, states=None):
+    kind = move[0]
+    if kind == 'two_opt_star':
+        _, i, idx1, j, idx2 = move
+        routes[i], routes[j] = routes[i][:idx1] + routes[j][idx2:], routes[j][:idx2] + routes[i][idx1:]
+    elif kind == 'swap':
+        _, i, idx1, j, idx2 = move
+        route1, route2 = routes[i].copy(), routes[j].copy()
+        route1[idx1], route2[idx2] = routes[j][idx2], routes[i][idx1]
+        routes[i], routes[j] = route1, route2
+    elif kind == 'relocate':
+        _, i, start, length, j, k = move
+        segment = routes[i][start:start + length]
+        routes[i], routes[j] = routes[i][:start] + routes[i][start + length:], routes[j][:k] + segment + routes[j][k:]
+    else:
+        raise ValueError(f"Unknown move '{kind}'")
+    if states is not None:
+        states[i] = RouteState(routes[i], times, capacity)
+        states[j] = RouteState(routes[j], times, capacity)
+    for r in sorted((i, j), reverse=True):
+        if len(routes[r]) <= 2:
+            del routes[r]
+            if states is not None:
+                del states[r]
+    return routes
 
-            route_from = routes[i]
-            route_to = routes[j]
 
-            customers_from = route_from[1:-1]
+# Índices de las dos rutas que cambia un movimiento
+def move_routes(move):
+    return (move[1], move[4]) if move[0] == 'relocate' else (move[1], move[3])
 
-            # Intentar mover secuencias de diferentes tamaños
-            for seq_length in range(1, len(customers_from) + 1):
-                for idx_cust in range(len(customers_from) - seq_length + 1):
-                    segment = customers_from[idx_cust:idx_cust + seq_length]
 
-                    temp_route_from = route_from[:idx_cust + 1] + route_from[idx_cust + seq_length + 1:]
-                    if not is_feasible(temp_route_from, capacity, times):
-                        continue
+# Identificador de una ruta por su contenido (las rutas se reemplazan por copias, no se modifican)
+def route_key(route):
+    return tuple(node.index for node in route)
+
+# Sacar de todos los conjuntos limpios las rutas que un movimiento va a cambiar: una ruta que vuelve a un contenido
+# anterior no puede quedar limpia, porque sus pares con las demás rutas ya no son los que se revisaron
+def forget_routes(clean, routes):
+    for route in routes:
+        key = route_key(route)
+        for clean_routes in clean.values():
+            clean_routes.discard(key)
 
-                    for k in range(1, len(route_to)):
-                        temp_route_to = route_to[:k] + segment + route_to[k:]
-                        if is_feasible(temp_route_to, capacity, times):
-                            temp_routes = routes.copy()
-                            temp_routes[i] = temp_route_from
-                            temp_routes[j] = temp_route_to
-                            temp_distance = calculate_total_distance(temp_routes, times)
-                            if temp_distance + 1e-6 < best_distance:
-                                best_routes = temp_routes
-                                best_distance = temp_distance
-                                improved = True
-    return best_routes, best_distance, improved
-
-
-def vnd_algorithm(routes, times, capacity, time_limit, start_time):
+def vnd_algorithm(routes, times, capacity, time_limit, start_time, neighbors=None, return_states=False, granular_arcs=None):
     """
     Algoritmo VND con criterio de parada basado en tiempo.
+    neighbors: vecindario granular (build_granular_neighbors) para los movimientos entre rutas, None para explorarlos todos.
+    granular_arcs: granular_matrix de neighbors para el 3-opt (se construye aquí si no se da).
+    return_states: devolver también los RouteState de las rutas finales (los que mantuvo la búsqueda), para exportarlas
+    sin volver a simular los horarios.
+    Cada vecindario guarda las rutas "limpias" (revisadas sin mejora, identificadas por su secuencia de clientes): solo
+    se vuelven a revisar las rutas que cambió un movimiento aceptado y, entre rutas, los pares con alguna ruta sucia.
+    Una ruta que cambia sale de todos los conjuntos, así que estos solo contienen rutas actuales.
     """
-    best_routes = [route.copy() for route in routes]
+    best_routes = list(routes)  # Las rutas modificadas se reemplazan por listas nuevas, las originales no cambian
     best_distance = calculate_total_distance(best_routes, times)
+    states = [RouteState(route, times, capacity) for route in best_routes]  # Horarios y cargas de cada ruta
+    if granular_arcs is None and neighbors is not None:
+        granular_arcs = granular_matrix(neighbors, len(times))
     neighborhoods = [
         two_opt_within_route_single,
         or_opt_within_route_single,
+        three_opt_within_route_single,
         swap_between_routes_best,
         relocate_between_routes_best,
         two_opt_across_routes,
         merge_routes
     ]
 
+    clean = {neighborhood: set() for neighborhood in neighborhoods}  # Rutas sin movimientos que mejoren, por vecindario
+
     neighborhood_index = 0
 
     while neighborhood_index < len(neighborhoods):
@@ -283,13 +436,21 @@ def vnd_algorithm(routes, times, capacity, time_limit, start_time):
         neighborhood = neighborhoods[neighborhood_index]
         improved = False
 
-        if neighborhood in [two_opt_within_route_single, or_opt_within_route_single]:
+        if neighborhood in [two_opt_within_route_single, or_opt_within_route_single, three_opt_within_route_single]:
             # Aplicar movimientos dentro de rutas individuales
             for idx, route in enumerate(best_routes):
-                new_route, new_distance, route_improved = neighborhood(route, times, capacity)
-                if route_improved and new_distance + 1e-6 < calculate_route_distance(best_routes[idx], times):
+                if route_key(route) in clean[neighborhood]:
+                    continue  # La ruta no cambió desde que se revisó sin mejora
+                if neighborhood == three_opt_within_route_single:
+                    new_route, new_distance, route_improved = neighborhood(route, times, capacity, granular_arcs)
+                else:
+                    new_route, new_distance, route_improved = neighborhood(route, times, capacity)
+                route_distance = calculate_route_distance(route, times)
+                if route_improved and new_distance + 1e-6 < route_distance:
+                    forget_routes(clean, [route])
                     best_routes[idx] = new_route
-                    best_distance = calculate_total_distance(best_routes, times)
+                    states[idx] = RouteState(new_route, times, capacity)
+                    best_distance += new_distance - route_distance
                     improved = True
 
                     # Verificar el tiempo después de cada mejora
@@ -297,19 +458,37 @@ def vnd_algorithm(routes, times, capacity, time_limit, start_time):
                     elapsed_time = current_time - start_time
                     if elapsed_time >= time_limit:
                         break
+                else:
+                    clean[neighborhood].add(route_key(route))
             if elapsed_time >= time_limit:
                 break
         else:
+            active_routes = {idx for idx, route in enumerate(best_routes) if route_key(route) not in clean[neighborhood]}
+            if not active_routes:
+                # Todos los pares se revisaron sin mejora y ninguna ruta cambió desde entonces
+                neighborhood_index += 1
+                continue
             if neighborhood == merge_routes:
                 new_routes = neighborhood(best_routes, times, capacity)
                 new_distance = calculate_total_distance(new_routes, times)
                 neighborhood_improved = (len(new_routes) < len(best_routes) or new_distance + 1e-6 < best_distance)
+                if neighborhood_improved:
+                    new_keys = {route_key(route) for route in new_routes}
+                    forget_routes(clean, [route for route in best_routes if route_key(route) not in new_keys])
+                    best_routes = list(new_routes)
+                    best_distance = new_distance
+                    states = [RouteState(route, times, capacity) for route in best_routes]
+            else:
+                move, delta = neighborhood(best_routes, times, capacity, neighbors, active_routes, states)
+                neighborhood_improved = move is not None
+                if neighborhood_improved:
+                    forget_routes(clean, [best_routes[r] for r in move_routes(move)])
+                    apply_move(best_routes, move, times, capacity, states)  # Solo cambian las dos rutas del movimiento
+                    best_distance += delta
+
+            if not neighborhood_improved:
+                clean[neighborhood].update(route_key(route) for route in best_routes)
             else:
-                new_routes, new_distance, neighborhood_improved = neighborhood(best_routes, times, capacity)
-
-            if neighborhood_improved and (new_distance + 1e-6 < best_distance or len(new_routes) < len(best_routes)):
-                best_routes = [route.copy() for route in new_routes]
-                best_distance = new_distance
                 improved = True
 
                 # Verificar el tiempo después de cada mejora
@@ -325,6 +504,8 @@ def vnd_algorithm(routes, times, capacity, time_limit, start_time):
             # Pasar al siguiente vecindario
             neighborhood_index += 1
 
+    if return_states:
+        return best_routes, states
     return best_routes
 
 